@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ChatRoom, RoomMembership, Message, MessageReadStatus, TypingIndicator
+from .models import ChatRoom, RoomMembership, Message, MessageReadStatus, TypingIndicator, MediaUpload, ImageDerivative, RoomEvent, PresenceNode
 
 
 @admin.register(ChatRoom)
@@ -8,7 +8,7 @@ class ChatRoomAdmin(admin.ModelAdmin):
     list_filter = ('room_type', 'created_at', 'updated_at')
     search_fields = ('name', 'id', 'created_by__username')
     date_hierarchy = 'created_at'
-    readonly_fields = ('id', 'created_at', 'updated_at')
+    readonly_fields = ('id', 'last_seq', 'created_at', 'updated_at')
     
     def get_queryset(self, request):
         return super().get_queryset(request).prefetch_related('members', 'created_by')
@@ -16,17 +16,17 @@ class ChatRoomAdmin(admin.ModelAdmin):
 
 @admin.register(RoomMembership)
 class RoomMembershipAdmin(admin.ModelAdmin):
-    list_display = ('user', 'room', 'role', 'is_online', 'last_seen', 'joined_at', 'unread_count')
+    list_display = ('user', 'room', 'role', 'is_online', 'presence_node', 'last_seen', 'joined_at', 'unread_count')
     list_filter = ('role', 'is_online', 'joined_at')
     search_fields = ('user__username', 'room__name', 'room__id')
     date_hierarchy = 'joined_at'
-    readonly_fields = ('joined_at',)
+    readonly_fields = ('joined_at', 'presence_node')
 
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ('id', 'room', 'sender', 'message_type', 'content_preview', 'created_at', 'is_edited')
-    list_filter = ('message_type', 'is_edited', 'created_at')
+    list_filter = ('message_type', 'is_edited', 'deleted_at', 'created_at')
     search_fields = ('content', 'sender__username', 'room__name', 'id')
     date_hierarchy = 'created_at'
     readonly_fields = ('id', 'created_at', 'updated_at')
@@ -53,3 +53,33 @@ class TypingIndicatorAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'room__name', 'room__id')
     date_hierarchy = 'started_at'
     readonly_fields = ('started_at',)
+
+
+@admin.register(MediaUpload)
+class MediaUploadAdmin(admin.ModelAdmin):
+    list_display = ('id', 'room', 'user', 'media_type', 'filename', 'received', 'total_size', 'status', 'created_at')
+    list_filter = ('media_type', 'status', 'created_at')
+    search_fields = ('id', 'filename', 'user__username', 'room__id')
+    readonly_fields = ('id', 'created_at', 'updated_at')
+
+
+@admin.register(ImageDerivative)
+class ImageDerivativeAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'status', 'width', 'height', 'created_at', 'updated_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('sha256', 'source')
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(RoomEvent)
+class RoomEventAdmin(admin.ModelAdmin):
+    list_display = ('room', 'seq', 'created_at')
+    search_fields = ('room__id',)
+    readonly_fields = ('room', 'seq', 'payload', 'created_at')
+
+
+@admin.register(PresenceNode)
+class PresenceNodeAdmin(admin.ModelAdmin):
+    list_display = ('hostname', 'pid', 'id', 'started_at', 'heartbeat_at')
+    search_fields = ('hostname', 'id')
+    readonly_fields = ('id', 'hostname', 'pid', 'started_at', 'heartbeat_at')
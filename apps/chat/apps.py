@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.chat'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+        from .instrumentation import add_frame_listener, install_query_observer
+        from .metrics import observe_frame
+        from .profiles import user_changed
+
+        connection_created.connect(install_query_observer, dispatch_uid='chat_query_observer')
+        add_frame_listener(observe_frame)
+        post_save.connect(user_changed, sender=User, dispatch_uid='chat_profile_saved')
+        post_delete.connect(user_changed, sender=User, dispatch_uid='chat_profile_deleted')
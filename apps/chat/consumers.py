@@ -1,27 +1,71 @@
 import json
+import sys
+import time
+import uuid
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from django.conf import settings
 from django.utils import timezone
+from .events import events_since, publish_event, recent_events
+from .groups import broadcast_to_room, room_group_name, user_group_name
+from .instrumentation import instrumented_sync_to_async, track_frame
+from .metrics import CONNECTS, DISCONNECTS, IDLE_CLOSES, OPEN_CONNECTIONS, REJECTIONS
 from .models import ChatRoom, RoomMembership, Message, TypingIndicator, MessageReadStatus
-from .serializers import MessageSerializer, UserSerializer
+from .presence import RECONNECT_CLOSE_CODE, local_node
+from .serializers import MessageSerializer
 from apps.subscription.models import Subscription
 from django.contrib.auth.models import User
 from django.db import models
 
+
+# Frame types a client may send; anything else is tracked as 'unknown'
+FRAME_TYPES = (
+    'chat_message', 'typing_start', 'typing_stop',
+    'message_read', 'delete_message', 'edit_message',
+)
+
+
+# Closes a socket that sent nothing, not even a ping, for CHAT_IDLE_TIMEOUT (cf. HTTP 408)
+IDLE_CLOSE_CODE = 4408
+# Answer to the {"type": "ping"} heartbeat, which skips the database and frame instrumentation
+PONG_FRAME = json.dumps({'type': 'pong'})
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
+    # Joined explicitly; shared rather than the empty list channels gives each instance
+    groups = ()
+
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
-        self.room_group_name = f'chat_{self.room_id}'
+        self.room_group_name = room_group_name(self.room_id)
         self.user = self.scope['user']
-        
+        self.user_group_name = user_group_name(self.user.id)
+        # Sequence number of the last room event sent on this socket
+        self.last_seq = 0
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            self.resume_from = int(query['last_seq'][0])
+        except (KeyError, ValueError):
+            self.resume_from = None
+
+        with track_frame('connect', room_id=self.room_id, user_id=self.user.id):
+            await self.join_room()
+
+    async def join_room(self):
+        if local_node.draining:
+            await self.refuse_draining()
+            return
+
         # Check if user is authenticated
         if not self.user.is_authenticated:
+            REJECTIONS.inc('unauthenticated')
             await self.close()
             return
         
         # Check if user is member of the room
         is_member = await self.check_room_membership()
         if not is_member:
+            REJECTIONS.inc('not_member')
             await self.close()
             return
         
@@ -30,66 +74,153 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        await self.channel_layer.group_add(
+            self.user_group_name,
+            self.channel_name
+        )
         
         await self.accept()
+        self.accepted = True
+        CONNECTS.inc()
+        OPEN_CONNECTIONS.inc()
+        await local_node.join(self)
+        if local_node.draining:
+            # Started draining while this socket connected
+            await self.reconnect_later()
+            return
         
         # Mark user as online
         await self.update_online_status(True)
         
         # Broadcast user joined
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_status',
-                'user_id': self.user.id,
-                'username': self.user.username,
-                'is_online': True,
-                'online_count': await self.get_online_count()
-            }
-        )
+        await self.broadcast({
+            'type': 'user_status',
+            'user_id': self.user.id,
+            'username': self.user.username,
+            'is_online': True,
+            'online_count': await self.get_online_count()
+        })
+
+        if self.resume_from is not None:
+            await self.resume(self.resume_from)
+
+    async def resume(self, last_seq):
+        # Already in the room group: live events from here on are deduplicated by seq
+        current, events = await self.get_events_since(last_seq)
+        if events is None:
+            self.last_seq = current
+            await self.send(text_data=json.dumps({
+                'type': 'resync',
+                'seq': current
+            }))
+            return
+        self.last_seq = last_seq
+        for event in events:
+            await getattr(self, event['type'])(event)
     
+    async def refuse_draining(self):
+        # Accepted only to tell the client where it stands: a plain rejection reads as a failed handshake
+        REJECTIONS.inc('draining')
+        await self.accept()
+        await self.reconnect_later()
+
+    async def reconnect_later(self):
+        # The process is draining: come back after a random delay, on another worker
+        await self.send(text_data=json.dumps({
+            'type': 'reconnect',
+            'retry_after_ms': local_node.retry_after_ms()
+        }))
+        await self.close(code=RECONNECT_CLOSE_CODE)
+
+    async def close_idle(self):
+        IDLE_CLOSES.inc()
+        await self.close(code=IDLE_CLOSE_CODE)
+
+    def presence_rooms(self):
+        # Rooms this socket holds the user online in
+        return [self.room_id]
+
     async def disconnect(self, close_code):
+        if getattr(self, 'accepted', False):
+            DISCONNECTS.inc()
+            OPEN_CONNECTIONS.dec()
+            local_node.leave(self)
+
         if hasattr(self, 'room_group_name'):
-            # Mark user as offline
-            await self.update_online_status(False)
-            
-            # Remove typing indicator
-            await self.remove_typing_indicator()
-            
-            # Leave room group
-            await self.channel_layer.group_discard(
-                self.room_group_name,
-                self.channel_name
-            )
-            
-            # Broadcast user left
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_status',
-                    'user_id': self.user.id,
-                    'username': self.user.username,
-                    'is_online': False,
-                    'online_count': await self.get_online_count()
-                }
-            )
+            with track_frame('disconnect', room_id=self.room_id, user_id=self.user.id):
+                if local_node.draining:
+                    # The drain marked the whole node offline in bulk
+                    await self.discard_groups()
+                else:
+                    await self.leave_room()
+
+    async def leave_room(self):
+        # Mark user as offline
+        await self.update_online_status(False)
+        
+        # Remove typing indicator
+        await self.remove_typing_indicator()
+        
+        # Leave room group
+        await self.discard_groups()
+        
+        # Broadcast user left
+        await self.broadcast({
+            'type': 'user_status',
+            'user_id': self.user.id,
+            'username': self.user.username,
+            'is_online': False,
+            'online_count': await self.get_online_count()
+        })
     
+    async def discard_groups(self):
+        await self.channel_layer.group_discard(
+            self.room_group_name,
+            self.channel_name
+        )
+        await self.channel_layer.group_discard(
+            self.user_group_name,
+            self.channel_name
+        )
+
+    async def broadcast(self, event):
+        await broadcast_to_room(self.room_id, event, self.channel_layer)
+
+    async def publish(self, event):
+        # Events clients may need to replay after a reconnect carry the room's next seq
+        await self.broadcast(await self.sequence_event(event))
+
+    async def send_event(self, frame, event):
+        seq = event.get('seq')
+        if seq is not None:
+            if seq <= self.last_seq:
+                return
+            self.last_seq = frame['seq'] = seq
+            recent_events.append(self.room_id, event)
+        await self.send(text_data=json.dumps(frame))
+
     async def receive(self, text_data):
-        # Check if the user is subscribed
-        subscription = await database_sync_to_async(Subscription.objects.filter(user=self.user, is_active=True).first)()
-        if not subscription:
-            # Check if user has sent 10 messages in total (this is free tier limit). After that, require subscription.
-            message_count = await database_sync_to_async(Message.objects.filter(sender=self.user).count)()
-            if message_count >= 10:
-                await self.send(text_data=json.dumps({
-                    "type": "error",
-                    "message": "You are not subscribed. Please subscribe to send more messages as you've hit the free tier limit."
-                }))
-                return  # Exit early if not subscribed
-    
+        # Any frame pushes back the idle deadline kept by apps.chat.timers
+        self.last_active = time.monotonic()
         data = json.loads(text_data)
         message_type = data.get('type')
-        
+        if message_type == 'ping':
+            await self.send(text_data=PONG_FRAME)
+            return
+
+        frame_type = message_type if message_type in FRAME_TYPES else 'unknown'
+        with track_frame(frame_type, room_id=self.room_id, user_id=self.user.id):
+            await self.handle_frame(message_type, data)
+
+    async def handle_frame(self, message_type, data):
+        # Check if the user is subscribed (or still within the free tier limit)
+        if not await self.can_send_messages():
+            await self.send(text_data=json.dumps({
+                "type": "error",
+                "message": "You are not subscribed. Please subscribe to send more messages as you've hit the free tier limit."
+            }))
+            return  # Exit early if not subscribed
+
         if message_type == 'chat_message':
             await self.handle_chat_message(data)
         elif message_type == 'typing_start':
@@ -115,54 +246,42 @@ class ChatConsumer(AsyncWebsocketConsumer):
             message_data = await self.serialize_message(message)
             
             # Send message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message_data
-                }
-            )
+            await self.publish({
+                'type': 'chat_message',
+                'message': message_data
+            })
     
     async def handle_typing_start(self):
         await self.add_typing_indicator()
         
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'typing_indicator',
-                'user_id': self.user.id,
-                'username': self.user.username,
-                'is_typing': True
-            }
-        )
+        await self.broadcast({
+            'type': 'typing_indicator',
+            'user_id': self.user.id,
+            'username': self.user.username,
+            'is_typing': True
+        })
     
     async def handle_typing_stop(self):
         await self.remove_typing_indicator()
         
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'typing_indicator',
-                'user_id': self.user.id,
-                'username': self.user.username,
-                'is_typing': False
-            }
-        )
+        await self.broadcast({
+            'type': 'typing_indicator',
+            'user_id': self.user.id,
+            'username': self.user.username,
+            'is_typing': False
+        })
     
     async def handle_message_read(self, data):
         message_id = data.get('message_id')
         if message_id:
             await self.mark_message_as_read(message_id)
             
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'message_read_status',
-                    'message_id': message_id,
-                    'user_id': self.user.id,
-                    'username': self.user.username
-                }
-            )
+            await self.publish({
+                'type': 'message_read_status',
+                'message_id': message_id,
+                'user_id': self.user.id,
+                'username': self.user.username
+            })
     
     async def handle_delete_message(self, data):
         message_id = data.get('message_id')
@@ -170,13 +289,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
             deleted = await self.delete_message(message_id)
             
             if deleted:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'message_deleted',
-                        'message_id': message_id
-                    }
-                )
+                await self.publish({
+                    'type': 'message_deleted',
+                    # As serialized, so the logged events of the message can be matched
+                    'message_id': str(uuid.UUID(str(message_id)))
+                })
     
     async def handle_edit_message(self, data):
         message_id = data.get('message_id')
@@ -188,101 +305,145 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if message:
                 message_data = await self.serialize_message(message)
                 
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'message_edited',
-                        'message': message_data
-                    }
-                )
+                await self.publish({
+                    'type': 'message_edited',
+                    'message': message_data
+                })
     
     # Receive message from room group
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'chat_message',
             'message': event['message']
-        }))
+        }, event)
     
     async def user_status(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'user_status',
             'user_id': event['user_id'],
             'username': event['username'],
             'is_online': event['is_online'],
             'online_count': event['online_count']
-        }))
+        }, event)
     
+    async def users_offline(self, event):
+        # Sent once per room when a worker drains or a dead one is swept
+        await self.send_event({
+            'type': 'users_offline',
+            'user_ids': event['user_ids'],
+            'online_count': event['online_count']
+        }, event)
+
     async def typing_indicator(self, event):
         # Don't send typing indicator to the user who is typing
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_event({
                 'type': 'typing_indicator',
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'is_typing': event['is_typing']
-            }))
+            }, event)
     
     async def message_read_status(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'message_read_status',
             'message_id': event['message_id'],
             'user_id': event['user_id'],
             'username': event['username']
-        }))
+        }, event)
     
     async def message_deleted(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'message_deleted',
             'message_id': event['message_id']
-        }))
+        }, event)
     
     async def message_edited(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'message_edited',
             'message': event['message']
+        }, event)
+
+    async def message_media(self, event):
+        await self.send_event({
+            'type': 'message_media',
+            'message_id': event['message_id'],
+            'derivatives': event['derivatives']
+        }, event)
+
+    async def membership_changed(self, event):
+        await self.send_event({
+            'type': 'membership_changed',
+            'added': event['added'],
+            'removed': event['removed'],
+            'member_count': event['member_count']
+        }, event)
+        if self.user.id in event['removed']:
+            await self.close()
+
+    async def subscription_status(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'subscription_status',
+            'is_active': event['is_active']
         }))
-    
+
     # Database operations
-    @database_sync_to_async
+    @instrumented_sync_to_async
+    def can_send_messages(self):
+        if Subscription.objects.filter(user_id=self.user.id, is_active=True).exists():
+            return True
+        # Check if user has sent 10 messages in total (this is free tier limit). After that, require subscription.
+        return Message.objects.filter(sender_id=self.user.id, deleted_at__isnull=True).count() < 10
+
+    @instrumented_sync_to_async
     def check_room_membership(self):
         try:
             return ChatRoom.objects.filter(
                 id=self.room_id,
-                members=self.user
+                members=self.user.id
             ).exists()
         except:
             return False
     
-    @database_sync_to_async
+    @instrumented_sync_to_async
     def update_online_status(self, is_online):
         try:
             membership = RoomMembership.objects.get(
                 room_id=self.room_id,
-                user=self.user
+                user_id=self.user.id
             )
             membership.is_online = is_online
+            membership.presence_node_id = local_node.id if is_online else None
             membership.last_seen = timezone.now()
             membership.save()
         except RoomMembership.DoesNotExist:
             pass
     
-    @database_sync_to_async
+    @instrumented_sync_to_async
+    def sequence_event(self, event):
+        return publish_event(self.room_id, event)
+
+    @instrumented_sync_to_async
+    def get_events_since(self, last_seq):
+        return events_since(self.room_id, last_seq)
+
+    @instrumented_sync_to_async
     def get_online_count(self):
         return RoomMembership.objects.filter(
             room_id=self.room_id,
             is_online=True
         ).count()
     
-    @database_sync_to_async
+    @instrumented_sync_to_async
     def save_message(self, content, reply_to_id=None):
         try:
             reply_to = None
             if reply_to_id:
-                reply_to = Message.objects.get(id=reply_to_id)
+                reply_to = Message.objects.get(id=reply_to_id, deleted_at__isnull=True)
             
             message = Message.objects.create(
                 room_id=self.room_id,
-                sender=self.user,
+                sender_id=self.user.id,
                 content=content,
                 message_type='text',
                 reply_to=reply_to
@@ -296,7 +457,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             # Increment unread count for all members except sender
             RoomMembership.objects.filter(
                 room_id=self.room_id
-            ).exclude(user=self.user).update(
+            ).exclude(user_id=self.user.id).update(
                 unread_count=models.F('unread_count') + 1
             )
             
@@ -305,45 +466,45 @@ class ChatConsumer(AsyncWebsocketConsumer):
             print(f"Error saving message: {e}")
             return None
     
-    @database_sync_to_async
+    @instrumented_sync_to_async
     def serialize_message(self, message):
         from django.core.serializers import serialize
         serializer = MessageSerializer(message)
         return serializer.data
     
-    @database_sync_to_async
+    @instrumented_sync_to_async
     def add_typing_indicator(self):
         try:
             TypingIndicator.objects.update_or_create(
                 room_id=self.room_id,
-                user=self.user
+                user_id=self.user.id
             )
         except Exception as e:
             print(f"Error adding typing indicator: {e}")
     
-    @database_sync_to_async
+    @instrumented_sync_to_async
     def remove_typing_indicator(self):
         try:
             TypingIndicator.objects.filter(
                 room_id=self.room_id,
-                user=self.user
+                user_id=self.user.id
             ).delete()
         except Exception as e:
             print(f"Error removing typing indicator: {e}")
     
-    @database_sync_to_async
+    @instrumented_sync_to_async
     def mark_message_as_read(self, message_id):
         try:
-            message = Message.objects.get(id=message_id, room_id=self.room_id)
+            message = Message.objects.get(id=message_id, room_id=self.room_id, deleted_at__isnull=True)
             MessageReadStatus.objects.get_or_create(
                 message=message,
-                user=self.user
+                user_id=self.user.id
             )
             
             # Decrement unread count
             membership = RoomMembership.objects.get(
                 room_id=self.room_id,
-                user=self.user
+                user_id=self.user.id
             )
             if membership.unread_count > 0:
                 membership.unread_count -= 1
@@ -351,36 +512,272 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             print(f"Error marking message as read: {e}")
     
-    @database_sync_to_async
+    @instrumented_sync_to_async
     def delete_message(self, message_id):
+        # One-row tombstone update; read receipts and replies are cleaned up by the purger
         try:
-            message = Message.objects.get(
+            now = timezone.now()
+            return Message.objects.filter(
                 id=message_id,
                 room_id=self.room_id,
-                sender=self.user
-            )
-            message.delete()
-            return True
-        except Message.DoesNotExist:
-            return False
+                sender_id=self.user.id,
+                deleted_at__isnull=True
+            ).update(deleted_at=now, content='', updated_at=now) == 1
         except Exception as e:
             print(f"Error deleting message: {e}")
             return False
     
-    @database_sync_to_async
+    @instrumented_sync_to_async
     def edit_message(self, message_id, new_content):
         try:
-            message = Message.objects.get(
+            # Only the edited columns, and never on a message deleted meanwhile
+            updated = Message.objects.filter(
                 id=message_id,
                 room_id=self.room_id,
-                sender=self.user
-            )
-            message.content = new_content
-            message.is_edited = True
-            message.save()
-            return message
+                sender_id=self.user.id,
+                deleted_at__isnull=True
+            ).update(content=new_content, is_edited=True, updated_at=timezone.now())
+            if not updated:
+                return None
+            return Message.objects.select_related('image_derivative').get(id=message_id)
         except Message.DoesNotExist:
             return None
         except Exception as e:
             print(f"Error editing message: {e}")
             return None
+
+
+class MultiplexChatConsumer(ChatConsumer):
+    """
+    One socket per user for any number of rooms (ws/chat/).
+
+    The client subscribes with {"type": "subscribe", "rooms": [...]} and an
+    optional "last_seq" map of room id to sequence to resume from, and leaves
+    with {"type": "unsubscribe", "rooms": [...]}. Room frames in both
+    directions carry a "room" field; otherwise they are those of
+    ChatConsumer, whose handlers run with the frame's room as the current
+    room. Membership, presence and online counts are checked and updated
+    with one query each per subscribe, whatever the number of rooms. As on
+    ChatConsumer, {"type": "ping"} is answered with {"type": "pong"}.
+    """
+
+    async def connect(self):
+        self.user = self.scope['user']
+        self.room_id = None
+        # Subscribed room id -> sequence number of the last event sent for it
+        self.rooms = {}
+
+        with track_frame('connect', user_id=self.user.id):
+            if local_node.draining:
+                await self.refuse_draining()
+                return
+            if not self.user.is_authenticated:
+                REJECTIONS.inc('unauthenticated')
+                await self.close()
+                return
+            self.user_group_name = user_group_name(self.user.id)
+            await self.channel_layer.group_add(self.user_group_name, self.channel_name)
+            await self.accept()
+            self.accepted = True
+            CONNECTS.inc()
+            OPEN_CONNECTIONS.inc()
+            await local_node.join(self)
+
+    def presence_rooms(self):
+        return list(self.rooms)
+
+    async def disconnect(self, close_code):
+        if not getattr(self, 'accepted', False):
+            return
+        DISCONNECTS.inc()
+        OPEN_CONNECTIONS.dec()
+        local_node.leave(self)
+        with track_frame('disconnect', user_id=self.user.id):
+            if local_node.draining:
+                # The drain marked the whole node offline in bulk
+                for room_id in self.rooms:
+                    await self.channel_layer.group_discard(room_group_name(room_id), self.channel_name)
+                self.rooms.clear()
+            else:
+                await self.unsubscribe(list(self.rooms), notify=False)
+            await self.channel_layer.group_discard(self.user_group_name, self.channel_name)
+
+    def enter_room(self, room_id):
+        # ChatConsumer's handlers and helpers act on the current room
+        self.room_id = room_id
+        self.room_group_name = room_group_name(room_id)
+
+    async def receive(self, text_data):
+        self.last_active = time.monotonic()
+        data = json.loads(text_data)
+        message_type = data.get('type')
+        if message_type == 'ping':
+            await self.send(text_data=PONG_FRAME)
+            return
+
+        if message_type in ('subscribe', 'unsubscribe'):
+            rooms = self.parse_rooms(data.get('rooms'))
+            with track_frame(message_type, user_id=self.user.id, rooms=len(rooms)):
+                if message_type == 'subscribe':
+                    await self.subscribe(rooms, data.get('last_seq') or {})
+                else:
+                    await self.unsubscribe([room_id for room_id in rooms if room_id in self.rooms])
+            return
+
+        room_id = str(data.get('room', ''))
+        frame_type = message_type if message_type in FRAME_TYPES else 'unknown'
+        with track_frame(frame_type, room_id=room_id, user_id=self.user.id):
+            if room_id not in self.rooms:
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'room': room_id,
+                    'message': "Not subscribed to this room."
+                }))
+                return
+            self.enter_room(room_id)
+            await self.handle_frame(message_type, data)
+
+    def parse_rooms(self, rooms):
+        parsed = []
+        for room_id in rooms if isinstance(rooms, list) else []:
+            try:
+                # Interned: the keys of self.rooms are shared by every socket subscribed to a room
+                parsed.append(sys.intern(str(uuid.UUID(str(room_id)))))
+            except ValueError:
+                continue
+        return list(dict.fromkeys(parsed))
+
+    async def subscribe(self, rooms, last_seqs):
+        if local_node.draining:
+            # About to be closed; the node no longer holds anyone online
+            return
+        new_rooms = [room_id for room_id in rooms if room_id not in self.rooms]
+        allowed = set()
+        if new_rooms and len(self.rooms) + len(new_rooms) <= settings.CHAT_MAX_SUBSCRIPTIONS:
+            allowed = await self.get_member_rooms(new_rooms)
+        joined = [room_id for room_id in new_rooms if room_id in allowed]
+
+        for room_id in joined:
+            self.rooms[room_id] = 0
+            await self.channel_layer.group_add(room_group_name(room_id), self.channel_name)
+        await self.send(text_data=json.dumps({
+            'type': 'subscribed',
+            'rooms': joined,
+            'denied': [room_id for room_id in rooms if room_id not in self.rooms]
+        }))
+        if not joined:
+            return
+
+        online_counts = await self.set_rooms_online(joined, True)
+        for room_id in joined:
+            self.enter_room(room_id)
+            await self.broadcast({
+                'type': 'user_status',
+                'user_id': self.user.id,
+                'username': self.user.username,
+                'is_online': True,
+                'online_count': online_counts.get(room_id, 0)
+            })
+            try:
+                last_seq = int(last_seqs[room_id])
+            except (KeyError, TypeError, ValueError):
+                continue
+            await self.resume(last_seq)
+
+    async def unsubscribe(self, rooms, notify=True):
+        if not rooms:
+            return
+        for room_id in rooms:
+            del self.rooms[room_id]
+            await self.channel_layer.group_discard(room_group_name(room_id), self.channel_name)
+        if notify:
+            await self.send(text_data=json.dumps({
+                'type': 'unsubscribed',
+                'rooms': rooms
+            }))
+
+        online_counts = await self.set_rooms_online(rooms, False)
+        for room_id in rooms:
+            self.enter_room(room_id)
+            await self.broadcast({
+                'type': 'user_status',
+                'user_id': self.user.id,
+                'username': self.user.username,
+                'is_online': False,
+                'online_count': online_counts.get(room_id, 0)
+            })
+
+    async def resume(self, last_seq):
+        room_id = self.room_id
+        current, events = await self.get_events_since(last_seq)
+        if events is None:
+            self.rooms[room_id] = current
+            await self.send(text_data=json.dumps({
+                'type': 'resync',
+                'room': room_id,
+                'seq': current
+            }))
+            return
+        self.rooms[room_id] = last_seq
+        for event in events:
+            await getattr(self, event['type'])(event)
+
+    async def membership_changed(self, event):
+        room_id = event['room_id']
+        await self.send_event({
+            'type': 'membership_changed',
+            'added': event['added'],
+            'removed': event['removed'],
+            'member_count': event['member_count']
+        }, event)
+        if self.user.id in event['removed'] and room_id in self.rooms:
+            # Removed from the room: drop it without touching the deleted membership
+            del self.rooms[room_id]
+            await self.channel_layer.group_discard(room_group_name(room_id), self.channel_name)
+
+    async def send_event(self, frame, event):
+        room_id = event.get('room_id')
+        if room_id is None:
+            await self.send(text_data=json.dumps(frame))
+            return
+        if room_id not in self.rooms:
+            # Still queued from before an unsubscribe
+            return
+        seq = event.get('seq')
+        if seq is not None:
+            if seq <= self.rooms[room_id]:
+                return
+            self.rooms[room_id] = frame['seq'] = seq
+            recent_events.append(room_id, event)
+        frame['room'] = room_id
+        await self.send(text_data=json.dumps(frame))
+
+    # Database operations
+    @instrumented_sync_to_async
+    def get_member_rooms(self, room_ids):
+        return {
+            str(room_id) for room_id in RoomMembership.objects.filter(
+                user_id=self.user.id,
+                room_id__in=room_ids
+            ).values_list('room_id', flat=True)
+        }
+
+    @instrumented_sync_to_async
+    def set_rooms_online(self, room_ids, is_online):
+        RoomMembership.objects.filter(
+            user_id=self.user.id,
+            room_id__in=room_ids
+        ).update(
+            is_online=is_online,
+            last_seen=timezone.now(),
+            presence_node_id=local_node.id if is_online else None
+        )
+        if not is_online:
+            TypingIndicator.objects.filter(user_id=self.user.id, room_id__in=room_ids).delete()
+        return {
+            str(row['room_id']): row['online']
+            for row in RoomMembership.objects.filter(
+                room_id__in=room_ids,
+                is_online=True
+            ).values('room_id').annotate(online=models.Count('id'))
+        }
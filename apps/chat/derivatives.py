@@ -0,0 +1,143 @@
+"""
+Thumbnail and web-optimized derivatives of chat images.
+
+Rendering runs in a pool of spawned worker processes (apps.chat.imaging), so
+neither the event loop nor request threads spend CPU on Pillow, and workers
+inherit none of the server's threads, sockets or database connections.
+Derivatives are keyed by the SHA-256 of the original: a duplicate upload
+reuses the existing ImageDerivative row and is never rendered again.
+
+At most CHAT_DERIVATIVE_QUEUE_SIZE images are queued or rendering per
+process. Past that, submissions are refused and the row stays pending until
+`manage.py build_derivatives` picks it up.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection
+
+from .groups import broadcast_to_room
+from .media import media_url
+from .metrics import DERIVATIVE_JOBS, DERIVATIVE_LATENCY
+from .models import ImageDerivative, Message
+
+
+logger = logging.getLogger(__name__)
+
+
+def derivative_name(sha256, name):
+    return f'chat/images/derived/{sha256[:2]}/{sha256}/{name}.jpg'
+
+
+def derivative_payload(derivative, message_id):
+    # Shared by every message of the same image, so the links are per message
+    if derivative is None or derivative.status != 'ready':
+        return None
+    return {
+        'thumbnail': media_url(message_id, 'thumbnail'),
+        'web': media_url(message_id, 'web'),
+        'width': derivative.width,
+        'height': derivative.height,
+    }
+
+
+def _source_for_worker(derivative):
+    # Workers read local files themselves; other storages hand over the bytes
+    storage = ImageDerivative._meta.get_field('web').storage
+    try:
+        return storage.path(derivative.source)
+    except NotImplementedError:
+        with storage.open(derivative.source) as fh:
+            return fh.read()
+
+
+def store_derivatives(derivative_pk, size, rendered):
+    """Save rendered derivatives, mark the row ready and tell the rooms showing it."""
+    derivative = ImageDerivative.objects.get(pk=derivative_pk)
+    for name, (data, width, height) in rendered.items():
+        getattr(derivative, name).save(derivative_name(derivative.sha256, name), ContentFile(data), save=False)
+    derivative.width, derivative.height = size
+    derivative.status = 'ready'
+    derivative.error = ''
+    derivative.save()
+
+    channel_layer = get_channel_layer()
+    for message_id, room_id in Message.objects.filter(image_derivative=derivative, deleted_at__isnull=True).values_list('id', 'room_id'):
+        async_to_sync(broadcast_to_room)(room_id, {
+            'type': 'message_media',
+            'message_id': str(message_id),
+            'derivatives': derivative_payload(derivative, message_id),
+        }, channel_layer)
+
+
+class DerivativePipeline:
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+        return self._executor
+
+    def submit(self, derivative, block=False):
+        """Queue an image for rendering. Returns False when the queue is full."""
+        if not self._slots.acquire(blocking=block):
+            DERIVATIVE_JOBS.inc('rejected')
+            return False
+        # Pillow is only needed once an image is rendered, not by every process serializing messages
+        from .imaging import render_derivatives
+
+        try:
+            started = time.perf_counter()
+            future = self.executor.submit(render_derivatives, _source_for_worker(derivative))
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._finish(derivative.pk, future, started))
+        return True
+
+    def _finish(self, derivative_pk, future, started):
+        # Runs on the executor's result thread, which must not keep a connection open
+        try:
+            store_derivatives(derivative_pk, *future.result())
+            DERIVATIVE_JOBS.inc('processed')
+            DERIVATIVE_LATENCY.observe(time.perf_counter() - started)
+        except Exception as e:
+            logger.exception("Rendering derivatives of image %s failed", derivative_pk)
+            ImageDerivative.objects.filter(pk=derivative_pk).update(status='failed', error=f"{type(e).__name__}: {e}")
+            DERIVATIVE_JOBS.inc('failed')
+        finally:
+            self._slots.release()
+            connection.close()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = DerivativePipeline(settings.CHAT_DERIVATIVE_WORKERS, settings.CHAT_DERIVATIVE_QUEUE_SIZE)
+    return _pipeline
@@ -0,0 +1,148 @@
+"""
+Per-room event sequence numbers and replay for resuming sockets.
+
+Every new, edited, deleted and read message event takes the next number of
+its room's `ChatRoom.last_seq` counter and is logged as a RoomEvent before it
+is broadcast. A client reconnecting with `?last_seq=N` gets events N+1 up to
+the current sequence replayed, then continues live.
+
+Replay comes from a bounded in-memory ring of recent events per room,
+filled both by events published in this process and by events this
+process's sockets deliver, so a ring is only trusted when it holds the
+whole gap. Otherwise the gap is read from RoomEvent. A client further
+behind than CHAT_RESUME_MAX_EVENTS, or whose gap has been pruned from the
+log, is told to resync.
+
+Deleting a message tombstones the events about it, in the log through their
+indexed message id and in the rings as they take the deletion, so replay
+never brings back the content or media links of a deleted message.
+"""
+import threading
+import uuid
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.db import models, transaction
+
+from .models import ChatRoom, RoomEvent
+
+
+# What an event may carry of a message's content
+MESSAGE_CONTENT = {'content': '', 'image': None, 'video': None, 'derivatives': None}
+
+
+def event_message_id(event):
+    """Id of the message an event carries or refers to, if any, as serialized."""
+    message = event.get('message')
+    message_id = message.get('id') if message else event.get('message_id')
+    try:
+        return str(uuid.UUID(str(message_id))) if message_id else None
+    except ValueError:
+        # Frames such as message_read pass on whatever id the client sent
+        return None
+
+
+def tombstone(event, message_id):
+    """`event` stripped of the content of message `message_id`, if it is about that message."""
+    if event_message_id(event) != message_id:
+        return event
+    event = {**event, **{key: value for key, value in MESSAGE_CONTENT.items() if key in event}}
+    if event.get('message'):
+        event['message'] = {**event['message'], **MESSAGE_CONTENT}
+    return event
+
+
+class RoomEventBuffer:
+    """Most recent contiguous events of the busiest rooms, least recently used rooms dropped first."""
+
+    def __init__(self, size, rooms):
+        self.size = size
+        self.rooms = rooms
+        self._buffers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def append(self, room_id, event):
+        room_id = str(room_id)
+        with self._lock:
+            buffer = self._buffers.get(room_id)
+            if buffer is None:
+                buffer = self._buffers[room_id] = deque(maxlen=self.size)
+                if len(self._buffers) > self.rooms:
+                    self._buffers.popitem(last=False)
+            else:
+                self._buffers.move_to_end(room_id)
+                last = buffer[-1]['seq']
+                if event['seq'] <= last:
+                    return
+                if event['seq'] != last + 1:
+                    # Events were missed; only the part after the gap is usable
+                    buffer.clear()
+            buffer.append(event)
+            if event['type'] == 'message_deleted':
+                for i, earlier in enumerate(buffer):
+                    buffer[i] = tombstone(earlier, event['message_id'])
+
+    def since(self, room_id, after, until):
+        """Events after..until, or None unless all of them are buffered."""
+        with self._lock:
+            buffer = self._buffers.get(str(room_id))
+            if not buffer or buffer[0]['seq'] > after + 1 or buffer[-1]['seq'] < until:
+                return None
+            start = after + 1 - buffer[0]['seq']
+            return list(buffer)[start:start + until - after]
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+
+
+recent_events = RoomEventBuffer(settings.CHAT_EVENT_BUFFER_SIZE, settings.CHAT_EVENT_BUFFER_ROOMS)
+
+
+def publish_event(room_id, event):
+    """Number and log a room group event; returns the event with its `seq` to broadcast."""
+    with transaction.atomic():
+        # The row lock taken by the update orders concurrent publishers
+        ChatRoom.objects.filter(id=room_id).update(last_seq=models.F('last_seq') + 1)
+        seq = ChatRoom.objects.values_list('last_seq', flat=True).get(id=room_id)
+        event = {**event, 'room_id': str(room_id), 'seq': seq}
+        if event['type'] == 'message_deleted':
+            _tombstone_logged(event['message_id'])
+        RoomEvent.objects.create(room_id=room_id, seq=seq, payload=event, message_id=event_message_id(event))
+    recent_events.append(room_id, event)
+    return event
+
+
+def _tombstone_logged(message_id):
+    # By the indexed message_id, so the cost follows the message's events, not the log's size
+    logged = RoomEvent.objects.filter(message_id=message_id).only('payload')
+    changed = []
+    for row in logged:
+        payload = tombstone(row.payload, message_id)
+        if payload != row.payload:
+            row.payload = payload
+            changed.append(row)
+    RoomEvent.objects.bulk_update(changed, ['payload'])
+
+
+def events_since(room_id, after):
+    """
+    (current_seq, events) to bring a client at `after` up to date, with
+    events None when the client must resync.
+    """
+    current = ChatRoom.objects.values_list('last_seq', flat=True).get(id=room_id)
+    if after == current:
+        return current, []
+    if after > current or current - after > settings.CHAT_RESUME_MAX_EVENTS:
+        return current, None
+
+    events = recent_events.since(room_id, after, current)
+    if events is None:
+        events = list(
+            RoomEvent.objects.filter(room_id=room_id, seq__gt=after, seq__lte=current)
+            .order_by('seq')
+            .values_list('payload', flat=True)
+        )
+        if len(events) != current - after:
+            return current, None
+    return current, events
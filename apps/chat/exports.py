@@ -0,0 +1,189 @@
+import csv
+import json
+import zlib
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .media import media_url
+from .models import Message, MessageReadStatus
+from .profiles import sender_profiles
+
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# Rows fetched per DB round trip; senders missing from the profile cache are fetched once per chunk
+DEFAULT_CHUNK_SIZE = 2000
+# Encoded output is flushed in blocks of roughly this many bytes
+OUTPUT_BUFFER_SIZE = 64 * 1024
+
+MESSAGE_FIELDS = (
+    'id', 'sender_id', 'message_type', 'content', 'image', 'video',
+    'reply_to_id', 'is_edited', 'created_at', 'updated_at',
+)
+RECEIPT_FIELDS = ('message_id', 'user_id', 'read_at')
+
+CSV_COLUMNS = (
+    'record', 'id', 'message_id', 'user_id', 'username', 'first_name', 'last_name',
+    'message_type', 'content', 'image', 'video', 'reply_to', 'is_edited',
+    'created_at', 'updated_at', 'read_at',
+)
+
+
+def parse_export_bound(value, upper=False):
+    """
+    Parse a `since`/`until` filter value. Accepts an ISO datetime or a plain
+    date; a plain date used as an upper bound covers that whole day.
+    """
+    if not value:
+        return None
+
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date or datetime: {value}")
+        if upper:
+            day += timedelta(days=1)
+        parsed = datetime.combine(day, time.min)
+
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _user_fields(users, user_id):
+    user = users.get(user_id) or {}
+    return {
+        'user_id': user_id,
+        'username': user.get('username'),
+        'first_name': user.get('first_name'),
+        'last_name': user.get('last_name'),
+    }
+
+
+def iter_room_records(room_id, since=None, until=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield every message and read receipt of a room as flat dicts, messages
+    first. Rows are streamed with `.iterator()` so memory stays bounded by
+    `chunk_size` regardless of room size.
+    """
+    messages = Message.objects.filter(room_id=room_id, deleted_at__isnull=True)
+    receipts = MessageReadStatus.objects.filter(message__room_id=room_id, message__deleted_at__isnull=True)
+    if since:
+        messages = messages.filter(created_at__gte=since)
+        receipts = receipts.filter(read_at__gte=since)
+    if until:
+        messages = messages.filter(created_at__lt=until)
+        receipts = receipts.filter(read_at__lt=until)
+
+    messages = messages.order_by('created_at', 'id').values(*MESSAGE_FIELDS)
+    for batch in _batched(messages.iterator(chunk_size=chunk_size), chunk_size):
+        senders = sender_profiles.get_many({row['sender_id'] for row in batch})
+        for row in batch:
+            yield {
+                'record': 'message',
+                'id': row['id'],
+                **_user_fields(senders, row['sender_id']),
+                'message_type': row['message_type'],
+                'content': row['content'],
+                'image': media_url(row['id']) if row['image'] else None,
+                'video': media_url(row['id']) if row['video'] else None,
+                'reply_to': row['reply_to_id'],
+                'is_edited': row['is_edited'],
+                'created_at': row['created_at'],
+                'updated_at': row['updated_at'],
+            }
+
+    receipts = receipts.order_by('read_at', 'id').values(*RECEIPT_FIELDS)
+    for batch in _batched(receipts.iterator(chunk_size=chunk_size), chunk_size):
+        readers = sender_profiles.get_many({row['user_id'] for row in batch})
+        for row in batch:
+            yield {
+                'record': 'read_receipt',
+                'message_id': row['message_id'],
+                **_user_fields(readers, row['user_id']),
+                'read_at': row['read_at'],
+            }
+
+
+class _Echo:
+    # File-like object that hands back whatever csv.writer writes to it
+    def write(self, value):
+        return value
+
+
+def _iter_ndjson(records):
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+def _iter_csv(records):
+    writer = csv.DictWriter(_Echo(), fieldnames=CSV_COLUMNS, extrasaction='ignore')
+    yield writer.writeheader()
+    for record in records:
+        yield writer.writerow({
+            key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in record.items()
+        })
+
+
+def _buffered(lines, size=OUTPUT_BUFFER_SIZE):
+    # Group small lines into larger blocks to keep per-chunk overhead low
+    buffer, length = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _gzipped(blocks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_room_export(room_id, export_format='ndjson', since=None, until=None,
+                     compress=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the encoded export of a room as byte blocks."""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    records = iter_room_records(room_id, since=since, until=until, chunk_size=chunk_size)
+    lines = _iter_csv(records) if export_format == 'csv' else _iter_ndjson(records)
+    blocks = _buffered(lines)
+    return _gzipped(blocks) if compress else blocks
+
+
+async def aiter_blocks(blocks):
+    """
+    Drive a synchronous export generator from async code one block at a time.
+    StreamingHttpResponse would otherwise consume a sync iterator into a list
+    when served over ASGI.
+    """
+    sentinel = object()
+    next_block = sync_to_async(next, thread_sensitive=True)
+    while (block := await next_block(blocks, sentinel)) is not sentinel:
+        yield block
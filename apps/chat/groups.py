@@ -0,0 +1,31 @@
+"""
+Channel layer group names shared by the consumers and by code that sends to
+their sockets from elsewhere (views, commands, other apps), and the room
+broadcast they all go through.
+"""
+import sys
+
+from channels.layers import get_channel_layer
+
+from .metrics import FANOUT, group_size
+
+
+def user_group_name(user_id):
+    # Every socket of a user joins this group for account-level events
+    return sys.intern(f'user_{user_id}')
+
+
+def room_group_name(room_id):
+    # Interned, like user_group_name: the sockets of a room share one string instead of a copy each
+    return sys.intern(f'chat_{room_id}')
+
+
+async def broadcast_to_room(room_id, event, channel_layer=None):
+    """Send `event` to the sockets of a room and record its fan-out."""
+    channel_layer = channel_layer or get_channel_layer()
+    group = room_group_name(room_id)
+    size = group_size(channel_layer, group)
+    if size is not None:
+        FANOUT.observe(size, event['type'])
+    # Tagged so sockets subscribed to many rooms can tell them apart
+    await channel_layer.group_send(group, {'room_id': str(room_id), **event})
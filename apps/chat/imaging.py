@@ -0,0 +1,51 @@
+"""
+Image derivative rendering. Runs inside derivative pool worker processes, so
+it only depends on Pillow and never imports Django.
+"""
+import io
+
+from PIL import Image, ImageOps
+
+
+# name: (max width, max height, JPEG quality)
+DERIVATIVE_SPECS = {
+    'thumbnail': (320, 320, 75),
+    'web': (1600, 1600, 82),
+}
+
+
+def _open(source):
+    # `source` is a local path or the original's bytes
+    return Image.open(source if isinstance(source, str) else io.BytesIO(source))
+
+
+def _flatten(image):
+    # JPEG has no alpha: composite transparent images on white
+    if image.mode in ('RGB', 'L'):
+        return image
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def render_derivatives(source, specs=DERIVATIVE_SPECS):
+    """
+    Render every derivative of one image as progressive JPEG. Returns the
+    original's (width, height) and {name: (jpeg bytes, width, height)}.
+    """
+    with _open(source) as image:
+        size = image.size
+        largest = max((width, height) for width, height, _ in specs.values())
+        # JPEG decoders can skip detail below the largest target: far less work for big photos
+        image.draft('RGB', largest)
+        image = _flatten(ImageOps.exif_transpose(image))
+
+        rendered = {}
+        # Largest first, each shrunk further from the previous one
+        for name, (width, height, quality) in sorted(specs.items(), key=lambda item: -item[1][0] * item[1][1]):
+            image.thumbnail((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+            rendered[name] = (buffer.getvalue(), image.width, image.height)
+    return size, rendered
@@ -0,0 +1,174 @@
+import functools
+import logging
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+
+logger = logging.getLogger('apps.chat.frames')
+slow_query_logger = logging.getLogger('apps.chat.slow_queries')
+
+# Stats of the frame being handled. asgiref copies the context into executor
+# threads, so queries run by database_sync_to_async helpers land here too.
+_current_frame = ContextVar('chat_current_frame', default=None)
+_frame_listeners = []
+
+
+class FrameStats:
+    __slots__ = ('frame_type', 'fields', 'queries', 'db_time', 'wall_time', 'helpers', '_started')
+
+    def __init__(self, frame_type, fields):
+        self.frame_type = frame_type
+        self.fields = fields
+        self.queries = 0
+        self.db_time = 0.0
+        self.wall_time = 0.0
+        self.helpers = {}
+        self._started = time.perf_counter()
+
+    def record_helper(self, name, wall_time, queries, db_time):
+        calls, total_wall, total_queries, total_db = self.helpers.get(name, (0, 0.0, 0, 0.0))
+        self.helpers[name] = (calls + 1, total_wall + wall_time, total_queries + queries, total_db + db_time)
+
+    def as_dict(self):
+        return {
+            'frame_type': self.frame_type,
+            **self.fields,
+            'queries': self.queries,
+            'db_time_ms': round(self.db_time * 1000, 3),
+            'wall_time_ms': round(self.wall_time * 1000, 3),
+            'helpers': {
+                name: {
+                    'calls': calls,
+                    'wall_time_ms': round(wall_time * 1000, 3),
+                    'queries': queries,
+                    'db_time_ms': round(db_time * 1000, 3),
+                }
+                for name, (calls, wall_time, queries, db_time) in self.helpers.items()
+            },
+        }
+
+
+def add_frame_listener(listener):
+    """Register a callable receiving the FrameStats of every finished frame."""
+    _frame_listeners.append(listener)
+
+
+def remove_frame_listener(listener):
+    _frame_listeners.remove(listener)
+
+
+def _call_site():
+    # Innermost stack frame that belongs to this project rather than Django or a library
+    base_dir = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-3]):
+        if frame.filename.startswith(base_dir) and 'site-packages' not in frame.filename:
+            return f"{frame.filename[len(base_dir) + 1:]}:{frame.lineno} in {frame.name}"
+    return None
+
+
+def observe_query(execute, sql, params, many, context):
+    """Execute wrapper attributing query count and time to the current frame."""
+    stats = _current_frame.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        stats.queries += 1
+        stats.db_time += duration
+        if duration * 1000 >= settings.CHAT_SLOW_QUERY_MS:
+            call_site = _call_site()
+            slow_query_logger.warning(
+                "Slow query (%.1f ms) in %s frame at %s: %s",
+                duration * 1000, stats.frame_type, call_site, sql,
+                extra={'chat_slow_query': {
+                    'frame_type': stats.frame_type,
+                    'duration_ms': round(duration * 1000, 3),
+                    'sql': sql,
+                    'call_site': call_site,
+                }},
+            )
+
+
+def install_query_observer(sender, connection, **kwargs):
+    # connection_created fires on every reconnect of the same wrapper
+    if observe_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(observe_query)
+
+
+@contextmanager
+def track_frame(frame_type, **fields):
+    """Collect query count, DB time and wall time for one consumer frame."""
+    stats = FrameStats(frame_type, fields)
+    token = _current_frame.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_frame.reset(token)
+        stats.wall_time = time.perf_counter() - stats._started
+
+        if stats.wall_time * 1000 >= settings.CHAT_SLOW_FRAME_MS:
+            logger.warning("Slow %s frame (%.1f ms, %d queries)", frame_type, stats.wall_time * 1000, stats.queries,
+                           extra={'chat_frame': stats.as_dict()})
+        elif logger.isEnabledFor(logging.INFO):
+            logger.info("%s frame (%.1f ms, %d queries)", frame_type, stats.wall_time * 1000, stats.queries,
+                        extra={'chat_frame': stats.as_dict()})
+
+        for listener in _frame_listeners:
+            listener(stats)
+
+
+def instrumented_sync_to_async(func):
+    """
+    Drop-in for `database_sync_to_async` that records each helper's wall time,
+    query count and DB time on the current frame.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        stats = _current_frame.get()
+        if stats is None:
+            return func(*args, **kwargs)
+
+        queries, db_time = stats.queries, stats.db_time
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.record_helper(name, time.perf_counter() - started, stats.queries - queries, stats.db_time - db_time)
+
+    return database_sync_to_async(timed)
+
+
+@contextmanager
+def assert_query_budget(**budgets):
+    """
+    Fail if any frame handled inside the block exceeds its query budget.
+
+        with assert_query_budget(chat_message=2, typing_start=1):
+            await communicator.send_json_to({'type': 'chat_message', 'content': 'hi'})
+            await communicator.receive_json_from()
+    """
+    frames = []
+    add_frame_listener(frames.append)
+    try:
+        yield frames
+    finally:
+        remove_frame_listener(frames.append)
+
+    over_budget = [
+        f"{stats.frame_type}: {stats.queries} queries (budget {budgets[stats.frame_type]})"
+        for stats in frames
+        if stats.frame_type in budgets and stats.queries > budgets[stats.frame_type]
+    ]
+    if over_budget:
+        raise AssertionError("Query budget exceeded: " + "; ".join(over_budget))
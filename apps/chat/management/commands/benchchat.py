@@ -0,0 +1,277 @@
+import asyncio
+import json
+import random
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.chat.models import ChatRoom, RoomMembership
+from apps.subscription.models import Subscription
+from utils.benchmark import build_report, isolated_database, latency_summary, write_report
+
+
+FRAME_TYPES = ('chat', 'typing', 'read', 'edit')
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in FRAME_TYPES:
+            raise CommandError(f"Unknown frame type in --mix: {name}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise CommandError(f"Invalid weight in --mix: {part}")
+    if not any(mix.values()):
+        raise CommandError("--mix needs at least one positive weight.")
+    return mix
+
+
+class QueryCounter:
+    # Execute wrapper counting every query issued on a connection
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class PendingFrame:
+    def __init__(self, frame_type, expected):
+        self.frame_type = frame_type
+        self.expected = expected
+        self.received = 0
+        self.sent_at = None
+        self.done = asyncio.get_running_loop().create_future()
+
+
+class BenchClient:
+    def __init__(self, bench, user_id, room_index, communicator):
+        self.bench = bench
+        self.user_id = user_id
+        self.room_index = room_index
+        self.communicator = communicator
+        self.last_message_id = None
+        self.typing = False
+        self.reader = None
+
+    async def read_loop(self):
+        # Read the output queue directly: receive_output() cancels the app on timeout
+        while True:
+            event = await self.communicator.output_queue.get()
+            if event['type'] == 'websocket.close':
+                return
+            if event['type'] == 'websocket.send' and event.get('text'):
+                self.bench.on_frame(self, json.loads(event['text']), time.perf_counter())
+
+
+class ChatBenchmark:
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        self.mix = parse_mix(options['mix'])
+        self.clients = []
+        self.room_sizes = defaultdict(int)
+        self.pending = {}
+        self.counter = QueryCounter()
+        self.delivery_latency = defaultdict(list)
+        self.fanout_latency = defaultdict(list)
+        self.frame_queries = defaultdict(list)
+        self.timeouts = defaultdict(int)
+        self.deliveries = 0
+
+    def on_frame(self, client, frame, received_at):
+        frame_type = frame.get('type')
+        key = None
+        if frame_type == 'chat_message':
+            message = frame['message']
+            if message['sender']['id'] == client.user_id:
+                client.last_message_id = message['id']
+            key = ('chat', message['content'])
+        elif frame_type == 'message_edited':
+            key = ('edit', frame['message']['content'])
+        elif frame_type == 'message_read_status':
+            key = ('read', frame['message_id'], frame['user_id'])
+        elif frame_type == 'typing_indicator':
+            key = ('typing', frame['user_id'], frame['is_typing'])
+
+        pending = self.pending.get(key)
+        if pending is None or pending.sent_at is None:
+            return
+
+        self.deliveries += 1
+        pending.received += 1
+        self.delivery_latency[pending.frame_type].append(received_at - pending.sent_at)
+        if pending.received == pending.expected and not pending.done.done():
+            self.fanout_latency[pending.frame_type].append(received_at - pending.sent_at)
+            pending.done.set_result(True)
+
+    async def connect_all(self, users):
+        connect_latency = []
+        for user_id, room_id, room_index in users:
+            token = str(AccessToken.for_user(User(id=user_id)))
+            communicator = WebsocketCommunicator(self.application, f'/ws/chat/{room_id}/?token={token}')
+            started = time.perf_counter()
+            connected, _ = await communicator.connect(timeout=self.options['timeout'])
+            if not connected:
+                raise CommandError(f"User {user_id} could not connect to room {room_id}.")
+            connect_latency.append(time.perf_counter() - started)
+
+            client = BenchClient(self, user_id, room_index, communicator)
+            client.reader = asyncio.create_task(client.read_loop())
+            self.clients.append(client)
+            self.room_sizes[room_index] += 1
+        return connect_latency
+
+    async def send_frame(self, client, frame_type):
+        if frame_type in ('read', 'edit') and not client.last_message_id:
+            frame_type = 'chat'
+
+        room_size = self.room_sizes[client.room_index]
+        nonce = uuid.uuid4().hex
+        if frame_type == 'chat':
+            key = ('chat', f'bench:{nonce}')
+            payload = {'type': 'chat_message', 'content': key[1]}
+            expected = room_size
+        elif frame_type == 'edit':
+            key = ('edit', f'bench-edit:{nonce}')
+            payload = {'type': 'edit_message', 'message_id': client.last_message_id, 'content': key[1]}
+            expected = room_size
+        elif frame_type == 'read':
+            key = ('read', client.last_message_id, client.user_id)
+            payload = {'type': 'message_read', 'message_id': client.last_message_id}
+            expected = room_size
+        else:
+            client.typing = not client.typing
+            key = ('typing', client.user_id, client.typing)
+            payload = {'type': 'typing_start' if client.typing else 'typing_stop'}
+            # The typing user does not receive their own indicator
+            expected = room_size - 1
+
+        pending = PendingFrame(frame_type, expected)
+        self.pending[key] = pending
+        queries_before = self.counter.count
+        pending.sent_at = time.perf_counter()
+        try:
+            await client.communicator.send_to(text_data=json.dumps(payload))
+            await asyncio.wait_for(pending.done, self.options['timeout'])
+        except asyncio.TimeoutError:
+            self.timeouts[frame_type] += 1
+        finally:
+            self.pending.pop(key, None)
+        self.frame_queries[frame_type].append(self.counter.count - queries_before)
+
+    async def sender(self, index, clients, frames):
+        rng = random.Random(f"{self.options['seed']}:sender:{index}")
+        types, weights = zip(*self.mix.items())
+        for _ in range(frames):
+            await self.send_frame(rng.choice(clients), rng.choices(types, weights)[0])
+
+    async def run(self, users):
+        # Consumer queries run on the thread-sensitive executor thread, so install the counter there
+        await database_sync_to_async(lambda: connection.execute_wrappers.append(self.counter))()
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        connect_latency = await self.connect_all(users)
+        # Let the join broadcasts drain before measuring retained memory
+        await asyncio.sleep(0.5)
+        memory = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+
+        concurrency = max(1, min(self.options['concurrency'], len(self.clients)))
+        frames = self.options['frames']
+        queries_before = self.counter.count
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self.sender(i, self.clients[i::concurrency], frames // concurrency + (i < frames % concurrency))
+            for i in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+        total_queries = self.counter.count - queries_before
+
+        for client in self.clients:
+            await client.communicator.disconnect()
+            client.reader.cancel()
+
+        by_type = {}
+        for frame_type, queries in self.frame_queries.items():
+            by_type[frame_type] = {
+                'frames': len(queries),
+                'timeouts': self.timeouts[frame_type],
+                'fanout_latency': latency_summary(self.fanout_latency[frame_type]),
+                'delivery_latency': latency_summary(self.delivery_latency[frame_type]),
+            }
+            # Per-type query counts are only exact when frames do not overlap
+            if concurrency == 1:
+                by_type[frame_type]['queries_per_frame'] = round(sum(queries) / len(queries), 2)
+
+        sent = sum(len(queries) for queries in self.frame_queries.values())
+        return {
+            'connections': len(self.clients),
+            'frames_sent': sent,
+            'elapsed_s': round(elapsed, 3),
+            'frames_per_second': round(sent / elapsed, 1) if elapsed else None,
+            'deliveries_per_second': round(self.deliveries / elapsed, 1) if elapsed else None,
+            'queries_per_frame': round(total_queries / sent, 2) if sent else None,
+            'memory_per_connection_bytes': round(memory / len(self.clients)),
+            'connect_latency': latency_summary(connect_latency),
+            'fanout_latency': latency_summary([v for values in self.fanout_latency.values() for v in values]),
+            'delivery_latency': latency_summary([v for values in self.delivery_latency.values() for v in values]),
+            'by_type': by_type,
+        }
+
+
+class Command(BaseCommand):
+    help = "Benchmark ChatConsumer fan-out latency, throughput, queries and memory with in-process WebSocket clients."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100, help="Simulated WebSocket clients (N)")
+        parser.add_argument('--rooms', type=int, default=10, help="Rooms the clients are spread across (M)")
+        parser.add_argument('--frames', type=int, default=1000, help="Total frames to send")
+        parser.add_argument('--mix', default='chat=70,typing=15,read=10,edit=5', help="Frame mix as type=weight pairs")
+        parser.add_argument('--concurrency', type=int, default=1, help="Concurrent senders")
+        parser.add_argument('--timeout', type=float, default=5.0, help="Seconds to wait for a frame's fan-out")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('-o', '--output', help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        if options['rooms'] < 1 or options['clients'] < 2 * options['rooms']:
+            raise CommandError("Need at least one room and two clients per room.")
+        parse_mix(options['mix'])
+
+        with isolated_database():
+            from config.asgi import application
+
+            users = self.create_fixtures(options)
+            results = asyncio.run(ChatBenchmark(application, options).run(users))
+
+            params = {key: options[key] for key in ('clients', 'rooms', 'frames', 'mix', 'concurrency', 'seed')}
+            write_report(build_report('chat_consumer', params, results), options['output'], self.stdout)
+
+    def create_fixtures(self, options):
+        users = User.objects.bulk_create(
+            User(username=f'bench_{i}') for i in range(options['clients'])
+        )
+        rooms = ChatRoom.objects.bulk_create(
+            ChatRoom(name=f'bench room {i}', room_type='group') for i in range(options['rooms'])
+        )
+        # Subscribed users skip the free-tier message limit
+        Subscription.objects.bulk_create(Subscription(user=user, is_active=True) for user in users)
+
+        assignments = [(user.id, rooms[i % len(rooms)].id, i % len(rooms)) for i, user in enumerate(users)]
+        RoomMembership.objects.bulk_create(
+            RoomMembership(user_id=user_id, room_id=room_id) for user_id, room_id, _ in assignments
+        )
+        return assignments
@@ -0,0 +1,193 @@
+import asyncio
+import gc
+import os
+import time
+import tracemalloc
+
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.chat.models import ChatRoom, RoomMembership
+from utils.benchmark import build_report, isolated_database, write_report
+
+
+GIB = 1024 ** 3
+
+
+async def idle_application(scope, receive, send):
+    # Accepts and waits: what the in-process test harness alone keeps per connection
+    while True:
+        event = await receive()
+        if event['type'] == 'websocket.connect':
+            await send({'type': 'websocket.accept'})
+        elif event['type'] == 'websocket.disconnect':
+            return
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def drain_output(communicators):
+    # Frames a server would have written to the socket and freed
+    for communicator in communicators:
+        while not communicator.output_queue.empty():
+            communicator.output_queue.get_nowait()
+
+
+async def open_socket(application, path, frames, timeout):
+    communicator = WebsocketCommunicator(application, path)
+    connected, _ = await communicator.connect(timeout=timeout)
+    if not connected:
+        raise CommandError(f"Could not connect to {path}.")
+    for frame in frames:
+        await communicator.send_json_to(frame)
+    return communicator
+
+
+async def open_idle(application, sockets, options):
+    # In batches, so connects overlap their database round trips
+    communicators = []
+    batch = options['concurrency']
+    for start in range(0, len(sockets), batch):
+        communicators += await asyncio.gather(*(
+            open_socket(application, path, frames, options['timeout']) for path, frames in sockets[start:start + batch]
+        ))
+        drain_output(communicators)
+    return communicators
+
+
+async def close_all(communicators, options):
+    batch = options['concurrency']
+    for start in range(0, len(communicators), batch):
+        await asyncio.gather(*(
+            communicator.disconnect(timeout=options['timeout']) for communicator in communicators[start:start + batch]
+        ))
+
+
+async def measure(application, sockets, options, top=0):
+    gc.collect()
+    rss_before = rss_bytes()
+    if top:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    communicators = await open_idle(application, sockets, options)
+    elapsed = time.perf_counter() - started
+    # Let join broadcasts and subscribe replies settle, then drop them
+    await asyncio.sleep(options['settle'])
+    drain_output(communicators)
+    gc.collect()
+
+    result = {'connect_seconds': round(elapsed, 2)}
+    if top:
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        diff = after.compare_to(before, 'lineno')
+        result['traced_bytes'] = sum(stat.size_diff for stat in diff)
+        result['top_allocations'] = [
+            {'site': str(stat.traceback), 'bytes_per_connection': round(stat.size_diff / len(sockets), 1)}
+            for stat in diff[:top]
+        ]
+    else:
+        rss_after = rss_bytes()
+        result['rss_bytes'] = rss_after - rss_before if rss_before is not None else None
+
+    await close_all(communicators, options)
+    return result
+
+
+async def run(application, sockets, options):
+    results = {}
+    # RSS first, on a heap that has not yet grown for these connections; then the traced run
+    harness = [(path, []) for path, _ in sockets]
+    rss_harness = (await measure(idle_application, harness, options))['rss_bytes']
+    rss_total = (await measure(application, sockets, options))['rss_bytes']
+    traced_harness = await measure(idle_application, harness, options, top=1)
+    traced = await measure(application, sockets, options, top=options['top'])
+
+    count = len(sockets)
+    per_connection = (traced['traced_bytes'] - traced_harness['traced_bytes']) / count
+    results['connections'] = count
+    results['bytes_per_connection'] = round(per_connection)
+    results['harness_bytes_per_connection'] = round(traced_harness['traced_bytes'] / count)
+    results['connections_per_gib'] = int(GIB / per_connection) if per_connection > 0 else None
+    if rss_total is not None:
+        rss_per_connection = (rss_total - rss_harness) / count
+        results['rss_bytes_per_connection'] = round(rss_per_connection)
+        results['connections_per_gib_rss'] = int(GIB / rss_per_connection) if rss_per_connection > 0 else None
+    results['connect_seconds'] = traced['connect_seconds']
+    results['top_allocations'] = traced['top_allocations']
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        "Open N idle chat sockets in-process and report the memory each keeps, net of the test "
+        "harness, with the allocation sites that dominate."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=2000, help="Idle sockets opened per endpoint")
+        parser.add_argument('--rooms', type=int, default=200, help="Rooms the sockets are spread across")
+        parser.add_argument('--subscriptions', type=int, default=5, help="Rooms each multiplexed socket subscribes to")
+        parser.add_argument('--endpoint', action='append', choices=('room', 'multiplex'), help="Only these endpoints (repeatable)")
+        parser.add_argument('--concurrency', type=int, default=50, help="Sockets connecting at once")
+        parser.add_argument('--settle', type=float, default=0.5, help="Seconds to let broadcasts settle before measuring")
+        parser.add_argument('--timeout', type=float, default=30.0, help="Seconds to wait for a connect or disconnect")
+        parser.add_argument('--top', type=int, default=15, help="Allocation sites listed per endpoint")
+        parser.add_argument('-o', '--output', help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        if min(options['connections'], options['concurrency']) < 1 or not 1 <= options['subscriptions'] <= options['rooms']:
+            raise CommandError("Need positive --connections and --concurrency, and 1 <= --subscriptions <= --rooms.")
+
+        # Frames are slow under tracemalloc; that is not worth a warning each
+        with isolated_database(), override_settings(CHAT_SLOW_FRAME_MS=float('inf')):
+            from config.asgi import application
+
+            tokens, rooms = self.create_fixtures(options)
+            subscriptions = options['subscriptions']
+            endpoints = {
+                'room': [
+                    (f'/ws/chat/{rooms[i % len(rooms)]}/?token={token}', [])
+                    for i, token in enumerate(tokens)
+                ],
+                'multiplex': [
+                    (f'/ws/chat/?token={token}', [{
+                        'type': 'subscribe',
+                        'rooms': [rooms[(i + k) % len(rooms)] for k in range(subscriptions)],
+                    }])
+                    for i, token in enumerate(tokens)
+                ],
+            }
+            results = {
+                name: asyncio.run(run(application, endpoints[name], options))
+                for name in options['endpoint'] or endpoints
+            }
+
+        params = {key: options[key] for key in ('connections', 'rooms', 'subscriptions')}
+        write_report(build_report('idle_connections', params, results), options['output'], self.stdout)
+
+    def create_fixtures(self, options):
+        users = User.objects.bulk_create(
+            User(username=f'bench_idle_{i}', first_name='Bench', last_name=f'User {i}')
+            for i in range(options['connections'])
+        )
+        rooms = ChatRoom.objects.bulk_create(
+            ChatRoom(name=f'idle room {i}', room_type='group') for i in range(options['rooms'])
+        )
+        RoomMembership.objects.bulk_create(
+            RoomMembership(user=user, room=rooms[(i + k) % len(rooms)])
+            for i, user in enumerate(users)
+            for k in range(options['subscriptions'])
+        )
+        tokens = [str(AccessToken.for_user(user)) for user in users]
+        return tokens, [str(room.id) for room in rooms]
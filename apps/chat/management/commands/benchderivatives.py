@@ -0,0 +1,91 @@
+import io
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageDraw
+
+from apps.chat.imaging import render_derivatives
+from utils.benchmark import build_report, latency_summary, write_report
+
+
+def synthetic_photo(width, height, seed):
+    """A camera-like JPEG: smooth gradients, shapes and sensor noise."""
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        radius = rng.randrange(width // 40, width // 6)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius),
+                     fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    noise = Image.effect_noise((width, height), 24).convert('RGB')
+    image = Image.blend(image, noise, 0.15)
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def timed_render(path):
+    started = time.perf_counter()
+    render_derivatives(path)
+    return time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = "Measure image derivative throughput (images per second per core) of the process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=40)
+        parser.add_argument('--width', type=int, default=4000)
+        parser.add_argument('--height', type=int, default=3000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('-o', '--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['images'] < 1 or options['workers'] < 1:
+            raise CommandError("--images and --workers must be positive.")
+
+        with tempfile.TemporaryDirectory(prefix='bench-derivatives-') as directory:
+            paths = []
+            for i in range(options['images']):
+                path = os.path.join(directory, f'{i}.jpg')
+                with open(path, 'wb') as fh:
+                    fh.write(synthetic_photo(options['width'], options['height'], f"{options['seed']}:{i}"))
+                paths.append(path)
+            source_bytes = sum(os.path.getsize(path) for path in paths)
+
+            # A quarter of the images in-process first: the cost per image without the pool
+            serial = [timed_render(path) for path in paths[:max(1, len(paths) // 4)]]
+
+            with ProcessPoolExecutor(options['workers'], mp_context=multiprocessing.get_context('spawn')) as pool:
+                # Spawning and importing Pillow in every worker happens once per process, not per image
+                list(pool.map(timed_render, paths[:options['workers']]))
+                started = time.perf_counter()
+                latencies = list(pool.map(timed_render, paths))
+                elapsed = time.perf_counter() - started
+
+        cores = min(options['workers'], os.cpu_count() or 1)
+        images_per_second = len(paths) / elapsed
+        results = {
+            'cores_used': cores,
+            'source_mb': round(source_bytes / 2 ** 20, 1),
+            'serial': {
+                'images_per_second': round(len(serial) / sum(serial), 2),
+                'render': latency_summary(serial),
+            },
+            'pool': {
+                'seconds': round(elapsed, 3),
+                'images_per_second': round(images_per_second, 2),
+                'images_per_second_per_core': round(images_per_second / cores, 2),
+                'render': latency_summary(latencies),
+            },
+        }
+        params = {key: options[key] for key in ('images', 'width', 'height', 'workers', 'seed')}
+        write_report(build_report('image_derivatives', params, results), options['output'], self.stdout)
@@ -0,0 +1,153 @@
+import asyncio
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.chat.timers import TimerWheel
+from utils.benchmark import build_report, latency_summary, write_report
+
+
+class Socket:
+    # Stands in for a consumer: the wheel only uses last_active and wheel_slot
+    def __init__(self, pings):
+        self.pings = pings
+        self.last_active = 0.0
+        self.wheel_slot = None
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_sockets(count, silent, rng):
+    return [Socket(pings=rng.random() >= silent) for _ in range(count)]
+
+
+def ping_schedule(sockets, interval_ticks, rng):
+    # Each pinging socket sends a heartbeat every interval, at its own phase
+    schedule = [[] for _ in range(interval_ticks)]
+    for socket in sockets:
+        if socket.pings:
+            schedule[rng.randrange(interval_ticks)].append(socket)
+    return schedule
+
+
+def run_wheel(sockets, schedule, options, rng):
+    clock = VirtualClock()
+    wheel = TimerWheel(options['timeout'], options['tick'], expire=None, clock=clock)
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for socket in sockets:
+        # Staggered connects, each within one ping interval of the socket's first heartbeat
+        clock.now = -rng.uniform(0, options['interval'])
+        wheel.add(socket)
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    ticks = int(options['duration'] / options['tick'])
+    warmup = int(options['timeout'] / options['tick'])
+    tick_latency, examined, touch_seconds, touches, expired = [], [], 0.0, 0, 0
+    for tick in range(1, ticks + 1):
+        clock.now = tick * options['tick']
+        started = time.perf_counter()
+        for socket in schedule[tick % len(schedule)]:
+            socket.last_active = clock.now
+        touch_seconds += time.perf_counter() - started
+        touches += len(schedule[tick % len(schedule)])
+
+        due = len(wheel.slots[(wheel.current + 1) % len(wheel.slots)])
+        started = time.perf_counter()
+        expired += len(wheel.advance(clock.now))
+        if tick > warmup:
+            tick_latency.append(time.perf_counter() - started)
+            examined.append(due)
+    return {
+        'tick_latency': latency_summary(tick_latency),
+        'examined_per_tick_mean': round(sum(examined) / len(examined), 1),
+        'examined_per_tick_max': max(examined),
+        'ping_ns': round(touch_seconds / max(1, touches) * 1e9, 1),
+        'expired': expired,
+        'memory_per_socket_bytes': round(memory / len(sockets), 1),
+    }
+
+
+def run_scan(sockets, options):
+    # One task checking every socket each tick
+    now = options['timeout']
+    latencies = []
+    for _ in range(options['scan_ticks']):
+        started = time.perf_counter()
+        sum(1 for socket in sockets if socket.last_active + options['timeout'] <= now)
+        latencies.append(time.perf_counter() - started)
+    return {'tick_latency': latency_summary(latencies), 'examined_per_tick_mean': len(sockets)}
+
+
+async def run_call_later(sockets, options):
+    # A loop timer per socket, moved on every heartbeat
+    loop = asyncio.get_running_loop()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    handles = [loop.call_later(options['timeout'], lambda: None) for _ in sockets]
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for i, handle in enumerate(handles):
+        handle.cancel()
+        handles[i] = loop.call_later(options['timeout'], lambda: None)
+    ping_seconds = time.perf_counter() - started
+    for handle in handles:
+        handle.cancel()
+    return {
+        'ping_ns': round(ping_seconds / len(handles) * 1e9, 1),
+        'memory_per_socket_bytes': round(memory / len(handles), 1),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure idle deadline tracking for N sockets: the timer wheel against scanning every socket "
+        "per tick and a loop timer per socket. Runs on a virtual clock, without sockets or a database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', default='1000,10000,100000', help="Comma-separated socket counts")
+        parser.add_argument('--timeout', type=float, default=75.0, help="Idle timeout in seconds")
+        parser.add_argument('--tick', type=float, default=1.0, help="Wheel tick in seconds")
+        parser.add_argument('--interval', type=float, default=25.0, help="Seconds between a client's pings")
+        parser.add_argument('--silent', type=float, default=0.01, help="Fraction of sockets that never ping")
+        parser.add_argument('--duration', type=float, default=300.0, help="Simulated seconds")
+        parser.add_argument('--scan-ticks', type=int, default=20, help="Ticks timed for the full scan")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('-o', '--output', help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        try:
+            counts = [int(count) for count in options['connections'].split(',')]
+        except ValueError:
+            raise CommandError("--connections must be comma-separated integers.")
+        if min(counts) < 1 or options['tick'] <= 0 or not options['tick'] <= options['interval'] < options['timeout']:
+            raise CommandError("Need positive counts and tick <= interval < timeout.")
+        if options['duration'] <= options['timeout']:
+            raise CommandError("--duration must exceed --timeout.")
+
+        results = {}
+        for count in counts:
+            rng = random.Random(f"{options['seed']}:{count}")
+            sockets = make_sockets(count, options['silent'], rng)
+            schedule = ping_schedule(sockets, round(options['interval'] / options['tick']), rng)
+            results[count] = {
+                'silent_sockets': sum(not socket.pings for socket in sockets),
+                'wheel': run_wheel(sockets, schedule, options, rng),
+                'scan': run_scan(sockets, options),
+                'call_later': asyncio.run(run_call_later(sockets, options)),
+            }
+
+        params = {key: options[key] for key in ('connections', 'timeout', 'tick', 'interval', 'silent', 'duration', 'seed')}
+        write_report(build_report('heartbeat', params, results), options['output'], self.stdout)
@@ -0,0 +1,109 @@
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.views.static import serve
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.chat.models import ChatRoom, Message, RoomMembership
+from apps.chat.views import MessageMediaView
+from utils.benchmark import build_report, isolated_database, latency_summary, write_report
+
+
+def consume(response):
+    total = 0
+    for block in response.streaming_content if response.streaming else [response.content]:
+        total += len(block)
+    response.close()
+    return total
+
+
+def measure(requests, handler):
+    """Latencies, bytes sent and the largest tracemalloc peak of one download."""
+    latencies, sent = [], 0
+    for headers in requests:
+        started = time.perf_counter()
+        sent += consume(handler(headers))
+        latencies.append(time.perf_counter() - started)
+
+    peak = 0
+    for headers in requests[:5]:
+        tracemalloc.start()
+        consume(handler(headers))
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return latencies, sent, peak
+
+
+def summary(latencies, sent, peak):
+    return {
+        'mb_sent': round(sent / 2 ** 20, 1),
+        'mb_per_second': round(sent / 2 ** 20 / sum(latencies), 1),
+        'peak_kb_per_download': round(peak / 1024, 1),
+        'latency': latency_summary(latencies),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare downloads of a chat video through the permission-checked media view with the "
+        "development static() media route: throughput, bytes sent for Range requests and memory per download."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=64)
+        parser.add_argument('--downloads', type=int, default=10)
+        parser.add_argument('--ranges', type=int, default=200, help="Random 256 KB Range requests, as a video player seeking")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('-o', '--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['size_mb'] < 1 or options['downloads'] < 1:
+            raise CommandError("--size-mb and --downloads must be positive.")
+
+        rng = random.Random(options['seed'])
+        size = options['size_mb'] * 2 ** 20
+        name = 'chat/videos/bench.mp4'
+        range_requests = []
+        for _ in range(options['ranges']):
+            start = rng.randrange(size - 256 * 1024)
+            range_requests.append({'HTTP_RANGE': f'bytes={start}-{start + 256 * 1024 - 1}'})
+
+        with tempfile.TemporaryDirectory(prefix='bench-media-') as media_root, \
+                override_settings(MEDIA_ROOT=media_root, CHAT_MEDIA_OFFLOAD=''), isolated_database():
+            os.makedirs(os.path.join(media_root, 'chat/videos'))
+            with open(os.path.join(media_root, name), 'wb') as fh:
+                for _ in range(options['size_mb']):
+                    fh.write(os.urandom(2 ** 20))
+
+            user = User.objects.create_user('bench-media', password='x')
+            room = ChatRoom.objects.create(name='bench', created_by=user)
+            RoomMembership.objects.create(room=room, user=user)
+            message = Message.objects.create(room=room, sender=user, message_type='video', video=name)
+
+            factory = APIRequestFactory()
+            view = MessageMediaView.as_view()
+
+            def static_route(headers):
+                return serve(factory.get(f'/media/{name}', **headers), name, document_root=media_root)
+
+            def media_view(headers):
+                request = factory.get(f'/api/chat/messages/{message.id}/media/original/', **headers)
+                force_authenticate(request, user=user)
+                return view(request, message_id=message.id, variant='original')
+
+            full = [{}] * options['downloads']
+            results = {}
+            for label, handler in (('static', static_route), ('media_view', media_view)):
+                results[label] = {
+                    'full': summary(*measure(full, handler)),
+                    'ranges': summary(*measure(range_requests, handler)) if range_requests else None,
+                }
+
+        params = {key: options[key] for key in ('size_mb', 'downloads', 'ranges', 'seed')}
+        write_report(build_report('media_downloads', params, results), options['output'], self.stdout)
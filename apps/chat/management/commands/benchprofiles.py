@@ -0,0 +1,122 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+
+from apps.chat.exports import iter_room_records
+from apps.chat.models import ChatRoom, Message, RoomMembership
+from apps.chat.profiles import sender_profiles
+from apps.chat.serializers import MessageSerializer, UserSerializer
+from utils.benchmark import build_report, isolated_database, latency_summary, write_report
+
+
+class StockMessageSerializer(MessageSerializer):
+    # The sender as serialized before the profile cache: a nested User
+    sender = UserSerializer(read_only=True)
+
+    class Meta(MessageSerializer.Meta):
+        list_serializer_class = serializers.ListSerializer
+
+
+def seed_room(senders, messages, rng):
+    users = User.objects.bulk_create([
+        User(username=f'bench-profile-{i}', first_name=f'First{i}', last_name=f'Last{i}') for i in range(senders)
+    ])
+    room = ChatRoom.objects.create(name='bench-profiles', room_type='group', created_by=users[0])
+    RoomMembership.objects.bulk_create([RoomMembership(room=room, user=user) for user in users])
+    started = timezone.now() - timedelta(days=30)
+    with transaction.atomic():
+        created = Message.objects.bulk_create([
+            Message(room=room, sender=rng.choice(users), content=f'message {i}') for i in range(messages)
+        ], batch_size=1000)
+        for i, message in enumerate(created):
+            message.created_at = started + timedelta(seconds=i)
+        Message.objects.bulk_update(created, ['created_at'], batch_size=1000)
+    return room, users
+
+
+def user_queries(captured):
+    return sum('"auth_user"' in query['sql'] for query in captured)
+
+
+def time_pages(room, serializer_class, cursors, page_size, select_sender=False):
+    latencies, queries, profile_queries = [], 0, 0
+    for cursor in cursors:
+        connection.queries_log.clear()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as captured:
+            page = Message.objects.filter(room=room, deleted_at__isnull=True, created_at__lt=cursor)
+            page = page.select_related('image_derivative', *(['sender'] if select_sender else []))
+            serializer_class(page.order_by('-created_at', '-id')[:page_size], many=True).data
+        latencies.append(time.perf_counter() - started)
+        queries += len(captured)
+        profile_queries += user_queries(captured)
+    return {
+        'latency': latency_summary(latencies),
+        'queries_per_page': round(queries / len(cursors), 2),
+        'user_queries_per_page': round(profile_queries / len(cursors), 2),
+    }
+
+
+def time_export(room):
+    connection.queries_log.clear()
+    started = time.perf_counter()
+    with CaptureQueriesContext(connection) as captured:
+        rows = sum(1 for _ in iter_room_records(room.id, chunk_size=500))
+    return {'rows': rows, 'seconds': round(time.perf_counter() - started, 3), 'user_queries': user_queries(captured)}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure sender profile lookups when serializing history pages and exports: a nested "
+        "User per message, select_related('sender') and the profile cache, cold and warm."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--senders', type=int, default=300)
+        parser.add_argument('--messages', type=int, default=20_000)
+        parser.add_argument('--pages', type=int, default=200)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('-o', '--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if min(options['senders'], options['messages'], options['pages'], options['page_size']) < 1:
+            raise CommandError("--senders, --messages, --pages and --page-size must be positive.")
+
+        rng = random.Random(options['seed'])
+        with isolated_database():
+            room, users = seed_room(options['senders'], options['messages'], rng)
+            bounds = list(Message.objects.filter(room=room).values_list('created_at', flat=True))
+            cursors = [rng.choice(bounds) for _ in range(options['pages'])]
+            page_size = options['page_size']
+
+            sender_profiles.clear()
+            results = {
+                'history_nested_user': time_pages(room, StockMessageSerializer, cursors, page_size),
+                'history_select_related': time_pages(room, StockMessageSerializer, cursors, page_size, select_sender=True),
+                'history_profile_cache_cold': time_pages(room, MessageSerializer, cursors[:1], page_size),
+                'history_profile_cache': time_pages(room, MessageSerializer, cursors, page_size),
+            }
+            sender_profiles.clear()
+            results['export_cold'] = time_export(room)
+            results['export_warm'] = time_export(room)
+
+            # A rename drops only that profile
+            users[0].first_name = 'Renamed'
+            users[0].save()
+            results['after_rename'] = time_pages(room, MessageSerializer, cursors[:20], page_size)
+            results['cache'] = {
+                'hits': sender_profiles.hits,
+                'misses': sender_profiles.misses,
+                'hit_rate': round(sender_profiles.hits / max(1, sender_profiles.hits + sender_profiles.misses), 4),
+            }
+
+        params = {key: options[key] for key in ('senders', 'messages', 'pages', 'page_size', 'seed')}
+        write_report(build_report('sender_profiles', params, results), options['output'], self.stdout)
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.benchmark import build_report, latency_summary, write_report
+from utils.startup import cold_start, import_profile, package_totals
+
+
+# What a fresh worker runs before it can serve; each entry point picks its settings
+TARGETS = {
+    # Ready for sockets: the ASGI module imports the consumers
+    'asgi': 'import config.asgi',
+    # The URLconf (every view, serializer and their dependencies) loads on the first HTTP request
+    'asgi_first_request': (
+        'import config.asgi\n'
+        'from django.urls import get_resolver\n'
+        'get_resolver().url_patterns'
+    ),
+    'realtime': 'import config.realtime',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure cold start of the ASGI entry points in fresh interpreters, with an import time "
+        "profile per module and per package."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=10, help="Cold starts timed per target.")
+        parser.add_argument('--top', type=int, default=15, help="Slowest modules and packages listed per target.")
+        parser.add_argument('--target', action='append', choices=list(TARGETS), help="Only these targets (repeatable).")
+        parser.add_argument('-o', '--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1 or options['top'] < 1:
+            raise CommandError("--runs and --top must be positive.")
+
+        results = {}
+        for name in options['target'] or TARGETS:
+            code = TARGETS[name]
+            # Warm the OS page cache and .pyc files so every run measures Python, not the disk
+            cold_start(code)
+            seconds = [cold_start(code) for _ in range(options['runs'])]
+            modules = import_profile(code)
+            slowest = sorted(modules, key=lambda entry: entry['self_ms'], reverse=True)[:options['top']]
+            results[name] = {
+                'cold_start': latency_summary(seconds),
+                'modules_imported': len(modules),
+                'import_ms_total': round(sum(entry['self_ms'] for entry in modules), 1),
+                'slowest_packages': dict(list(package_totals(modules).items())[:options['top']]),
+                'slowest_modules': slowest,
+            }
+
+        params = {key: options[key] for key in ('runs', 'top', 'target')}
+        write_report(build_report('startup', params, results), options['output'], self.stdout)
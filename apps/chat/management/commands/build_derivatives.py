@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.chat.derivatives import DerivativePipeline
+from apps.chat.models import ImageDerivative
+
+
+class Command(BaseCommand):
+    help = (
+        "Render image derivatives still pending because the pipeline queue was full or the "
+        "server restarted, optionally retrying failed ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (defaults to CHAT_DERIVATIVE_WORKERS)")
+        parser.add_argument('--min-age', type=int, default=300,
+                            help="Skip rows younger than this many seconds; a server may still be rendering them")
+        parser.add_argument('--retry-failed', action='store_true', help="Render failed rows again")
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or settings.CHAT_DERIVATIVE_WORKERS
+        statuses = ['pending', 'failed'] if options['retry_failed'] else ['pending']
+        started = timezone.now()
+        queryset = ImageDerivative.objects.filter(
+            status__in=statuses, created_at__lt=started - timedelta(seconds=options['min_age'])
+        )
+
+        pipeline = DerivativePipeline(workers, queue_size=2 * workers)
+        submitted = 0
+        for derivative in queryset.iterator():
+            pipeline.submit(derivative, block=True)
+            submitted += 1
+        pipeline.shutdown(wait=True)
+
+        failed = ImageDerivative.objects.filter(status='failed', updated_at__gte=started).count()
+        self.stdout.write(self.style.SUCCESS(f"Rendered derivatives of {submitted - failed} image(s), {failed} failed"))
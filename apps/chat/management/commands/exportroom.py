@@ -0,0 +1,56 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.chat.models import ChatRoom
+from apps.chat.exports import (
+    DEFAULT_CHUNK_SIZE,
+    EXPORT_FORMATS,
+    iter_room_export,
+    parse_export_bound,
+)
+
+
+class Command(BaseCommand):
+    help = "Stream all messages and read receipts of a chat room as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('room_id', help="ID of the room to export")
+        parser.add_argument('--format', dest='export_format', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--since', help="Inclusive lower bound (ISO date or datetime)")
+        parser.add_argument('--until', help="Exclusive upper bound (ISO date or datetime)")
+        parser.add_argument('--gzip', action='store_true', help="Gzip the output on the fly")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Rows fetched per DB round trip")
+        parser.add_argument('-o', '--output', help="Output file (defaults to stdout)")
+
+    def handle(self, *args, **options):
+        room_id = options['room_id']
+        try:
+            since = parse_export_bound(options['since'])
+            until = parse_export_bound(options['until'], upper=True)
+            room_exists = ChatRoom.objects.filter(id=room_id).exists()
+        except Exception as e:
+            raise CommandError(str(e))
+
+        if not room_exists:
+            raise CommandError(f"Room {room_id} not found.")
+
+        blocks = iter_room_export(
+            room_id,
+            options['export_format'],
+            since=since,
+            until=until,
+            compress=options['gzip'],
+            chunk_size=options['chunk_size'],
+        )
+
+        output = options['output']
+        if output:
+            with open(output, 'wb') as fh:
+                for block in blocks:
+                    fh.write(block)
+            self.stderr.write(self.style.SUCCESS(f"Exported room {room_id} to {output}"))
+        else:
+            for block in blocks:
+                sys.stdout.buffer.write(block)
+            sys.stdout.buffer.flush()
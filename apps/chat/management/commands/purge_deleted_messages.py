@@ -0,0 +1,40 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.chat.purge import prune_events_batch, purge_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove deleted (tombstoned) messages and their read receipts, and room events older "
+        "than CHAT_EVENT_RETENTION, in small batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help="Keep tombstones younger than this many seconds, so reconnecting clients still see the delete")
+        parser.add_argument('--pause', type=float, default=0.05, help="Seconds to sleep between batches, to let other writers in")
+
+    def drain(self, purge, before, options):
+        total = 0
+        while batch := purge(before, options['batch_size']):
+            total += batch
+            if batch < options['batch_size']:
+                break
+            time.sleep(options['pause'])
+        return total
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        now = timezone.now()
+        purged = self.drain(purge_batch, now - timedelta(seconds=options['min_age']), options)
+        pruned = self.drain(prune_events_batch, now - timedelta(seconds=settings.CHAT_EVENT_RETENTION), options)
+
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} deleted message(s) and {pruned} expired room event(s)"))
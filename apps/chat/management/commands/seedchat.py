@@ -0,0 +1,249 @@
+import random
+import time
+import uuid
+from collections import deque
+from multiprocessing import get_context
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from apps.chat.models import ChatRoom, RoomMembership, Message, MessageReadStatus
+from apps.subscription.models import Subscription
+
+
+WORDS = (
+    "hey hello thanks sure okay maybe tomorrow today meeting call later lunch "
+    "coffee deploy build review merge ticket bug fix release update plan idea "
+    "great nice cool agreed done working busy free weekend morning evening "
+    "photo link doc draft budget client launch sprint demo question answer"
+).split()
+
+# Most recent messages of a room a reply may point at
+REPLY_WINDOW = 50
+
+
+def _uuid(rng):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def _room_rng(seed, room_index):
+    # Seeded per room so output does not depend on how rooms are split across workers
+    return random.Random(f"{seed}:room:{room_index}")
+
+
+def _sentence(rng):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(2, 14))).capitalize()
+
+
+def _seed_room_messages(task):
+    """Generate and insert messages and read statuses for a slice of rooms."""
+    seed, rooms, options = task
+    batch_size = options['batch_size']
+    messages, statuses = [], []
+    totals = {'messages': 0, 'read_statuses': 0}
+
+    def flush():
+        Message.objects.bulk_create(messages, batch_size=batch_size)
+        MessageReadStatus.objects.bulk_create(statuses, batch_size=batch_size)
+        totals['messages'] += len(messages)
+        totals['read_statuses'] += len(statuses)
+        messages.clear()
+        statuses.clear()
+
+    for room_index, room_id, member_ids, message_count in rooms:
+        rng = _room_rng(seed, room_index)
+        recent = deque(maxlen=REPLY_WINDOW)
+        for _ in range(message_count):
+            sender_id = rng.choice(member_ids)
+            reply_to_id = None
+            if recent and rng.random() < options['reply_ratio']:
+                reply_to_id = rng.choice(recent)
+
+            message_id = _uuid(rng)
+            messages.append(Message(
+                id=message_id,
+                room_id=room_id,
+                sender_id=sender_id,
+                content=_sentence(rng),
+                reply_to_id=reply_to_id,
+            ))
+            recent.append(message_id)
+
+            if len(member_ids) > 1 and rng.random() < options['read_ratio']:
+                readers = rng.sample(member_ids, k=min(len(member_ids), rng.randint(1, 5)))
+                statuses.extend(
+                    MessageReadStatus(message_id=message_id, user_id=user_id)
+                    for user_id in readers if user_id != sender_id
+                )
+
+            if len(messages) >= batch_size:
+                flush()
+
+    flush()
+    return totals
+
+
+class Command(BaseCommand):
+    help = "Generate deterministic synthetic users, rooms, messages and subscriptions for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--rooms', type=int, default=200)
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--group-ratio', type=float, default=0.3, help="Share of rooms that are group rooms")
+        parser.add_argument('--min-group-size', type=int, default=3)
+        parser.add_argument('--max-group-size', type=int, default=5000)
+        parser.add_argument('--group-size-alpha', type=float, default=1.2, help="Pareto shape of group sizes (lower = more skewed)")
+        parser.add_argument('--reply-ratio', type=float, default=0.15, help="Share of messages replying to a recent one")
+        parser.add_argument('--read-ratio', type=float, default=0.5, help="Share of messages with read statuses")
+        parser.add_argument('--subscribed-ratio', type=float, default=0.3, help="Share of users with an active subscription")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=1, help="Worker processes used for messages")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='seed', help="Username prefix of generated users")
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError("At least 2 users are required.")
+
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}_user_').exists():
+            raise CommandError(f"Users with prefix '{prefix}' already exist. Use another --prefix or a fresh database.")
+
+        workers = options['workers']
+        if workers > 1 and connection.vendor == 'sqlite':
+            self.stderr.write(self.style.WARNING("SQLite allows a single writer; falling back to 1 worker."))
+            workers = 1
+
+        started = time.perf_counter()
+        rng = random.Random(options['seed'])
+
+        user_ids = self.seed_users(options)
+        rooms = self.seed_rooms(rng, user_ids, options)
+        self.log(f"{len(user_ids)} users, {len(rooms)} rooms", started)
+
+        totals = self.seed_messages(rng, rooms, workers, options)
+        self.log(f"{totals['messages']} messages, {totals['read_statuses']} read statuses", started)
+
+        subscriptions = self.seed_subscriptions(rng, user_ids, options)
+        self.log(f"{subscriptions} subscriptions", started)
+
+        self.stdout.write(self.style.SUCCESS(f"Seeding finished in {time.perf_counter() - started:.1f}s"))
+
+    def log(self, message, started):
+        self.stdout.write(f"[{time.perf_counter() - started:8.1f}s] {message}")
+
+    def seed_users(self, options):
+        prefix = options['prefix']
+        # Hashing is deliberately slow, so every user shares one precomputed hash
+        password = make_password('password')
+        users = (
+            User(username=f'{prefix}_user_{i}', first_name='Seed', last_name=f'User {i}', password=password)
+            for i in range(options['users'])
+        )
+        self.bulk_insert(User, users, options['batch_size'])
+
+        ids = dict(User.objects.filter(username__startswith=f'{prefix}_user_').values_list('username', 'id'))
+        return [ids[f'{prefix}_user_{i}'] for i in range(options['users'])]
+
+    def seed_rooms(self, rng, user_ids, options):
+        max_group = min(options['max_group_size'], len(user_ids))
+        min_group = min(options['min_group_size'], max_group)
+
+        # A pair of users has at most one private room, as get_or_create_direct_room enforces
+        dm_pairs = set()
+        max_dm_pairs = len(user_ids) * (len(user_ids) - 1) // 2
+
+        rooms, memberships = [], []
+        for room_index in range(options['rooms']):
+            # Once every pair has its private room, the rest are group rooms
+            if rng.random() < options['group_ratio'] or len(dm_pairs) == max_dm_pairs:
+                room_type = 'group'
+                size = int(min_group * rng.paretovariate(options['group_size_alpha']))
+                member_ids = rng.sample(user_ids, k=max(min_group, min(size, max_group)))
+            else:
+                room_type = 'private'
+                member_ids = rng.sample(user_ids, k=2)
+                while frozenset(member_ids) in dm_pairs:
+                    member_ids = rng.sample(user_ids, k=2)
+                dm_pairs.add(frozenset(member_ids))
+
+            room_id = _uuid(rng)
+            rooms.append((room_index, room_id, room_type, member_ids))
+            memberships.extend(
+                RoomMembership(
+                    room_id=room_id,
+                    user_id=user_id,
+                    role='admin' if position == 0 else 'member',
+                )
+                for position, user_id in enumerate(member_ids)
+            )
+
+        self.bulk_insert(ChatRoom, (
+            ChatRoom(
+                id=room_id,
+                name=f"{options['prefix']} group {room_index}" if room_type == 'group' else None,
+                room_type=room_type,
+                created_by_id=member_ids[0],
+                # The canonical (low, high) key DM lookups go through
+                dm_user_low_id=min(member_ids) if room_type == 'private' else None,
+                dm_user_high_id=max(member_ids) if room_type == 'private' else None,
+            )
+            for room_index, room_id, room_type, member_ids in rooms
+        ), options['batch_size'])
+        self.bulk_insert(RoomMembership, memberships, options['batch_size'])
+        return rooms
+
+    def seed_messages(self, rng, rooms, workers, options):
+        # Busier rooms get more traffic: weight by member count times a random activity factor
+        weights = [len(member_ids) ** 0.5 * rng.expovariate(1.0) for _, _, _, member_ids in rooms]
+        total_weight = sum(weights) or 1
+        counts = [int(options['messages'] * weight / total_weight) for weight in weights]
+        for i in range(options['messages'] - sum(counts)):
+            counts[i % len(counts)] += 1
+
+        room_tasks = [
+            (room_index, room_id, member_ids, count)
+            for (room_index, room_id, _, member_ids), count in zip(rooms, counts)
+            if count
+        ]
+
+        if workers <= 1:
+            return _seed_room_messages((options['seed'], room_tasks, options))
+
+        # Forked workers must not share the parent's DB connection
+        connections.close_all()
+        slices = [room_tasks[i::workers] for i in range(workers)]
+        with get_context('fork').Pool(workers) as pool:
+            results = pool.map(_seed_room_messages, [(options['seed'], rooms_slice, options) for rooms_slice in slices])
+
+        return {
+            key: sum(result[key] for result in results)
+            for key in ('messages', 'read_statuses')
+        }
+
+    def seed_subscriptions(self, rng, user_ids, options):
+        subscriptions = []
+        for i, user_id in enumerate(user_ids):
+            if rng.random() < options['subscribed_ratio']:
+                subscriptions.append(Subscription(
+                    user_id=user_id,
+                    stripe_customer_id=f"cus_{options['prefix']}{i}",
+                    stripe_subscription_id=f"sub_{options['prefix']}{i}",
+                    subscription_length=rng.randint(1, 24),
+                    is_active=True,
+                ))
+        self.bulk_insert(Subscription, subscriptions, options['batch_size'])
+        return len(subscriptions)
+
+    def bulk_insert(self, model, objects, batch_size):
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                model.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            model.objects.bulk_create(batch)
@@ -0,0 +1,30 @@
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.chat.presence import announce_offline, sweep_stale_nodes
+
+
+class Command(BaseCommand):
+    help = (
+        "Clear the online flags held by chat worker processes that stopped heartbeating. "
+        "Workers sweep on start and on every heartbeat; this is for when none is running."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--timeout', type=int, default=None,
+            help="Seconds without a heartbeat after which a process is dead (defaults to CHAT_PRESENCE_TIMEOUT)"
+        )
+
+    def handle(self, *args, **options):
+        timeout = settings.CHAT_PRESENCE_TIMEOUT if options['timeout'] is None else options['timeout']
+        if timeout < 0:
+            raise CommandError("--timeout must not be negative.")
+
+        changes = sweep_stale_nodes(timeout)
+        async_to_sync(announce_offline)(changes)
+        users = sum(len(change['user_ids']) for change in changes.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Marked {users} membership(s) offline in {len(changes)} room(s)"
+        ))
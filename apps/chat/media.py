@@ -0,0 +1,155 @@
+"""
+Serving chat attachments with HTTP Range and conditional request support.
+
+Files are either streamed from the storage backend in fixed-size blocks, so
+a download holds one CHAT_MEDIA_CHUNK_SIZE buffer however large the file, or
+handed to the web server with X-Sendfile / X-Accel-Redirect when
+CHAT_MEDIA_OFFLOAD is set. The web server then handles ranges itself.
+
+Message payloads link to the membership-checked view (`media_url`), never
+to the storage URL, and MEDIA_URL itself is not served.
+"""
+import mimetypes
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CACHE_CONTROL = 'private, max-age=3600'
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def media_url(message_id, variant='original'):
+    """Path of a message attachment on the download view."""
+    return reverse('message_media', args=[message_id, variant])
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single-range `Range` header, or None to
+    serve the whole file. Multi-range requests are answered in full, which
+    RFC 9110 allows.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range: the final N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def _if_range_matches(request, etag, modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('W/'):
+        # If-Range only matches strong validators (RFC 9110 13.1.5)
+        return False
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(modified)
+
+
+def iter_file(fh, start, length, chunk_size):
+    try:
+        fh.seek(start)
+        remaining = length
+        while remaining > 0:
+            block = fh.read(min(chunk_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    finally:
+        fh.close()
+
+
+async def aiter_file(blocks):
+    # File reads need no database connection, so downloads run in parallel threads
+    sentinel = object()
+    next_block = sync_to_async(next, thread_sensitive=False)
+    while (block := await next_block(blocks, sentinel)) is not sentinel:
+        yield block
+
+
+def _content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def _offload_response(field_file):
+    """
+    Let the web server send the file, Range requests included. Returns None
+    when the storage backend has no local path to hand over.
+    """
+    response = HttpResponse(content_type=_content_type(field_file.name))
+    if settings.CHAT_MEDIA_OFFLOAD == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = settings.CHAT_MEDIA_ACCEL_PREFIX + field_file.name
+        return response
+    try:
+        response['X-Sendfile'] = field_file.path
+    except NotImplementedError:
+        return None
+    return response
+
+
+def serve_field_file(request, field_file):
+    """Response for a stored file honouring Range, If-Range and conditional headers."""
+    storage = field_file.storage
+    size = storage.size(field_file.name)
+    modified = storage.get_modified_time(field_file.name).timestamp()
+    etag = quote_etag(f'{size:x}-{int(modified * 1_000_000):x}')
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(modified))
+    if response is None and settings.CHAT_MEDIA_OFFLOAD:
+        response = _offload_response(field_file)
+    if response is None:
+        response = _streaming_response(request, field_file, size, etag, modified)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    response['Cache-Control'] = CACHE_CONTROL
+    if response.status_code != 416:
+        response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _streaming_response(request, field_file, size, etag, modified):
+    try:
+        byte_range = parse_range(request.headers.get('Range'), size) if _if_range_matches(request, etag, modified) else None
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1 if size else 0
+    blocks = iter_file(field_file.storage.open(field_file.name, 'rb'), start, length, settings.CHAT_MEDIA_CHUNK_SIZE)
+    if isinstance(request, ASGIRequest):
+        blocks = aiter_file(blocks)
+
+    response = StreamingHttpResponse(blocks, content_type=_content_type(field_file.name), status=206 if byte_range else 200)
+    response['Content-Length'] = str(length)
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
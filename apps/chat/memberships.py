@@ -0,0 +1,95 @@
+"""
+Bulk room membership changes.
+
+Adding or removing thousands of members is a constant number of
+statements: the existing memberships are read once, the new ones inserted
+with batched `bulk_create(ignore_conflicts=True)` and removals deleted with
+one set-based DELETE, all in one transaction. Sockets learn about the change
+from one `membership_changed` event on the room group; those of removed
+members drop the room, which is the only place membership is cached.
+"""
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+
+from .groups import broadcast_to_room
+from .models import ChatRoom, RoomMembership, TypingIndicator
+
+
+BULK_BATCH_SIZE = 1000
+
+
+def _existing_users(user_ids):
+    return set(User.objects.filter(id__in=user_ids, is_active=True).values_list('id', flat=True))
+
+
+def _insert_members(room_id, user_ids, role='member'):
+    RoomMembership.objects.bulk_create(
+        [RoomMembership(room_id=room_id, user_id=user_id, role=role) for user_id in user_ids],
+        batch_size=BULK_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def create_room(creator, name, room_type, member_ids):
+    """Create a room with `creator` as admin and the other existing users as members."""
+    member_ids = _existing_users(set(member_ids) - {creator.id})
+    with transaction.atomic():
+        room = ChatRoom.objects.create(name=name, room_type=room_type, created_by=creator)
+        _insert_members(room.id, [creator.id], role='admin')
+        _insert_members(room.id, sorted(member_ids))
+    return room, member_ids
+
+
+def get_or_create_direct_room(user, other_id):
+    """
+    (room, created) for the private room of `user` and `other_id`, found by
+    its indexed (dm_user_low, dm_user_high) key. Concurrent first requests
+    race on the unique constraint and the losers read the winner's room.
+    """
+    low, high = sorted((user.id, other_id))
+    lookup = {'room_type': 'private', 'dm_user_low_id': low, 'dm_user_high_id': high}
+    try:
+        return ChatRoom.objects.get(**lookup), False
+    except ChatRoom.DoesNotExist:
+        pass
+    try:
+        with transaction.atomic():
+            room = ChatRoom.objects.create(created_by=user, **lookup)
+            _insert_members(room.id, [low, high])
+    except IntegrityError:
+        return ChatRoom.objects.get(**lookup), False
+    return room, True
+
+
+def add_members(room_id, user_ids):
+    """Add existing users to a room; returns the ids actually added."""
+    with transaction.atomic():
+        current = set(RoomMembership.objects.filter(room_id=room_id, user_id__in=user_ids).values_list('user_id', flat=True))
+        added = _existing_users(set(user_ids) - current)
+        # Conflicts only come from a concurrent add of the same user
+        _insert_members(room_id, sorted(added))
+    if added:
+        membership_changed(room_id, added=added)
+    return added
+
+
+def remove_members(room_id, user_ids):
+    """Remove users from a room; returns the ids actually removed."""
+    with transaction.atomic():
+        memberships = RoomMembership.objects.filter(room_id=room_id, user_id__in=user_ids)
+        removed = set(memberships.values_list('user_id', flat=True))
+        memberships.delete()
+        TypingIndicator.objects.filter(room_id=room_id, user_id__in=removed).delete()
+    if removed:
+        membership_changed(room_id, removed=removed)
+    return removed
+
+
+def membership_changed(room_id, added=(), removed=()):
+    async_to_sync(broadcast_to_room)(room_id, {
+        'type': 'membership_changed',
+        'added': sorted(added),
+        'removed': sorted(removed),
+        'member_count': RoomMembership.objects.filter(room_id=room_id).count(),
+    })
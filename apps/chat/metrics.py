@@ -0,0 +1,60 @@
+from channels.layers import InMemoryChannelLayer, channel_layers
+
+from utils.metrics import SIZE_BUCKETS, registry
+
+
+CONNECTS = registry.counter(
+    'chat_connects_total', "WebSocket connections accepted by ChatConsumer.")
+REJECTIONS = registry.counter(
+    'chat_connect_rejections_total', "WebSocket connections rejected by ChatConsumer.", ['reason'])
+DISCONNECTS = registry.counter(
+    'chat_disconnects_total', "ChatConsumer disconnects of accepted connections.")
+IDLE_CLOSES = registry.counter(
+    'chat_idle_closes_total', "Sockets closed for missing their heartbeat deadline.")
+OPEN_CONNECTIONS = registry.gauge(
+    'chat_open_connections', "WebSocket connections currently open in this process.")
+FRAMES = registry.counter(
+    'chat_frames_total', "Frames handled by ChatConsumer.", ['frame_type'])
+HANDLER_LATENCY = registry.histogram(
+    'chat_handler_latency_seconds', "Wall time spent handling a frame.", ['frame_type'])
+HANDLER_QUERIES = registry.histogram(
+    'chat_handler_queries', "Database queries issued while handling a frame.", ['frame_type'],
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 34))
+FANOUT = registry.histogram(
+    'chat_group_send_fanout', "Channels reached by a room group_send.", ['event_type'],
+    buckets=SIZE_BUCKETS)
+DERIVATIVE_JOBS = registry.counter(
+    'chat_image_derivative_jobs_total', "Image derivative renders by result.", ['result'])
+DERIVATIVE_LATENCY = registry.histogram(
+    'chat_image_derivative_seconds', "Time from queueing an image to storing its derivatives.")
+
+
+def observe_frame(stats):
+    # Frame listener fed by apps.chat.instrumentation.track_frame
+    FRAMES.inc(stats.frame_type)
+    HANDLER_LATENCY.observe(stats.wall_time, stats.frame_type)
+    HANDLER_QUERIES.observe(stats.queries, stats.frame_type)
+
+
+def group_size(channel_layer, group):
+    """Number of channels in a group, when the layer can tell without a round trip."""
+    if isinstance(channel_layer, InMemoryChannelLayer):
+        return len(channel_layer.groups.get(group, ()))
+    return None
+
+
+def _queue_depth():
+    # Only the in-memory layer keeps its queues in this process
+    layer = channel_layers.backends.get('default')
+    if not isinstance(layer, InMemoryChannelLayer):
+        return []
+    depths = [queue.qsize() for queue in list(layer.channels.values())]
+    return [
+        (('total',), sum(depths)),
+        (('max',), max(depths, default=0)),
+        (('channels',), len(depths)),
+    ]
+
+
+registry.callback_gauge(
+    'chat_channel_layer_queue_depth', "Messages waiting in the in-memory channel layer.", _queue_depth, ['stat'])
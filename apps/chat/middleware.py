@@ -8,6 +8,33 @@ from urllib.parse import parse_qs
 
 User = get_user_model()
 
+# Shared by every unauthenticated socket; it holds no per-user state
+ANONYMOUS_USER = AnonymousUser()
+
+
+class SocketUser:
+    """
+    The authenticated user of a socket.
+
+    Consumers keep their user for as long as the socket is open and only
+    read its id and username, so this stands in for a User instance and
+    its fields, _state and caches. Queries filter on `user.id`.
+    """
+    __slots__ = ('id', 'username')
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __repr__(self):
+        return f'<SocketUser {self.id} {self.username}>'
+
 
 class JWTAuthMiddleware(BaseMiddleware):
     """
@@ -16,39 +43,36 @@ class JWTAuthMiddleware(BaseMiddleware):
     """
 
     async def __call__(self, scope, receive, send):
+        # This frame stays suspended for the socket's lifetime, so everything
+        # parsed on the way (query, token, claims) is kept out of its locals
+        return await self.inner(dict(scope, user=await self.authenticate(scope)), receive, send)
+
+    async def authenticate(self, scope):
         # Extract token from query string
         query_string = scope.get('query_string', b'').decode()
         query_params = parse_qs(query_string)
         token = query_params.get('token', [None])[0]
+        if not token:
+            return ANONYMOUS_USER
 
-        # Authenticate user
-        if token:
-            try:
-                # Validate token
-                access_token = AccessToken(token)
-                user_id = access_token['user_id']
-                
-                # Get user from database
-                scope['user'] = await self.get_user(user_id)
-            except (InvalidToken, TokenError, KeyError) as e:
-                print(f"JWT Authentication failed: {e}")
-                scope['user'] = AnonymousUser()
-        else:
-            scope['user'] = AnonymousUser()
-
-        return await super().__call__(scope, receive, send)
+        try:
+            # Validate token
+            access_token = AccessToken(token)
+            user_id = access_token['user_id']
+        except (InvalidToken, TokenError, KeyError) as e:
+            print(f"JWT Authentication failed: {e}")
+            return ANONYMOUS_USER
+        return await self.get_user(user_id)
 
     @database_sync_to_async
     def get_user(self, user_id):
-        """Fetch user from database"""
-        try:
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            return AnonymousUser()
+        """Fetch the user's id and username from the database"""
+        row = User.objects.filter(id=user_id).values_list('id', 'username').first()
+        return SocketUser(*row) if row else ANONYMOUS_USER
 
 
 def JWTAuthMiddlewareStack(inner):
     """
     Helper function to wrap the ASGI application with JWT middleware
     """
-    return JWTAuthMiddleware(inner)
\ No newline at end of file
+    return JWTAuthMiddleware(inner)
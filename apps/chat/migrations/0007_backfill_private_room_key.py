@@ -0,0 +1,46 @@
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_private_room_key(apps, schema_editor):
+    """
+    Key every private room with exactly two members by its member pair. When
+    a pair already has several rooms, the oldest is keyed and the others are
+    left unkeyed: they stay reachable by id but are no longer returned as
+    the pair's direct room.
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    RoomMembership = apps.get_model('chat', 'RoomMembership')
+
+    pairs = (
+        RoomMembership.objects.filter(room__room_type='private')
+        .values('room_id')
+        .annotate(members=models.Count('id'), low=models.Min('user_id'), high=models.Max('user_id'))
+        .filter(members=2)
+        .order_by('room__created_at')
+    )
+    seen, batch = set(), []
+    for row in pairs.iterator():
+        key = (row['low'], row['high'])
+        if key in seen:
+            continue
+        seen.add(key)
+        batch.append(ChatRoom(id=row['room_id'], dm_user_low_id=row['low'], dm_user_high_id=row['high']))
+        if len(batch) == BATCH_SIZE:
+            ChatRoom.objects.bulk_update(batch, ['dm_user_low', 'dm_user_high'])
+            batch = []
+    if batch:
+        ChatRoom.objects.bulk_update(batch, ['dm_user_low', 'dm_user_high'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_private_room_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_private_room_key, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_backfill_private_room_key'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(condition=models.Q(('room_type', 'private')), fields=('dm_user_low', 'dm_user_high'), name='chat_unique_private_room'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.CheckConstraint(condition=models.Q(('dm_user_low__lt', models.F('dm_user_high')), ('dm_user_low__isnull', True), _connector='OR'), name='chat_private_room_key_ordered'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:19
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+def clear_unowned_online_flags(apps, schema_editor):
+    # Flags set before processes were tracked cannot be told from those left by
+    # crashed processes; live sockets set them again when they reconnect
+    RoomMembership = apps.get_model('chat', 'RoomMembership')
+    RoomMembership.objects.filter(is_online=True).update(is_online=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_private_room_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PresenceNode',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('hostname', models.CharField(max_length=255)),
+                ('pid', models.IntegerField()),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('heartbeat_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='roommembership',
+            name='presence_node',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='memberships', to='chat.presencenode'),
+        ),
+        migrations.RunPython(clear_unowned_online_flags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_presence_node'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mediaupload',
+            name='status',
+            field=models.CharField(choices=[('uploading', 'Uploading'), ('completing', 'Completing'), ('complete', 'Complete'), ('aborted', 'Aborted')], default='uploading', max_length=10),
+        ),
+    ]
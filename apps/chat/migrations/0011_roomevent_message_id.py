@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:38
+
+import uuid
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_message_id(apps, schema_editor):
+    """Key the logged events by the message they carry or refer to."""
+    RoomEvent = apps.get_model('chat', 'RoomEvent')
+
+    batch = []
+    for event in RoomEvent.objects.only('payload').iterator(chunk_size=BATCH_SIZE):
+        message = event.payload.get('message')
+        message_id = message.get('id') if message else event.payload.get('message_id')
+        try:
+            event.message_id = uuid.UUID(str(message_id)) if message_id else None
+        except ValueError:
+            # Frames such as message_read pass on whatever id the client sent
+            event.message_id = None
+        if event.message_id is None:
+            continue
+        batch.append(event)
+        if len(batch) == BATCH_SIZE:
+            RoomEvent.objects.bulk_update(batch, ['message_id'])
+            batch = []
+    if batch:
+        RoomEvent.objects.bulk_update(batch, ['message_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_mediaupload_completing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roomevent',
+            name='message_id',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_message_id, migrations.RunPython.noop),
+    ]
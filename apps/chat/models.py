@@ -15,11 +15,27 @@ class ChatRoom(models.Model):
     room_type = models.CharField(max_length=10, choices=ROOM_TYPES, default='private')
     members = models.ManyToManyField(User, related_name='chat_rooms', through='RoomMembership')
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='created_rooms')
+    # Sequence number of the room's latest event (apps.chat.events)
+    last_seq = models.BigIntegerField(default=0)
+    # Canonical key of a private room: its two members, lower user id first
+    dm_user_low = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    dm_user_high = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-updated_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dm_user_low', 'dm_user_high'],
+                condition=models.Q(room_type='private'),
+                name='chat_unique_private_room',
+            ),
+            models.CheckConstraint(
+                condition=models.Q(dm_user_low__lt=models.F('dm_user_high')) | models.Q(dm_user_low__isnull=True),
+                name='chat_private_room_key_ordered',
+            ),
+        ]
     
     def __str__(self):
         return self.name or f"Room {self.id}"
@@ -33,6 +49,18 @@ class ChatRoom(models.Model):
         return self.roommembership_set.filter(is_online=True).count()
 
 
+class PresenceNode(models.Model):
+    # A process serving chat sockets (apps.chat.presence); rows that stop heartbeating belong to dead processes
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    hostname = models.CharField(max_length=255)
+    pid = models.IntegerField()
+    started_at = models.DateTimeField(auto_now_add=True)
+    heartbeat_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.hostname}:{self.pid}"
+
+
 class RoomMembership(models.Model):
     ROLES = (
         ('admin', 'Admin'),
@@ -44,6 +72,8 @@ class RoomMembership(models.Model):
     role = models.CharField(max_length=10, choices=ROLES, default='member')
     is_online = models.BooleanField(default=False)
     last_seen = models.DateTimeField(default=timezone.now)
+    # Process whose socket set is_online, which clears it when that process drains or is swept
+    presence_node = models.ForeignKey(PresenceNode, on_delete=models.SET_NULL, null=True, blank=True, related_name='memberships')
     joined_at = models.DateTimeField(auto_now_add=True)
     unread_count = models.IntegerField(default=0)
     
@@ -55,6 +85,29 @@ class RoomMembership(models.Model):
         return f"{self.user.username} in {self.room}"
 
 
+class ImageDerivative(models.Model):
+    STATUSES = (
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    )
+
+    # Derivatives are keyed by the original's content, so identical uploads share them
+    sha256 = models.CharField(max_length=64, unique=True)
+    source = models.CharField(max_length=255)  # Storage name of the first original with this content
+    width = models.IntegerField(null=True, blank=True)
+    height = models.IntegerField(null=True, blank=True)
+    thumbnail = models.ImageField(max_length=255, null=True, blank=True)
+    web = models.ImageField(max_length=255, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Derivatives of {self.sha256[:12]} ({self.status})"
+
+
 class Message(models.Model):
     MESSAGE_TYPES = (
         ('text', 'Text'),
@@ -70,8 +123,11 @@ class Message(models.Model):
     content = models.TextField(blank=True)
     image = models.ImageField(upload_to='chat/images/', null=True, blank=True)
     video = models.FileField(upload_to='chat/videos/', null=True, blank=True)
+    image_derivative = models.ForeignKey(ImageDerivative, on_delete=models.SET_NULL, null=True, blank=True, related_name='messages')
     reply_to = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='replies')
     is_edited = models.BooleanField(default=False)
+    # Tombstone: set on delete, the row is removed later by `manage.py purge_deleted_messages`
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -94,6 +150,22 @@ class MessageReadStatus(models.Model):
         return f"{self.user.username} read message {self.message.id}"
 
 
+class RoomEvent(models.Model):
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='events')
+    seq = models.BigIntegerField()
+    # The channel layer event as broadcast to the room group
+    payload = models.JSONField()
+    # The message the event is about, so deleting it can tombstone its events by index
+    message_id = models.UUIDField(null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ('room', 'seq')
+
+    def __str__(self):
+        return f"Event {self.seq} in {self.room_id}"
+
+
 class TypingIndicator(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='typing_users')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -104,3 +176,37 @@ class TypingIndicator(models.Model):
     
     def __str__(self):
         return f"{self.user.username} typing in {self.room}"
+
+
+class MediaUpload(models.Model):
+    MEDIA_TYPES = (
+        ('image', 'Image'),
+        ('video', 'Video'),
+    )
+    STATUSES = (
+        ('uploading', 'Uploading'),
+        ('completing', 'Completing'),
+        ('complete', 'Complete'),
+        ('aborted', 'Aborted'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='uploads')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='media_uploads')
+    media_type = models.CharField(max_length=10, choices=MEDIA_TYPES)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    total_size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)  # Bytes stored so far; the next chunk starts here
+    checksum = models.CharField(max_length=64, blank=True)  # Optional SHA-256 of the whole file
+    caption = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default='uploading')
+    message = models.OneToOneField(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.media_type} upload {self.id} by {self.user.username}"
@@ -0,0 +1,245 @@
+"""
+Chat worker presence, and draining a worker's sockets on shutdown.
+
+A process registers a PresenceNode row when its first socket connects and
+refreshes the row's heartbeat while it runs. Memberships marked online by
+one of its sockets point at that node, so the process that set a flag is
+always known. A process that dies without cleaning up stops heartbeating:
+the next node to start or beat, or `manage.py sweep_presence`, clears the
+online flags of nodes silent for CHAT_PRESENCE_TIMEOUT.
+
+On SIGTERM the process drains instead of letting every consumer disconnect
+on its own, which would mean a membership write, a typing indicator delete
+and a `user_status` broadcast per socket. New sockets are refused. Open
+sockets get a `reconnect` frame with a random delay of up to
+CHAT_DRAIN_RECONNECT_JITTER seconds and are closed with 1012 (service
+restart), so clients spread over the remaining workers instead of returning
+at once. Then the memberships the node holds online are marked offline with
+one UPDATE per room, each room group gets one `users_offline` event, and
+queued image derivative renders are waited for before the server's own
+shutdown handler runs.
+
+The node also holds the idle deadlines of its sockets (apps.chat.timers).
+"""
+import asyncio
+import logging
+import os
+import random
+import signal
+import socket
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from .groups import broadcast_to_room
+from .models import PresenceNode, RoomMembership, TypingIndicator
+from .timers import TimerWheel
+
+
+logger = logging.getLogger(__name__)
+
+# "Service Restart": the server is going away and the client should reconnect
+RECONNECT_CLOSE_CODE = 1012
+
+
+def release_node(node_id):
+    """
+    Mark every membership `node_id` holds online offline, one room at a time,
+    and delete the node. Returns {room_id: {'user_ids', 'online_count'}} for
+    announce_offline.
+    """
+    held = RoomMembership.objects.filter(presence_node_id=node_id, is_online=True)
+    rooms = defaultdict(list)
+    for room_id, user_id in held.values_list('room_id', 'user_id'):
+        rooms[room_id].append(user_id)
+
+    now = timezone.now()
+    with transaction.atomic():
+        for room_id in rooms:
+            in_room = held.filter(room_id=room_id)
+            TypingIndicator.objects.filter(room_id=room_id, user_id__in=in_room.values('user_id')).delete()
+            in_room.update(is_online=False, last_seen=now, presence_node=None)
+        PresenceNode.objects.filter(id=node_id).delete()
+
+    online_counts = dict(
+        RoomMembership.objects.filter(room_id__in=list(rooms), is_online=True)
+        .values('room_id').annotate(online=models.Count('id')).values_list('room_id', 'online')
+    )
+    return {
+        str(room_id): {'user_ids': sorted(user_ids), 'online_count': online_counts.get(room_id, 0)}
+        for room_id, user_ids in rooms.items()
+    }
+
+
+def sweep_stale_nodes(timeout=None):
+    """Release the nodes that have not heartbeated for `timeout` seconds; returns their merged changes."""
+    timeout = settings.CHAT_PRESENCE_TIMEOUT if timeout is None else timeout
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    changes = {}
+    for node_id in PresenceNode.objects.filter(heartbeat_at__lt=cutoff).values_list('id', flat=True):
+        with transaction.atomic():
+            # Claim the node, so a concurrent sweeper finds it alive and skips it
+            if not PresenceNode.objects.filter(id=node_id, heartbeat_at__lt=cutoff).update(heartbeat_at=timezone.now()):
+                continue
+            released = release_node(node_id)
+        logger.warning("Swept presence node %s: %d room(s) had online flags", node_id, len(released))
+        for room_id, change in released.items():
+            merged = changes.setdefault(room_id, {'user_ids': [], 'online_count': 0})
+            merged['user_ids'] = sorted(set(merged['user_ids']) | set(change['user_ids']))
+            merged['online_count'] = change['online_count']
+    return changes
+
+
+async def announce_offline(changes):
+    # One event per room, whatever the number of users that went offline in it
+    channel_layer = get_channel_layer()
+    for room_id, change in changes.items():
+        await broadcast_to_room(room_id, {
+            'type': 'users_offline',
+            'user_ids': change['user_ids'],
+            'online_count': change['online_count'],
+        }, channel_layer)
+
+
+class LocalNode:
+    """The sockets of this process and its PresenceNode row."""
+
+    def __init__(self):
+        self.id = None
+        self.connections = set()
+        self.draining = False
+        self.loop = None
+        self.ready = None
+        self.heartbeat = None
+        self.idle = None
+        self.reaper = None
+        self.previous_handler = None
+
+    async def join(self, consumer):
+        """Track an accepted socket, registering the node on the first one of each event loop."""
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.ready = loop.create_task(self.start())
+        await self.ready
+        self.connections.add(consumer)
+        self.idle.add(consumer)
+
+    def leave(self, consumer):
+        self.connections.discard(consumer)
+        if self.idle is not None:
+            self.idle.remove(consumer)
+
+    async def start(self):
+        try:
+            if self.id is None:
+                self.id = await sync_to_async(self.register)()
+            changes = await sync_to_async(sweep_stale_nodes)()
+            await announce_offline(changes)
+        except BaseException:
+            # The next connection tries again
+            self.loop = None
+            raise
+        self.heartbeat = asyncio.create_task(self.beat_forever())
+        self.idle = TimerWheel(settings.CHAT_IDLE_TIMEOUT, settings.CHAT_IDLE_TICK, self.expire_idle)
+        self.reaper = asyncio.create_task(self.idle.run())
+        self.install_signal_handler()
+
+    def register(self):
+        node = PresenceNode.objects.create(hostname=socket.gethostname()[:255], pid=os.getpid())
+        logger.info("Registered presence node %s (%s)", node.id, node)
+        return node.id
+
+    async def beat_forever(self):
+        while not self.draining:
+            await asyncio.sleep(settings.CHAT_PRESENCE_HEARTBEAT)
+            if self.draining:
+                return
+            try:
+                alive = await sync_to_async(self.beat)()
+                if not alive:
+                    await self.reclaim()
+                await announce_offline(await sync_to_async(sweep_stale_nodes)())
+            except Exception:
+                logger.exception("Presence heartbeat of node %s failed", self.id)
+
+    def beat(self):
+        return PresenceNode.objects.filter(id=self.id).update(heartbeat_at=timezone.now()) == 1
+
+    async def reclaim(self):
+        # Swept while alive (e.g. the database was unreachable for a while): register
+        # again and mark the rooms of the open sockets online, one UPDATE per room
+        logger.warning("Presence node %s was swept while alive; registering again", self.id)
+        rooms = defaultdict(set)
+        for consumer in self.connections:
+            for room_id in consumer.presence_rooms():
+                rooms[room_id].add(consumer.user.id)
+        self.id = await sync_to_async(self.register)()
+        await sync_to_async(self.mark_online)(rooms)
+
+    async def expire_idle(self, consumer):
+        # Closing makes the server disconnect the socket, which runs the consumer's usual cleanup
+        self.connections.discard(consumer)
+        await consumer.close_idle()
+
+    def mark_online(self, rooms):
+        for room_id, user_ids in rooms.items():
+            RoomMembership.objects.filter(room_id=room_id, user_id__in=user_ids).update(
+                is_online=True, presence_node_id=self.id
+            )
+
+    def install_signal_handler(self):
+        if self.previous_handler is not None:
+            return
+        try:
+            self.previous_handler = signal.signal(signal.SIGTERM, self.on_sigterm) or signal.SIG_DFL
+        except ValueError:
+            # Signal handlers can only be set from the main thread
+            logger.warning("Not serving sockets from the main thread: SIGTERM will not drain them")
+
+    def on_sigterm(self, signum, frame):
+        self.loop.call_soon_threadsafe(self.loop.create_task, self.shutdown())
+
+    async def shutdown(self):
+        if self.draining:
+            return
+        try:
+            await asyncio.wait_for(self.drain(), settings.CHAT_DRAIN_TIMEOUT)
+        except Exception:
+            logger.exception("Draining presence node %s failed", self.id)
+        # Hand over to the server's own shutdown
+        signal.signal(signal.SIGTERM, self.previous_handler)
+        signal.raise_signal(signal.SIGTERM)
+
+    async def drain(self):
+        """Refuse new sockets, release this node's online flags and close every socket."""
+        self.draining = True
+        started = time.perf_counter()
+        for task in (self.heartbeat, self.reaper):
+            if task is not None:
+                task.cancel()
+        consumers = list(self.connections)
+        for consumer in consumers:
+            await consumer.reconnect_later()
+        # Only rows this node still holds: a client back already on another worker keeps its flag
+        if self.id is not None:
+            await announce_offline(await sync_to_async(release_node)(self.id))
+
+        # Let renders already queued store their derivatives instead of leaving them pending
+        from .derivatives import get_pipeline
+        await sync_to_async(get_pipeline().shutdown, thread_sensitive=False)(wait=True)
+        logger.info(
+            "Drained presence node %s: %d socket(s) in %.2fs", self.id, len(consumers), time.perf_counter() - started
+        )
+
+    def retry_after_ms(self):
+        return random.randint(0, int(settings.CHAT_DRAIN_RECONNECT_JITTER * 1000))
+
+
+local_node = LocalNode()
@@ -0,0 +1,117 @@
+"""
+Sender profiles for message payloads.
+
+Messages embed their sender's id, username and names. Pages of history, the
+inbox, exports and socket payloads keep naming the same few hundred users, so
+profiles are kept in a bounded per-process cache. Each profile lives for at
+most CHAT_PROFILE_CACHE_TTL seconds, and the least recently used ones are
+dropped first. Lookups take a batch of user ids and fetch all misses with
+one query.
+
+Saving or deleting a User drops its profile in this process, and lookups
+already fetching it at that moment do not store what they read; the rest of
+their batch is stored as usual. Other processes catch up within the TTL. Queryset `.update()` sends no signal, so renames
+made that way also wait for the TTL.
+"""
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+
+
+PROFILE_FIELDS = ('id', 'username', 'first_name', 'last_name')
+
+
+class ProfileCache:
+    """User profiles by id, least recently used dropped first, each kept for `ttl` seconds."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation. A fetch stores none of the users
+        # invalidated after it started, and nothing at all if a clear() did
+        self._generation = 0
+        self._invalidated = {}  # user id -> generation, while an older fetch runs
+        self._fetching = Counter()  # generation -> fetches started in it
+        self._cleared = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, user_ids):
+        """{user_id: profile} for the existing users among `user_ids`."""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for user_id in set(user_ids):
+                entry = self._profiles.get(user_id)
+                if entry is not None and entry[0] > now:
+                    self._profiles.move_to_end(user_id)
+                    found[user_id] = entry[1]
+                else:
+                    missing.append(user_id)
+            self.hits += len(found)
+            self.misses += len(missing)
+            if not missing:
+                return found
+            generation = self._generation
+            self._fetching[generation] += 1
+
+        fetched = {}
+        try:
+            fetched = {row['id']: row for row in User.objects.filter(id__in=missing).values(*PROFILE_FIELDS)}
+        finally:
+            expires = time.monotonic() + self.ttl
+            with self._lock:
+                if generation >= self._cleared:
+                    for user_id, profile in fetched.items():
+                        if self._invalidated.get(user_id, generation) > generation:
+                            continue
+                        self._profiles[user_id] = (expires, profile)
+                        self._profiles.move_to_end(user_id)
+                    while len(self._profiles) > self.size:
+                        self._profiles.popitem(last=False)
+                self._fetch_done(generation)
+        found.update(fetched)
+        return found
+
+    def _fetch_done(self, generation):
+        self._fetching[generation] -= 1
+        if not self._fetching[generation]:
+            del self._fetching[generation]
+        # Only invalidations newer than the oldest running fetch still matter
+        oldest = min(self._fetching, default=self._generation)
+        self._invalidated = {
+            user_id: invalidated for user_id, invalidated in self._invalidated.items() if invalidated > oldest
+        }
+
+    def get(self, user_id):
+        return self.get_many([user_id]).get(user_id)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._profiles.pop(user_id, None)
+            self._generation += 1
+            if self._fetching:
+                self._invalidated[user_id] = self._generation
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+            self._generation += 1
+            self._cleared = self._generation
+            self._invalidated.clear()
+            self.hits = self.misses = 0
+
+
+sender_profiles = ProfileCache(settings.CHAT_PROFILE_CACHE_SIZE, settings.CHAT_PROFILE_CACHE_TTL)
+
+
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # Logins save only last_login, which is not part of the profile
+    if update_fields is not None and not set(update_fields) & set(PROFILE_FIELDS):
+        return
+    sender_profiles.invalidate(instance.pk)
@@ -0,0 +1,82 @@
+"""
+Physical removal of deleted messages.
+
+Deleting a message on the socket only sets `Message.deleted_at`, one row
+update however many receipts and replies the message has. This module
+removes tombstoned rows later in small batches. A batch first deletes its
+read receipts CHAT_PURGE_RECEIPT_CHUNK_SIZE rows at a time, each chunk in
+its own transaction, since a message in a large room can have thousands;
+it then detaches replies and uploads and deletes the messages in one short
+transaction, so no single statement locks much of a busy room.
+The batch's image and video files, and the rendered derivatives no
+remaining message shares, are removed from storage once it commits.
+RoomEvent rows past CHAT_EVENT_RETENTION are pruned the same way.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from .models import ImageDerivative, Message, MessageReadStatus, RoomEvent
+
+
+def _delete_files(files):
+    for storage, name in files:
+        storage.delete(name)
+
+
+def _delete_receipts(message_ids, chunk_size):
+    receipts = MessageReadStatus.objects.filter(message_id__in=message_ids)
+    while chunk := list(receipts.values_list('id', flat=True)[:chunk_size]):
+        MessageReadStatus.objects.filter(id__in=chunk).delete()
+
+
+def purge_batch(deleted_before, batch_size):
+    """Remove up to `batch_size` messages tombstoned before `deleted_before`; return how many."""
+    ids = list(
+        Message.objects.filter(deleted_at__lt=deleted_before)
+        .order_by('deleted_at')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return 0
+
+    _delete_receipts(ids, settings.CHAT_PURGE_RECEIPT_CHUNK_SIZE)
+    with transaction.atomic():
+        batch = Message.objects.filter(id__in=ids, deleted_at__isnull=False)
+        images = set(batch.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True))
+        videos = set(batch.exclude(video='').exclude(video__isnull=True).values_list('video', flat=True))
+        derivative_ids = set(
+            batch.filter(image_derivative__isnull=False).values_list('image_derivative_id', flat=True)
+        )
+        # The collector handles the whole batch with one statement per related table;
+        # the receipts left are only those written since the chunks above
+        batch.delete()
+
+        # A name can back more than one message, e.g. rows copied by a command
+        images -= set(Message.objects.filter(image__in=images).values_list('image', flat=True))
+        videos -= set(Message.objects.filter(video__in=videos).values_list('video', flat=True))
+        files = [(Message._meta.get_field('image').storage, name) for name in images]
+        files += [(Message._meta.get_field('video').storage, name) for name in videos]
+
+        derivative_storage = ImageDerivative._meta.get_field('web').storage
+        for derivative in ImageDerivative.objects.filter(id__in=derivative_ids):
+            survivor = derivative.messages.exclude(image='').exclude(image__isnull=True).first()
+            if survivor is None:
+                files += [(derivative_storage, f.name) for f in (derivative.thumbnail, derivative.web) if f]
+                derivative.delete()
+            elif derivative.source in images:
+                # Keep a pending render readable
+                ImageDerivative.objects.filter(pk=derivative.pk).update(source=survivor.image.name)
+        transaction.on_commit(lambda: _delete_files(files))
+    return len(ids)
+
+
+def prune_events_batch(created_before, batch_size):
+    """Delete up to `batch_size` replay log rows older than `created_before`; return how many."""
+    ids = list(
+        RoomEvent.objects.filter(created_at__lt=created_before)
+        .order_by('created_at')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if ids:
+        RoomEvent.objects.filter(id__in=ids).delete()
+    return len(ids)
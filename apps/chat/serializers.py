@@ -1,6 +1,10 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import ChatRoom, RoomMembership, Message, MessageReadStatus, TypingIndicator
+from .models import ChatRoom, RoomMembership, Message, MessageReadStatus, TypingIndicator, MediaUpload
+from .derivatives import derivative_payload
+from .media import media_url
+from .profiles import sender_profiles
 import uuid
 
 
@@ -10,6 +14,25 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'first_name', 'last_name']
 
 
+class SenderProfileField(serializers.Field):
+    # A user id rendered as UserSerializer would render the user, from the profile cache
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, user_id):
+        profile = sender_profiles.get(user_id)
+        return dict(profile) if profile else None
+
+
+class MessageListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Fetch every missing sender profile of the page with one query
+        messages = list(data.all() if hasattr(data, 'all') else data)
+        sender_profiles.get_many({message.sender_id for message in messages})
+        return super().to_representation(messages)
+
+
 class ChatRoomSerializer(serializers.ModelSerializer):
     members = UserSerializer(many=True, read_only=True)
     created_by = UserSerializer(read_only=True)
@@ -37,18 +60,34 @@ class RoomMembershipSerializer(serializers.ModelSerializer):
 
 
 class MessageSerializer(serializers.ModelSerializer):
-    sender = UserSerializer(read_only=True)
-    room = serializers.PrimaryKeyRelatedField(queryset=ChatRoom.objects.all())
-    reply_to = serializers.PrimaryKeyRelatedField(queryset=Message.objects.all(), allow_null=True)
+    sender = SenderProfileField(source='sender_id')
+    room = serializers.PrimaryKeyRelatedField(queryset=ChatRoom.objects.all(), pk_field=serializers.UUIDField())
+    reply_to = serializers.PrimaryKeyRelatedField(queryset=Message.objects.all(), allow_null=True, pk_field=serializers.UUIDField())
     read_by = UserSerializer(many=True, read_only=True, source='read_statuses.user')
+    derivatives = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
         fields = [
             'id', 'room', 'sender', 'message_type', 'content',
-            'image', 'video', 'reply_to', 'is_edited',
+            'image', 'video', 'derivatives', 'reply_to', 'is_edited',
             'created_at', 'updated_at', 'read_by'
         ]
+        list_serializer_class = MessageListSerializer
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Link attachments to the membership-checked download view, not to storage
+        request = self.context.get('request')
+        for name in ('image', 'video'):
+            if data[name]:
+                url = media_url(instance.pk)
+                data[name] = request.build_absolute_uri(url) if request else url
+        return data
+
+    def get_derivatives(self, obj):
+        # Thumbnail and web-sized URLs once rendered, else null
+        return derivative_payload(obj.image_derivative, obj.pk)
 
     def validate(self, data):
         if data.get('message_type') == 'text' and not data.get('content'):
@@ -76,3 +115,82 @@ class TypingIndicatorSerializer(serializers.ModelSerializer):
     class Meta:
         model = TypingIndicator
         fields = ['room', 'user', 'started_at']
+
+
+class MediaUploadCreateSerializer(serializers.Serializer):
+    media_type = serializers.ChoiceField(choices=[choice for choice, _ in MediaUpload.MEDIA_TYPES])
+    filename = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1)
+    content_type = serializers.CharField(max_length=100, required=False, allow_blank=True)
+    checksum = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False, allow_blank=True, help_text="SHA-256 of the whole file")
+    caption = serializers.CharField(required=False, allow_blank=True)
+
+
+class MediaUploadSerializer(serializers.ModelSerializer):
+    room = serializers.PrimaryKeyRelatedField(read_only=True, pk_field=serializers.UUIDField())
+    offset = serializers.IntegerField(source='received', read_only=True)
+    message = MessageSerializer(read_only=True)
+
+    class Meta:
+        model = MediaUpload
+        fields = [
+            'id', 'room', 'media_type', 'filename', 'content_type',
+            'total_size', 'offset', 'status', 'message', 'created_at', 'updated_at'
+        ]
+
+
+class RoomCreateSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    room_type = serializers.ChoiceField(choices=[choice for choice, _ in ChatRoom.ROOM_TYPES], default='group')
+    members = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, default=list,
+        max_length=settings.CHAT_BULK_MEMBERS_MAX, help_text="User ids to add as members"
+    )
+
+
+class RoomSummarySerializer(serializers.ModelSerializer):
+    created_by = UserSerializer(read_only=True)
+    total_members = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = ChatRoom
+        fields = ['id', 'name', 'room_type', 'created_by', 'created_at', 'updated_at', 'total_members']
+
+
+class DirectRoomSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField(min_value=1)
+
+
+class RoomMembersSerializer(serializers.Serializer):
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False,
+        max_length=settings.CHAT_BULK_MEMBERS_MAX
+    )
+
+
+class RoomMembersResultSerializer(serializers.Serializer):
+    added = serializers.IntegerField(required=False)
+    removed = serializers.IntegerField(required=False)
+    total_members = serializers.IntegerField()
+
+
+class MessageHistorySerializer(serializers.Serializer):
+    results = MessageSerializer(many=True)
+    next_before = serializers.UUIDField(allow_null=True, help_text="Pass as `before` for the next older page; null on the last page")
+
+
+class LastMessageSerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    sender = SenderProfileField(source='sender_id')
+    message_type = serializers.CharField()
+    content = serializers.CharField()
+    created_at = serializers.DateTimeField()
+
+
+class InboxRoomSerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    name = serializers.CharField(allow_null=True)
+    room_type = serializers.CharField()
+    unread_count = serializers.IntegerField()
+    updated_at = serializers.DateTimeField()
+    last_message = LastMessageSerializer(allow_null=True)
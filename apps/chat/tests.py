@@ -1,3 +1,810 @@
-from django.test import TestCase
+import csv
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .derivatives import derivative_payload
+from .events import event_message_id, events_since, publish_event, recent_events
+from .groups import room_group_name
+from .instrumentation import assert_query_budget
+from .media import media_url
+from .middleware import JWTAuthMiddlewareStack
+from .models import (
+    ChatRoom, ImageDerivative, MediaUpload, Message, MessageReadStatus, PresenceNode, RoomEvent, RoomMembership,
+    TypingIndicator,
+)
+from .memberships import add_members, get_or_create_direct_room
+from .presence import LocalNode, announce_offline, release_node, sweep_stale_nodes
+from .profiles import ProfileCache
+from .purge import purge_batch
+from .routing import websocket_urlpatterns
+from .serializers import MessageSerializer
+from .timers import TimerWheel
+from .uploads import UploadError, complete_upload
+
+
+application = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+
+# Queries each frame may make. Raise one only together with the change that needs it.
+FRAME_BUDGETS = {
+    # The first socket of a process also registers its presence node and sweeps stale ones
+    'connect': 6,
+    'chat_message': 10,
+    'typing_start': 7,
+    'typing_stop': 4,
+    'message_read': 12,
+    'edit_message': 8,
+    'delete_message': 9,
+    'disconnect': 5,
+}
+
+
+# The consumers use database_sync_to_async, which closes connections between
+# calls, so these run outside a test transaction
+@override_settings(CHAT_SLOW_FRAME_MS=float('inf'), CHAT_SLOW_QUERY_MS=float('inf'))
+class ConsumerTestCase(TransactionTestCase):
+    def setUp(self):
+        # A node of its own per test, so no presence row or task outlives the test's event loop
+        patcher = mock.patch('apps.chat.consumers.local_node', LocalNode())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        recent_events.clear()
+
+        self.alice = User.objects.create_user('alice', password='x')
+        self.bob = User.objects.create_user('bob', password='x')
+        self.room = ChatRoom.objects.create(name='room', room_type='group', created_by=self.alice)
+        for user in (self.alice, self.bob):
+            RoomMembership.objects.create(room=self.room, user=user)
+
+    async def connect(self, user, path=None):
+        path = path or f'/ws/chat/{self.room.id}/'
+        communicator = WebsocketCommunicator(application, f'{path}?token={AccessToken.for_user(user)}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive_type(self, communicator, frame_type):
+        # Skips the frames before it, e.g. the other socket's join
+        while (frame := await communicator.receive_json_from(timeout=5))['type'] != frame_type:
+            pass
+        return frame
+
+
+class ChatConsumerQueryBudgetTests(ConsumerTestCase):
+    async def test_room_frames_stay_within_budget(self):
+        with assert_query_budget(**FRAME_BUDGETS) as frames:
+            alice = await self.connect(self.alice)
+            bob = await self.connect(self.bob)
+
+            await alice.send_json_to({'type': 'chat_message', 'content': 'hello'})
+            message_id = (await self.receive_type(alice, 'chat_message'))['message']['id']
+            await bob.send_json_to({'type': 'typing_start'})
+            await bob.send_json_to({'type': 'typing_stop'})
+            await bob.send_json_to({'type': 'message_read', 'message_id': message_id})
+            await self.receive_type(bob, 'message_read_status')
+            await alice.send_json_to({'type': 'edit_message', 'message_id': message_id, 'content': 'hi'})
+            await alice.send_json_to({'type': 'delete_message', 'message_id': message_id})
+            await self.receive_type(alice, 'message_deleted')
+            await alice.disconnect()
+            await bob.disconnect()
+
+        self.assertEqual(set(FRAME_BUDGETS), {stats.frame_type for stats in frames})
+
+    async def test_multiplexed_frames_stay_within_budget(self):
+        room_id = str(self.room.id)
+        with assert_query_budget(subscribe=3, unsubscribe=4, **FRAME_BUDGETS) as frames:
+            alice = await self.connect(self.alice, '/ws/chat/')
+            await alice.send_json_to({'type': 'subscribe', 'rooms': [room_id]})
+            self.assertEqual([room_id], (await alice.receive_json_from())['rooms'])
+            await alice.send_json_to({'type': 'chat_message', 'room': room_id, 'content': 'hello'})
+            await self.receive_type(alice, 'chat_message')
+            await alice.send_json_to({'type': 'unsubscribe', 'rooms': [room_id]})
+            await self.receive_type(alice, 'unsubscribed')
+            await alice.disconnect()
+
+        self.assertEqual(
+            ['connect', 'subscribe', 'chat_message', 'unsubscribe', 'disconnect'],
+            [stats.frame_type for stats in frames]
+        )
+
+    async def test_budget_overrun_fails(self):
+        alice = await self.connect(self.alice)
+        with self.assertRaisesMessage(AssertionError, 'chat_message'):
+            with assert_query_budget(chat_message=1):
+                await alice.send_json_to({'type': 'chat_message', 'content': 'hello'})
+                await self.receive_type(alice, 'chat_message')
+        await alice.disconnect()
+        self.assertEqual(1, await Message.objects.filter(room=self.room).acount())
+
+
+
+class MultiplexChatConsumerTests(ConsumerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.room_id = str(self.room.id)
+        self.other_room = ChatRoom.objects.create(name='other', room_type='group', created_by=self.bob)
+        RoomMembership.objects.create(room=self.other_room, user=self.bob)
+
+    async def subscribe(self, communicator, rooms, **frame):
+        await communicator.send_json_to({'type': 'subscribe', 'rooms': rooms, **frame})
+        return await self.receive_type(communicator, 'subscribed')
+
+    async def test_subscribe_admits_members_only(self):
+        alice = await self.connect(self.alice, '/ws/chat/')
+
+        frame = await self.subscribe(alice, [self.room_id, str(self.other_room.id), 'not-a-room', self.room_id])
+
+        self.assertEqual(([self.room_id], [str(self.other_room.id)]), (frame['rooms'], frame['denied']))
+        await alice.send_json_to({'type': 'chat_message', 'room': str(self.other_room.id), 'content': 'hi'})
+        self.assertEqual(
+            {'type': 'error', 'room': str(self.other_room.id), 'message': "Not subscribed to this room."},
+            await self.receive_type(alice, 'error')
+        )
+        self.assertFalse(await Message.objects.filter(room=self.other_room).aexists())
+        await alice.disconnect()
+
+    async def test_room_frames_carry_their_room(self):
+        alice = await self.connect(self.alice, '/ws/chat/')
+        bob = await self.connect(self.bob)
+        await self.subscribe(alice, [self.room_id])
+
+        await bob.send_json_to({'type': 'chat_message', 'content': 'hello'})
+        frame = await self.receive_type(alice, 'chat_message')
+
+        self.assertEqual((self.room_id, 'hello'), (frame['room'], frame['message']['content']))
+        self.assertTrue(await RoomMembership.objects.filter(room=self.room, user=self.alice, is_online=True).aexists())
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_unsubscribe_stops_delivery(self):
+        alice = await self.connect(self.alice, '/ws/chat/')
+        bob = await self.connect(self.bob)
+        await self.subscribe(alice, [self.room_id])
+
+        await alice.send_json_to({'type': 'unsubscribe', 'rooms': [self.room_id]})
+        self.assertEqual([self.room_id], (await self.receive_type(alice, 'unsubscribed'))['rooms'])
+        await bob.send_json_to({'type': 'chat_message', 'content': 'hello'})
+        await self.receive_type(bob, 'chat_message')
+
+        self.assertTrue(await alice.receive_nothing())
+        self.assertFalse(await RoomMembership.objects.filter(room=self.room, user=self.alice, is_online=True).aexists())
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_subscriptions_are_capped(self):
+        await RoomMembership.objects.acreate(room=self.other_room, user=self.alice)
+        alice = await self.connect(self.alice, '/ws/chat/')
+
+        with self.settings(CHAT_MAX_SUBSCRIPTIONS=1):
+            frame = await self.subscribe(alice, [self.room_id, str(self.other_room.id)])
+
+        self.assertEqual([], frame['rooms'])
+        self.assertEqual({self.room_id, str(self.other_room.id)}, set(frame['denied']))
+        await alice.disconnect()
+
+    async def test_subscribe_resumes_from_last_seq(self):
+        bob = await self.connect(self.bob)
+        await bob.send_json_to({'type': 'chat_message', 'content': 'missed'})
+        await self.receive_type(bob, 'chat_message')
+
+        alice = await self.connect(self.alice, '/ws/chat/')
+        await self.subscribe(alice, [self.room_id], last_seq={self.room_id: 0})
+        frame = await self.receive_type(alice, 'chat_message')
+
+        self.assertEqual((self.room_id, 1, 'missed'), (frame['room'], frame['seq'], frame['message']['content']))
+        await alice.disconnect()
+        await bob.disconnect()
+
+class DeletedMessageEventTests(TestCase):
+    def setUp(self):
+        recent_events.clear()
+        self.addCleanup(recent_events.clear)
+        user = User.objects.create_user('alice', password='x')
+        self.room = ChatRoom.objects.create(name='room', room_type='group', created_by=user)
+        derivative = ImageDerivative.objects.create(
+            sha256='0' * 64, source='chat/images/a.png', thumbnail='t.jpg', web='w.jpg', width=1, height=1, status='ready'
+        )
+        self.deleted, self.kept = (
+            Message.objects.create(
+                room=self.room, sender=user, message_type='image', content=content,
+                image='chat/images/a.png', image_derivative=derivative,
+            )
+            for content in ('secret', 'public')
+        )
+        for message in (self.deleted, self.kept):
+            publish_event(self.room.id, {'type': 'chat_message', 'message': MessageSerializer(message).data})
+            publish_event(self.room.id, {
+                'type': 'message_media', 'message_id': str(message.id),
+                'derivatives': derivative_payload(derivative, message.id),
+            })
+        publish_event(self.room.id, {'type': 'message_edited', 'message': {
+            **MessageSerializer(self.deleted).data, 'content': 'still secret',
+        }})
+
+    def delete(self):
+        publish_event(self.room.id, {'type': 'message_deleted', 'message_id': str(self.deleted.id)})
+
+    def assertNothingOfTheDeletedMessage(self, events):
+        self.assertEqual(6, len(events))
+        about = {str(self.deleted.id): [], str(self.kept.id): []}
+        for event in events:
+            about[event_message_id(event)].append(event.get('message') or event)
+        for carried in about[str(self.deleted.id)]:
+            self.assertEqual(
+                ('', None, None), (carried.get('content', ''), carried.get('image'), carried.get('derivatives'))
+            )
+        self.assertEqual(
+            ['public', media_url(self.kept.id, 'web')],
+            [carried.get('content') or carried['derivatives']['web'] for carried in about[str(self.kept.id)]]
+        )
+
+    def test_replay_from_the_ring_drops_the_content(self):
+        self.delete()
+
+        self.assertNothingOfTheDeletedMessage(events_since(self.room.id, 0)[1])
+
+    def test_replay_from_the_log_drops_the_content(self):
+        self.delete()
+        recent_events.clear()
+
+        self.assertNothingOfTheDeletedMessage(events_since(self.room.id, 0)[1])
+        self.assertNotIn('secret', str(list(RoomEvent.objects.values_list('payload', flat=True))))
+
+    def test_delete_cost_does_not_grow_with_the_log(self):
+        for _ in range(50):
+            publish_event(self.room.id, {'type': 'message_read_status', 'message_id': str(self.kept.id)})
+
+        # Savepoint (2), sequence (2), tombstone the message's events by index (2), log the delete (1)
+        with self.assertNumQueries(7):
+            self.delete()
+
+
+class MediaUploadCompletionTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = self.settings(MEDIA_ROOT=media_root, CHAT_UPLOAD_TEMP_DIR=os.path.join(media_root, 'parts'))
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user('alice', password='x')
+        self.room = ChatRoom.objects.create(name='room', room_type='group', created_by=self.user)
+        RoomMembership.objects.create(room=self.room, user=self.user)
+        self.client = Client(headers={'Authorization': f'Bearer {AccessToken.for_user(self.user)}'})
+        self.data = os.urandom(1000)
+        response = self.client.post(f'/api/chat/rooms/{self.room.id}/uploads/', {
+            'media_type': 'video', 'filename': 'clip.mp4', 'size': len(self.data),
+        }, content_type='application/json')
+        self.url = response['Location']
+        self.upload = MediaUpload.objects.get()
+
+    def send(self, offset, chunk):
+        # The test client leaves Content-Length out of empty bodies
+        return self.client.patch(self.url, chunk, content_type='application/offset+octet-stream', headers={
+            'Upload-Offset': str(offset), 'Upload-Checksum': hashlib.sha256(chunk).hexdigest(),
+        }, CONTENT_LENGTH=str(len(chunk)))
+
+    def test_last_chunk_creates_and_broadcasts_one_message(self):
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(room_group_name(self.room.id), channel)
+        self.addCleanup(async_to_sync(channel_layer.group_discard), room_group_name(self.room.id), channel)
+
+        self.assertEqual(200, self.send(0, self.data[:600]).status_code)
+        self.assertEqual(201, self.send(600, self.data[600:]).status_code)
+
+        message = Message.objects.get()
+        event = async_to_sync(channel_layer.receive)(channel)
+        self.assertEqual(('chat_message', str(self.room.id)), (event['type'], event['room_id']))
+        self.assertEqual(str(message.id), event['message']['id'])
+
+    def test_completion_runs_once(self):
+        self.send(0, self.data)
+        self.upload.refresh_from_db()
+
+        # A second final chunk (here an empty retry) finds the upload complete
+        self.assertEqual(message := self.upload.message, complete_upload(self.upload))
+        self.assertEqual(409, self.send(len(self.data), b'').status_code)
+        self.assertEqual([message.pk], list(Message.objects.values_list('pk', flat=True)))
+
+    def test_completion_in_progress_is_a_conflict(self):
+        self.send(0, self.data[:600])
+        MediaUpload.objects.filter(pk=self.upload.pk).update(received=len(self.data), status='completing')
+        self.upload.refresh_from_db()
+        self.upload.status = 'uploading'
+
+        with self.assertRaisesMessage(UploadError, "Upload is already being completed."):
+            complete_upload(self.upload)
+        self.assertFalse(Message.objects.exists())
+
+    def test_failed_completion_can_be_retried_with_an_empty_chunk(self):
+        with mock.patch.object(FileSystemStorage, 'save', side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.send(0, self.data)
+
+        self.upload.refresh_from_db()
+        self.assertEqual(('uploading', len(self.data)), (self.upload.status, self.upload.received))
+        self.assertFalse(Message.objects.exists())
+
+        self.assertEqual(201, self.send(len(self.data), b'').status_code)
+        self.assertEqual(self.data, Message.objects.get().video.read())
+
+
+class MessageMediaTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = self.settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(media_root, 'chat', 'videos'))
+        with open(os.path.join(media_root, 'chat', 'videos', 'clip.mp4'), 'wb') as fh:
+            fh.write(bytes(range(256)) * 4)
+
+        self.user = User.objects.create_user('alice', password='x')
+        room = ChatRoom.objects.create(name='room', room_type='group', created_by=self.user)
+        RoomMembership.objects.create(room=room, user=self.user)
+        self.message = Message.objects.create(room=room, sender=self.user, message_type='video', video='chat/videos/clip.mp4')
+        self.url = media_url(self.message.id)
+        self.client = Client(headers={'Authorization': f'Bearer {AccessToken.for_user(self.user)}'})
+
+    def test_payload_links_to_the_download_view(self):
+        data = MessageSerializer(self.message).data
+
+        self.assertEqual(f'/api/chat/messages/{self.message.id}/media/original/', data['video'])
+        self.assertIsNone(data['image'])
+
+    def test_download_needs_membership(self):
+        outsider = User.objects.create_user('mallory', password='x')
+        response = Client(headers={'Authorization': f'Bearer {AccessToken.for_user(outsider)}'}).get(self.url)
+
+        self.assertEqual(404, response.status_code)
+
+    def test_if_range_needs_a_strong_match(self):
+        etag = self.client.get(self.url)['ETag']
+
+        strong = self.client.get(self.url, headers={'Range': 'bytes=0-9', 'If-Range': etag})
+        weak = self.client.get(self.url, headers={'Range': 'bytes=0-9', 'If-Range': f'W/{etag}'})
+
+        self.assertEqual((206, '10'), (strong.status_code, strong['Content-Length']))
+        self.assertEqual((200, '1024'), (weak.status_code, weak['Content-Length']))
+
+
+class PurgeMediaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = self.settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        for name in ('chat/images/a.png', 'chat/images/b.png', 'chat/videos/c.mp4', 'derivatives/t.jpg', 'derivatives/w.jpg'):
+            os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+            with open(self.path(name), 'wb') as fh:
+                fh.write(b'x')
+
+        user = User.objects.create_user('alice', password='x')
+        room = ChatRoom.objects.create(name='room', room_type='group', created_by=user)
+        self.derivative = ImageDerivative.objects.create(
+            sha256='0' * 64, source='chat/images/a.png', thumbnail='derivatives/t.jpg', web='derivatives/w.jpg', status='ready'
+        )
+        self.first, self.second = (
+            Message.objects.create(room=room, sender=user, message_type='image', image=name, image_derivative=self.derivative)
+            for name in ('chat/images/a.png', 'chat/images/b.png')
+        )
+        self.video = Message.objects.create(room=room, sender=user, message_type='video', video='chat/videos/c.mp4')
+
+    def path(self, name):
+        return os.path.join(self.media_root, name)
+
+    def purge(self, *messages):
+        Message.objects.filter(pk__in=[message.pk for message in messages]).update(deleted_at=timezone.now())
+        with self.captureOnCommitCallbacks(execute=True):
+            purge_batch(timezone.now(), 100)
+
+    def test_removes_the_files_of_purged_messages(self):
+        self.purge(self.first, self.video)
+
+        self.assertFalse(os.path.exists(self.path('chat/images/a.png')))
+        self.assertFalse(os.path.exists(self.path('chat/videos/c.mp4')))
+        self.assertTrue(os.path.exists(self.path('chat/images/b.png')))
+
+    def test_shared_derivatives_stay_until_their_last_message_goes(self):
+        self.purge(self.first)
+
+        self.derivative.refresh_from_db()
+        self.assertEqual('chat/images/b.png', self.derivative.source)
+        self.assertTrue(os.path.exists(self.path('derivatives/w.jpg')))
+
+        self.purge(self.second)
+
+        self.assertFalse(ImageDerivative.objects.exists())
+        self.assertFalse(os.path.exists(self.path('derivatives/t.jpg')))
+        self.assertFalse(os.path.exists(self.path('derivatives/w.jpg')))
+
+    def test_receipts_are_deleted_in_bounded_chunks_first(self):
+        readers = [User.objects.create_user(f'reader{i}', password='x') for i in range(3)]
+        for message in (self.first, self.video, self.second):
+            MessageReadStatus.objects.bulk_create(MessageReadStatus(message=message, user=user) for user in readers)
+
+        with self.settings(CHAT_PURGE_RECEIPT_CHUNK_SIZE=2), CaptureQueriesContext(connection) as queries:
+            self.purge(self.first, self.video)
+
+        deletes = [q['sql'] for q in queries if q['sql'].startswith('DELETE FROM "chat_messagereadstatus"')]
+        # Six receipts two at a time, then the message delete's cascade finds none left
+        chunks, cascade = deletes[:-1], deletes[-1]
+        self.assertEqual([1, 1, 1], [sql.count(', ') for sql in chunks])
+        self.assertTrue(all('"id" IN' in sql for sql in chunks))
+        self.assertIn('"message_id" IN', cascade)
+        self.assertEqual({self.second.pk}, set(MessageReadStatus.objects.values_list('message_id', flat=True)))
+        self.assertEqual(3, MessageReadStatus.objects.count())
+
+    def test_nothing_is_removed_when_the_batch_rolls_back(self):
+        Message.objects.filter(pk=self.video.pk).update(deleted_at=timezone.now())
+        with mock.patch.object(ImageDerivative.objects, 'filter', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                purge_batch(timezone.now(), 100)
+
+        self.assertTrue(os.path.exists(self.path('chat/videos/c.mp4')))
+        self.assertTrue(Message.objects.filter(pk=self.video.pk).exists())
+
+
+class SeedChatTests(TestCase):
+    def test_private_rooms_get_one_canonical_pair_each(self):
+        call_command('seedchat', users=3, rooms=8, messages=0, group_ratio=0, stdout=StringIO())
+
+        private = ChatRoom.objects.filter(room_type='private').prefetch_related('roommembership_set')
+        pairs = [(room.dm_user_low_id, room.dm_user_high_id) for room in private]
+        self.assertEqual(3, len(set(pairs)))
+        for room, (low, high) in zip(private, pairs):
+            self.assertLess(low, high)
+            self.assertEqual({low, high}, {member.user_id for member in room.roommembership_set.all()})
+        # With every pair taken, the remaining rooms are group rooms
+        self.assertEqual(5, ChatRoom.objects.filter(room_type='group').count())
+
+
+class ProfileCacheTests(TestCase):
+    def setUp(self):
+        self.cache = ProfileCache(size=10, ttl=60)
+        self.alice = User.objects.create_user('alice', password='x')
+        self.bob = User.objects.create_user('bob', password='x')
+
+    def fetch_racing(self, *invalidations):
+        """get_many of both users while `invalidations` run between its read and its fill."""
+        def racing_filter(**kwargs):
+            for invalidate in invalidations:
+                invalidate()
+            return User.objects.all().filter(**kwargs)
+
+        with mock.patch.object(User.objects, 'filter', side_effect=racing_filter):
+            return self.cache.get_many([self.alice.pk, self.bob.pk])
+
+    def test_invalidation_during_a_fetch_drops_only_that_user(self):
+        profiles = self.fetch_racing(lambda: self.cache.invalidate(self.alice.pk))
+
+        self.assertEqual({self.alice.pk, self.bob.pk}, set(profiles))
+        with self.assertNumQueries(0):
+            self.cache.get(self.bob.pk)
+        with self.assertNumQueries(1):
+            self.cache.get(self.alice.pk)
+
+    def test_clear_during_a_fetch_drops_the_whole_batch(self):
+        self.fetch_racing(self.cache.clear)
+
+        with self.assertNumQueries(1):
+            self.cache.get_many([self.alice.pk, self.bob.pk])
+
+    def test_invalidations_are_forgotten_once_no_fetch_predates_them(self):
+        self.fetch_racing(lambda: self.cache.invalidate(self.alice.pk))
+        self.cache.invalidate(self.bob.pk)
+
+        self.assertEqual({}, self.cache._invalidated)
+        self.cache.get_many([self.alice.pk, self.bob.pk])
+        with self.assertNumQueries(0):
+            self.cache.get_many([self.alice.pk, self.bob.pk])
+
+
+class RoomGroupEventTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+        self.room = ChatRoom.objects.create(name='room', room_type='group', created_by=self.user)
+        self.channel_layer = get_channel_layer()
+        self.channel = async_to_sync(self.channel_layer.new_channel)()
+        group = room_group_name(self.room.id)
+        async_to_sync(self.channel_layer.group_add)(group, self.channel)
+        self.addCleanup(async_to_sync(self.channel_layer.group_discard), group, self.channel)
+
+    def received(self):
+        return async_to_sync(self.channel_layer.receive)(self.channel)
+
+    def test_membership_changes_reach_the_room(self):
+        add_members(self.room.id, [self.user.id])
+
+        event = self.received()
+        self.assertEqual(('membership_changed', str(self.room.id)), (event['type'], event['room_id']))
+        self.assertEqual([self.user.id], event['added'])
+
+    def test_offline_users_reach_the_room(self):
+        async_to_sync(announce_offline)({str(self.room.id): {'user_ids': [self.user.id], 'online_count': 0}})
+
+        event = self.received()
+        self.assertEqual(('users_offline', str(self.room.id)), (event['type'], event['room_id']))
+
+
+class RoomExportTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('admin', password='x', is_staff=True)
+        self.alice = User.objects.create_user('alice', password='x', first_name='Alice')
+        self.room = ChatRoom.objects.create(name='room', room_type='group', created_by=self.alice)
+        self.hello = Message.objects.create(room=self.room, sender=self.alice, content='hello, "world"')
+        Message.objects.create(room=self.room, sender=self.alice, content='gone', deleted_at=timezone.now())
+        MessageReadStatus.objects.create(message=self.hello, user=self.staff)
+        self.url = f'/api/chat/rooms/{self.room.id}/export/'
+
+    def export(self, user=None, **params):
+        client = Client(headers={'Authorization': f'Bearer {AccessToken.for_user(user or self.staff)}'})
+        return client.get(self.url, params)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_ndjson_has_messages_then_receipts(self):
+        response = self.export()
+
+        self.assertEqual('application/x-ndjson', response['Content-Type'])
+        self.assertIn('attachment; filename="room-', response['Content-Disposition'])
+        records = [json.loads(line) for line in self.body(response).splitlines()]
+        self.assertEqual(['message', 'read_receipt'], [record['record'] for record in records])
+        self.assertEqual(
+            (str(self.hello.id), 'alice', 'Alice', 'hello, "world"'),
+            (records[0]['id'], records[0]['username'], records[0]['first_name'], records[0]['content'])
+        )
+        self.assertEqual((str(self.hello.id), 'admin'), (records[1]['message_id'], records[1]['username']))
+
+    def test_csv_has_a_header_and_one_row_per_record(self):
+        response = self.export(file_format='csv')
+
+        self.assertEqual('text/csv', response['Content-Type'])
+        rows = list(csv.DictReader(self.body(response).decode().splitlines()))
+        self.assertEqual([('message', 'hello, "world"'), ('read_receipt', '')], [(row['record'], row['content']) for row in rows])
+
+    def test_gzip_wraps_the_same_export(self):
+        plain = self.body(self.export())
+        response = self.export(gzip='true')
+
+        self.assertEqual('application/gzip', response['Content-Type'])
+        self.assertTrue(response['Content-Disposition'].endswith('.ndjson.gz"'))
+        self.assertEqual(plain, gzip.decompress(self.body(response)))
+
+    def test_date_bounds_filter_the_records(self):
+        response = self.export(until='2000-01-01')
+
+        self.assertEqual(b'', self.body(response))
+
+    def test_staff_only(self):
+        self.assertEqual(403, self.export(user=self.alice).status_code)
+        self.assertEqual(401, Client().get(self.url).status_code)
+
+    def test_bad_parameters(self):
+        self.assertEqual(
+            {'detail': 'Unsupported export format.'}, self.export(file_format='xml').json()
+        )
+        self.assertEqual(
+            {'detail': 'Invalid date or datetime: soon'}, self.export(since='soon').json()
+        )
+        self.url = f'/api/chat/rooms/{uuid.uuid4()}/export/'
+        self.assertEqual(404, self.export().status_code)
+
+
+class RoomMembersTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob, self.carol = (
+            User.objects.create_user(username, password='x') for username in ('alice', 'bob', 'carol')
+        )
+        self.inactive = User.objects.create_user('dave', password='x', is_active=False)
+        self.room = ChatRoom.objects.create(name='room', room_type='group', created_by=self.alice)
+        RoomMembership.objects.create(room=self.room, user=self.alice, role='admin')
+        self.url = f'/api/chat/rooms/{self.room.id}/members/'
+        patcher = mock.patch('apps.chat.memberships.broadcast_to_room', new_callable=mock.AsyncMock)
+        self.broadcast = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, method, user_ids, user=None):
+        client = Client(headers={'Authorization': f'Bearer {AccessToken.for_user(user or self.alice)}'})
+        return getattr(client, method)(self.url, {'user_ids': user_ids}, content_type='application/json')
+
+    def broadcasts(self):
+        return [
+            (room_id, {key: event[key] for key in ('type', 'added', 'removed')})
+            for (room_id, event), _ in self.broadcast.call_args_list
+        ]
+
+    def test_add_counts_and_announces_only_new_members(self):
+        response = self.request('post', [self.alice.id, self.bob.id, self.carol.id, self.inactive.id, 9999])
+
+        self.assertEqual({'added': 2, 'total_members': 3}, response.json())
+        self.assertEqual(
+            [(self.room.id, {'type': 'membership_changed', 'added': [self.bob.id, self.carol.id], 'removed': []})],
+            self.broadcasts()
+        )
+
+        self.assertEqual({'added': 0, 'total_members': 3}, self.request('post', [self.bob.id]).json())
+        self.assertEqual(1, self.broadcast.call_count)
+
+    def test_remove_counts_and_announces_only_members(self):
+        RoomMembership.objects.create(room=self.room, user=self.bob)
+
+        response = self.request('delete', [self.bob.id, self.carol.id])
+
+        self.assertEqual({'removed': 1, 'total_members': 1}, response.json())
+        self.assertEqual(
+            [(self.room.id, {'type': 'membership_changed', 'added': [], 'removed': [self.bob.id]})],
+            self.broadcasts()
+        )
+
+        self.assertEqual({'removed': 0, 'total_members': 1}, self.request('delete', [self.bob.id]).json())
+        self.assertEqual(1, self.broadcast.call_count)
+
+    def test_only_admins_and_staff_manage_members(self):
+        RoomMembership.objects.create(room=self.room, user=self.bob)
+        staff = User.objects.create_user('admin', password='x', is_staff=True)
+
+        self.assertEqual(403, self.request('post', [self.carol.id], user=self.bob).status_code)
+        self.assertEqual(404, self.request('post', [self.bob.id], user=self.carol).status_code)
+        self.assertEqual(200, self.request('delete', [self.bob.id], user=staff).status_code)
+        self.assertEqual({'detail': 'Invalid input.'}, self.request('post', []).json())
+
+    def test_private_room_members_cannot_be_changed(self):
+        staff = User.objects.create_user('admin', password='x', is_staff=True)
+        room, _ = get_or_create_direct_room(self.alice, self.bob.id)
+        self.url = f'/api/chat/rooms/{room.id}/members/'
+
+        for method, user_ids in (('post', [self.carol.id]), ('delete', [self.bob.id])):
+            response = self.request(method, user_ids, user=staff)
+            self.assertEqual(
+                (400, {'detail': 'Members of a private room cannot be changed.'}), (response.status_code, response.json())
+            )
+        members = RoomMembership.objects.filter(room=room).values_list('user_id', flat=True)
+        self.assertEqual({self.alice.id, self.bob.id}, set(members))
+        self.assertFalse(self.broadcast.called)
+
+
+class PresenceNodeTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob, self.carol = (
+            User.objects.create_user(username, password='x') for username in ('alice', 'bob', 'carol')
+        )
+        self.room, self.other_room = (
+            ChatRoom.objects.create(name=name, room_type='group', created_by=self.alice) for name in ('room', 'other')
+        )
+        stale = timezone.now() - timedelta(minutes=10)
+        self.dead, self.other_dead = (
+            PresenceNode.objects.create(hostname='dead', pid=pid, heartbeat_at=stale) for pid in (1, 2)
+        )
+        self.alive = PresenceNode.objects.create(hostname='alive', pid=3)
+        self.online(self.room, self.alice, self.dead)
+        self.online(self.other_room, self.alice, self.dead)
+        self.online(self.room, self.bob, self.alive)
+        self.online(self.other_room, self.carol, self.other_dead)
+        TypingIndicator.objects.create(room=self.room, user=self.alice)
+
+    def online(self, room, user, node):
+        RoomMembership.objects.create(room=room, user=user, is_online=True, presence_node=node)
+
+    def online_users(self):
+        return set(RoomMembership.objects.filter(is_online=True).values_list('room__name', 'user__username'))
+
+    def test_release_node_marks_its_memberships_offline(self):
+        changes = release_node(self.dead.id)
+
+        self.assertEqual({
+            str(self.room.id): {'user_ids': [self.alice.id], 'online_count': 1},
+            str(self.other_room.id): {'user_ids': [self.alice.id], 'online_count': 1},
+        }, changes)
+        self.assertEqual({('room', 'bob'), ('other', 'carol')}, self.online_users())
+        self.assertFalse(TypingIndicator.objects.exists())
+        self.assertFalse(PresenceNode.objects.filter(id=self.dead.id).exists())
+        self.assertIsNone(RoomMembership.objects.get(room=self.room, user=self.alice).presence_node_id)
+
+    def test_sweep_releases_silent_nodes_only(self):
+        with self.assertLogs('apps.chat.presence', 'WARNING'):
+            changes = sweep_stale_nodes(timeout=60)
+
+        # The other room lost users of both dead nodes, announced together
+        self.assertEqual(
+            {'user_ids': sorted([self.alice.id, self.carol.id]), 'online_count': 0}, changes[str(self.other_room.id)]
+        )
+        self.assertEqual({'user_ids': [self.alice.id], 'online_count': 1}, changes[str(self.room.id)])
+        self.assertEqual({('room', 'bob')}, self.online_users())
+        self.assertEqual([self.alive.id], list(PresenceNode.objects.values_list('id', flat=True)))
+
+        self.assertEqual({}, sweep_stale_nodes(timeout=60))
+
+    def test_sweep_spares_nodes_within_the_timeout(self):
+        self.assertEqual({}, sweep_stale_nodes(timeout=3600))
+        self.assertEqual(3, PresenceNode.objects.count())
+
+
+class TimerWheelTests(SimpleTestCase):
+    class Socket:
+        pass
+
+    def setUp(self):
+        self.now = 1000.0
+        self.wheel = TimerWheel(timeout=10, tick=1, expire=None, clock=lambda: self.now)
+
+    def socket(self):
+        socket = self.Socket()
+        self.wheel.add(socket)
+        return socket
+
+    def run_ticks(self, ticks, on_tick=None):
+        """{tick: expired sockets} over the next `ticks` ticks of the fake clock."""
+        expired = {}
+        for _ in range(ticks):
+            self.now += 1
+            if on_tick:
+                on_tick(self.wheel.current + 1)
+            if due := self.wheel.advance(self.now):
+                expired[self.wheel.current] = due
+        return expired
+
+    def test_idle_socket_expires_at_its_deadline(self):
+        socket = self.socket()
+
+        self.assertEqual({10: [socket]}, self.run_ticks(20))
+        self.assertEqual(0, len(self.wheel))
+        self.assertIsNone(socket.wheel_slot)
+
+    def test_activity_pushes_the_deadline_back(self):
+        socket = self.socket()
+
+        def active_at_tick_5(tick):
+            if tick == 5:
+                socket.last_active = self.now
+
+        self.assertEqual({15: [socket]}, self.run_ticks(20, active_at_tick_5))
+
+    def test_deadline_between_ticks_expires_on_the_next_one(self):
+        self.now += 0.5
+        socket = self.socket()
+
+        self.assertEqual({11: [socket]}, self.run_ticks(20))
+
+    def test_removed_socket_never_expires(self):
+        socket = self.socket()
+        kept = self.socket()
+        self.wheel.remove(socket)
+
+        self.assertEqual({10: [kept]}, self.run_ticks(20))
+
+    def test_sockets_expire_by_their_own_deadlines(self):
+        early = [self.socket() for _ in range(3)]
+        self.assertEqual({}, self.run_ticks(4))
+        late = self.socket()
+
+        expired = self.run_ticks(20)
+
+        self.assertEqual([10, 14], sorted(expired))
+        self.assertEqual(set(early), set(expired[10]))
+        self.assertEqual([late], expired[14])
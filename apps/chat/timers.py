@@ -0,0 +1,76 @@
+"""
+Idle deadlines of chat sockets, checked by one timer wheel per process.
+
+A socket's deadline is CHAT_IDLE_TIMEOUT after the last frame it sent,
+counting the {"type": "ping"} heartbeats clients send while otherwise
+quiet. Receiving a frame only stores a timestamp on the consumer; nothing
+is rescheduled. Each socket sits in the slot of the tick its deadline fell
+in when it was last scheduled. Once per tick a single task takes the slot
+that is due, puts back the sockets that were active since, further ahead,
+and hands the others to `expire`. A tick therefore looks only at the
+sockets due in it (about N × tick / timeout of them, each once per
+timeout), and no socket has a task or loop timer of its own.
+"""
+import asyncio
+import logging
+import math
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    def __init__(self, timeout, tick, expire, clock=time.monotonic):
+        self.timeout = timeout
+        self.tick = tick
+        self.expire = expire
+        self.clock = clock
+        # Deadlines are at most one timeout ahead, so a lap never lands on a pending slot
+        self.slots = [set() for _ in range(math.ceil(timeout / tick) + 2)]
+        self.origin = clock()
+        # Ticks processed since origin
+        self.current = 0
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots)
+
+    def add(self, entry):
+        """Start tracking `entry`, which is kept alive by updating its `last_active`."""
+        entry.last_active = self.clock()
+        self.schedule(entry, entry.last_active + self.timeout)
+
+    def remove(self, entry):
+        slot = getattr(entry, 'wheel_slot', None)
+        if slot is not None:
+            self.slots[slot].discard(entry)
+            entry.wheel_slot = None
+
+    def schedule(self, entry, deadline):
+        due = max(self.current + 1, math.ceil((deadline - self.origin) / self.tick))
+        entry.wheel_slot = due % len(self.slots)
+        self.slots[entry.wheel_slot].add(entry)
+
+    def advance(self, now):
+        """Process the next tick; returns the entries past their deadline, no longer tracked."""
+        self.current += 1
+        index = self.current % len(self.slots)
+        due, self.slots[index] = self.slots[index], set()
+        expired = []
+        for entry in due:
+            deadline = entry.last_active + self.timeout
+            if deadline > now:
+                self.schedule(entry, deadline)
+            else:
+                entry.wheel_slot = None
+                expired.append(entry)
+        return expired
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(max(0, self.origin + (self.current + 1) * self.tick - self.clock()))
+            for entry in self.advance(self.clock()):
+                try:
+                    await self.expire(entry)
+                except Exception:
+                    logger.exception("Expiring %r failed", entry)
@@ -0,0 +1,212 @@
+"""
+Chunked, resumable media uploads.
+
+A client opens an upload session with the file's size, then sends the bytes
+in chunks, each with its offset and SHA-256. A chunk is appended to a part
+file only if its checksum matches; otherwise the part file is cut back, so
+the stored offset always covers verified bytes and an interrupted client
+resumes from it. The last chunk moves the file into the storage backend,
+creates the Message and broadcasts it to the room. Completion is claimed by
+moving the session to 'completing', so concurrent final chunks create one
+message. If it fails, the session is back at 'uploading' with every byte
+received, and an empty chunk at that offset retries the completion.
+
+Chunk bodies are copied from the request stream through one buffer of
+CHAT_UPLOAD_BUFFER_SIZE bytes, and at most CHAT_UPLOAD_MAX_CONCURRENT_CHUNKS
+chunks are written at once per process. Upload memory is therefore capped at
+their product, however many or however large the concurrent uploads. Under
+ASGI, Django spools each request body to disk beyond
+FILE_UPLOAD_MAX_MEMORY_SIZE before the view runs.
+"""
+import fcntl
+import hashlib
+import os
+import threading
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.files import File
+from django.db import models, transaction
+from django.utils import timezone
+
+from .derivatives import get_pipeline
+from .events import publish_event
+from .groups import broadcast_to_room
+from .models import ChatRoom, ImageDerivative, MediaUpload, Message, RoomMembership
+from .serializers import MessageSerializer
+
+
+_slots = threading.BoundedSemaphore(settings.CHAT_UPLOAD_MAX_CONCURRENT_CHUNKS)
+
+
+class UploadError(Exception):
+    def __init__(self, detail, status_code=400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def max_size(media_type):
+    if media_type == 'video':
+        return settings.CHAT_UPLOAD_MAX_VIDEO_SIZE
+    return settings.CHAT_UPLOAD_MAX_IMAGE_SIZE
+
+
+def part_path(upload):
+    return os.path.join(settings.CHAT_UPLOAD_TEMP_DIR, f'{upload.id}.part')
+
+
+def write_chunk(upload, offset, stream, length, checksum):
+    """
+    Append `length` bytes read from `stream` at `offset` and return the new
+    offset. The chunk is kept only if its SHA-256 matches `checksum`.
+    """
+    if upload.status != 'uploading':
+        raise UploadError("Upload is not in progress.", 409)
+    if length > settings.CHAT_UPLOAD_MAX_CHUNK_SIZE:
+        raise UploadError(f"Chunks may be at most {settings.CHAT_UPLOAD_MAX_CHUNK_SIZE} bytes.", 413)
+    if offset + length > upload.total_size:
+        raise UploadError("Chunk extends past the declared upload size.")
+
+    if not _slots.acquire(blocking=False):
+        raise UploadError("Too many uploads in progress, retry shortly.", 503)
+    try:
+        os.makedirs(settings.CHAT_UPLOAD_TEMP_DIR, exist_ok=True)
+        with open(os.open(part_path(upload), os.O_RDWR | os.O_CREAT, 0o600), 'r+b') as fh:
+            # One writer per session, across threads and processes
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError("Another chunk of this upload is being written.", 409)
+
+            upload.refresh_from_db(fields=['received', 'status'])
+            if offset != upload.received:
+                raise UploadError(f"Expected offset {upload.received}.", 409)
+
+            # Bytes past the offset are left over from a rejected or interrupted chunk
+            fh.truncate(offset)
+            fh.seek(offset)
+            digest = hashlib.sha256()
+            remaining = length
+            while remaining:
+                data = stream.read(min(settings.CHAT_UPLOAD_BUFFER_SIZE, remaining))
+                if not data:
+                    break
+                digest.update(data)
+                fh.write(data)
+                remaining -= len(data)
+
+            if remaining:
+                fh.truncate(offset)
+                raise UploadError("Chunk body is shorter than Content-Length.")
+            if digest.hexdigest() != checksum.lower():
+                fh.truncate(offset)
+                raise UploadError("Chunk checksum mismatch.")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+            MediaUpload.objects.filter(pk=upload.pk, received=offset).update(
+                received=offset + length, updated_at=timezone.now()
+            )
+            upload.received = offset + length
+    finally:
+        _slots.release()
+    return upload.received
+
+
+def _file_checksum(fh):
+    digest = hashlib.sha256()
+    fh.seek(0)
+    while data := fh.read(settings.CHAT_UPLOAD_BUFFER_SIZE):
+        digest.update(data)
+    fh.seek(0)
+    return digest.hexdigest()
+
+
+def complete_upload(upload):
+    """
+    Store the assembled file, create its Message and broadcast it to the room.
+    Of concurrent calls for one upload only the first does so; a call after
+    it has finished returns the same message.
+    """
+    claimed = MediaUpload.objects.filter(pk=upload.pk, status='uploading', received=upload.total_size).update(
+        status='completing', updated_at=timezone.now()
+    )
+    if not claimed:
+        upload.refresh_from_db(fields=['status', 'message'])
+        if upload.status == 'complete':
+            return upload.message
+        raise UploadError("Upload is already being completed.", 409)
+    upload.status = 'completing'
+
+    try:
+        message, derivative, render = _store_upload(upload)
+    except UploadError:
+        raise
+    except Exception:
+        # Back to its full offset: an empty chunk at that offset completes it again
+        MediaUpload.objects.filter(pk=upload.pk, status='completing').update(
+            status='uploading', updated_at=timezone.now()
+        )
+        upload.status = 'uploading'
+        raise
+    os.remove(part_path(upload))
+
+    event = publish_event(upload.room_id, {
+        'type': 'chat_message',
+        'message': MessageSerializer(message).data,
+    })
+    async_to_sync(broadcast_to_room)(upload.room_id, event)
+    # Queued after the broadcast, so clients see the message before its derivatives
+    if render:
+        get_pipeline().submit(derivative)
+    return message
+
+
+def _store_upload(upload):
+    path = part_path(upload)
+    field = Message._meta.get_field(upload.media_type)
+    with open(path, 'rb') as fh:
+        # Images always need their hash: it keys the derivative cache
+        checksum = _file_checksum(fh) if upload.checksum or upload.media_type == 'image' else None
+        if upload.checksum and checksum != upload.checksum.lower():
+            abort_upload(upload)
+            raise UploadError("File checksum mismatch; the upload was discarded.")
+        # File.chunks() streams the part file into storage in fixed-size blocks
+        name = field.storage.save(field.generate_filename(None, upload.filename), File(fh, name=upload.filename))
+
+    try:
+        with transaction.atomic():
+            derivative, render = None, False
+            if upload.media_type == 'image':
+                # A duplicate of an image seen before reuses its derivatives
+                derivative, render = ImageDerivative.objects.get_or_create(sha256=checksum, defaults={'source': name})
+            message = Message.objects.create(
+                room_id=upload.room_id,
+                sender_id=upload.user_id,
+                message_type=upload.media_type,
+                content=upload.caption,
+                image_derivative=derivative,
+                **{upload.media_type: name},
+            )
+            ChatRoom.objects.filter(id=upload.room_id).update(updated_at=timezone.now())
+            RoomMembership.objects.filter(room_id=upload.room_id).exclude(user_id=upload.user_id).update(
+                unread_count=models.F('unread_count') + 1
+            )
+            upload.status = 'complete'
+            upload.message = message
+            upload.save(update_fields=['status', 'message', 'updated_at'])
+    except Exception:
+        # The retry stores the file again under a new name
+        field.storage.delete(name)
+        raise
+    return message, derivative, render
+
+
+def abort_upload(upload):
+    upload.status = 'aborted'
+    upload.save(update_fields=['status', 'updated_at'])
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,26 @@
+from django.urls import path
+
+from .views import (
+    DirectRoomView,
+    InboxView,
+    MediaUploadCreateView,
+    MediaUploadView,
+    MessageMediaView,
+    RoomCreateView,
+    RoomExportView,
+    RoomMembersView,
+    RoomMessagesView,
+)
+
+
+urlpatterns = [
+    path('inbox/', InboxView.as_view(), name='inbox'),
+    path('rooms/', RoomCreateView.as_view(), name='room_create'),
+    path('rooms/direct/', DirectRoomView.as_view(), name='room_direct'),
+    path('rooms/<uuid:room_id>/members/', RoomMembersView.as_view(), name='room_members'),
+    path('rooms/<uuid:room_id>/messages/', RoomMessagesView.as_view(), name='room_messages'),
+    path('rooms/<uuid:room_id>/export/', RoomExportView.as_view(), name='room_export'),
+    path('rooms/<uuid:room_id>/uploads/', MediaUploadCreateView.as_view(), name='media_upload_create'),
+    path('uploads/<uuid:upload_id>/', MediaUploadView.as_view(), name='media_upload'),
+    path('messages/<uuid:message_id>/media/<str:variant>/', MessageMediaView.as_view(), name='message_media'),
+]
@@ -0,0 +1,5 @@
+from .export import *
+from .upload import *
+from .media import *
+from .room import *
+from .history import *
@@ -0,0 +1,89 @@
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .base import *
+from ..models import ChatRoom
+from ..exports import (
+    CONTENT_TYPES,
+    EXPORT_FORMATS,
+    aiter_blocks,
+    iter_room_export,
+    parse_export_bound,
+)
+
+
+class RoomExportView(APIView):
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    # Stream a full room export (messages + read receipts) for compliance
+    @swagger_auto_schema(
+        tags=["Chat"],
+        operation_id="chat_room_export",
+        operation_description="Stream all messages and read receipts of a room as NDJSON or CSV (staff only)",
+        manual_parameters=[
+            openapi.Parameter('file_format', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=list(EXPORT_FORMATS), description="Export format, defaults to ndjson"),
+            openapi.Parameter('since', openapi.IN_QUERY, type=openapi.TYPE_STRING, description="Inclusive lower bound (ISO date or datetime)"),
+            openapi.Parameter('until', openapi.IN_QUERY, type=openapi.TYPE_STRING, description="Exclusive upper bound (ISO date or datetime)"),
+            openapi.Parameter('gzip', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN, description="Gzip the stream on the fly"),
+        ],
+        responses={
+            200: openapi.Response(
+                '<b>Success:</b> Ok (streamed file)',
+            ),
+            400: openapi.Response(
+                '<b>Error:</b> Bad request <br><b>Response detail examples:</b> "Unsupported export format.", "Invalid date or datetime: {value}"',
+                ErrorResponseSerializer
+            ),
+            403: openapi.Response(
+                '<b>Error:</b> Forbidden',
+                ErrorResponseSerializer
+            ),
+            404: openapi.Response(
+                '<b>Error:</b> Not found <br><b>Response detail examples:</b> "Room not found."',
+                ErrorResponseSerializer
+            ),
+        }
+    )
+    def get(self, request, room_id):
+        export_format = request.query_params.get('file_format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {
+                    "detail": "Unsupported export format."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            since = parse_export_bound(request.query_params.get('since'))
+            until = parse_export_bound(request.query_params.get('until'), upper=True)
+        except ValueError as e:
+            return Response(
+                {
+                    "detail": str(e)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if not ChatRoom.objects.filter(id=room_id).exists():
+            return Response(
+                {
+                    "detail": "Room not found."
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        compress = request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+        blocks = iter_room_export(room_id, export_format, since=since, until=until, compress=compress)
+        if isinstance(request._request, ASGIRequest):
+            blocks = aiter_blocks(blocks)
+
+        filename = f"room-{room_id}-{timezone.now():%Y%m%d%H%M%S}.{export_format}"
+        if compress:
+            filename += '.gz'
+
+        content_type = 'application/gzip' if compress else CONTENT_TYPES[export_format]
+        response = StreamingHttpResponse(blocks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
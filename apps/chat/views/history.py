@@ -0,0 +1,161 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import OuterRef, Q, Subquery
+
+from .base import *
+from ..models import Message, RoomMembership
+from ..profiles import sender_profiles
+from ..serializers import InboxRoomSerializer, MessageHistorySerializer, MessageSerializer
+
+
+def parse_limit(value):
+    """Page size from a `limit` query parameter, or None if it is invalid."""
+    if not value:
+        return settings.CHAT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        return None
+    return limit if 1 <= limit <= settings.CHAT_MAX_PAGE_SIZE else None
+
+
+class RoomMessagesView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    # Page through a room's history, newest first
+    @swagger_auto_schema(
+        tags=["Chat"],
+        operation_id="chat_room_messages",
+        operation_description="Messages of a room the user is a member of, newest first",
+        manual_parameters=[
+            openapi.Parameter('before', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_UUID, description="Only messages older than this message (next_before of the previous page)"),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description="Messages per page"),
+        ],
+        responses={
+            200: openapi.Response(
+                '<b>Success:</b> Ok',
+                MessageHistorySerializer
+            ),
+            400: openapi.Response(
+                '<b>Error:</b> Bad request <br><b>Response detail examples:</b> "Invalid limit.", "Invalid before."',
+                ErrorResponseSerializer
+            ),
+            404: openapi.Response(
+                '<b>Error:</b> Not found <br><b>Response detail examples:</b> "Room not found."',
+                ErrorResponseSerializer
+            ),
+        }
+    )
+    def get(self, request, room_id):
+        limit = parse_limit(request.query_params.get('limit'))
+        if limit is None:
+            return Response(
+                {
+                    "detail": "Invalid limit."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not RoomMembership.objects.filter(room_id=room_id, user=request.user).exists():
+            return Response(
+                {
+                    "detail": "Room not found."
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        messages = Message.objects.filter(room_id=room_id, deleted_at__isnull=True)
+        before = request.query_params.get('before')
+        if before:
+            try:
+                cursor = Message.objects.filter(id=before, room_id=room_id).values_list('created_at', 'id').first()
+            except ValidationError:
+                cursor = None
+            if cursor is None:
+                return Response(
+                    {
+                        "detail": "Invalid before."
+                    },
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            # Keyset pagination on (created_at, id), which stays stable while messages arrive
+            created_at, message_id = cursor
+            messages = messages.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id))
+
+        page = list(messages.select_related('image_derivative').order_by('-created_at', '-id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        return Response(
+            {
+                "results": MessageSerializer(page, many=True).data,
+                "next_before": page[-1].id if has_more else None
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+class InboxView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    # The user's rooms with their latest message, most recently active first
+    @swagger_auto_schema(
+        tags=["Chat"],
+        operation_id="chat_inbox",
+        operation_description="Rooms of the requesting user, most recently active first, with the unread count and latest message",
+        manual_parameters=[
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description="Rooms per page"),
+            openapi.Parameter('offset', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description="Rooms to skip"),
+        ],
+        responses={
+            200: openapi.Response(
+                '<b>Success:</b> Ok',
+                InboxRoomSerializer(many=True)
+            ),
+            400: openapi.Response(
+                '<b>Error:</b> Bad request <br><b>Response detail examples:</b> "Invalid limit.", "Invalid offset."',
+                ErrorResponseSerializer
+            ),
+        }
+    )
+    def get(self, request):
+        limit = parse_limit(request.query_params.get('limit'))
+        if limit is None:
+            return Response(
+                {
+                    "detail": "Invalid limit."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        offset = request.query_params.get('offset', '0')
+        if not offset.isdigit():
+            return Response(
+                {
+                    "detail": "Invalid offset."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        offset = int(offset)
+
+        latest = Message.objects.filter(room_id=OuterRef('room_id'), deleted_at__isnull=True).order_by('-created_at', '-id')
+        memberships = list(
+            RoomMembership.objects.filter(user=request.user)
+            .annotate(last_message_id=Subquery(latest.values('id')[:1]))
+            .select_related('room')
+            .order_by('-room__updated_at', 'room_id')[offset:offset + limit]
+        )
+        last_messages = Message.objects.in_bulk(
+            [membership.last_message_id for membership in memberships if membership.last_message_id]
+        )
+        sender_profiles.get_many({message.sender_id for message in last_messages.values()})
+
+        rooms = [
+            {
+                'id': membership.room.id,
+                'name': membership.room.name,
+                'room_type': membership.room.room_type,
+                'unread_count': membership.unread_count,
+                'updated_at': membership.room.updated_at,
+                'last_message': last_messages.get(membership.last_message_id),
+            }
+            for membership in memberships
+        ]
+        return Response(InboxRoomSerializer(rooms, many=True).data, status=status.HTTP_200_OK)
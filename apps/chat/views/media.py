@@ -0,0 +1,76 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+from .base import *
+from ..media import serve_field_file
+from ..models import Message
+
+
+MEDIA_VARIANTS = ('original', 'thumbnail', 'web')
+
+
+class FileContentNegotiation(DefaultContentNegotiation):
+    # The response is the file itself, so Accept: image/* must not end in a 406
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class MessageMediaView(APIView):
+    permission_classes = [IsAuthenticated]
+    content_negotiation_class = FileContentNegotiation
+
+    # Download the image or video of a message, only for members of its room
+    @swagger_auto_schema(
+        tags=["Chat"],
+        operation_id="chat_message_media",
+        operation_description=(
+            "Download the attachment of a message: 'original' for the uploaded image or video, 'thumbnail' "
+            "or 'web' for image derivatives. Supports Range, If-Range, If-None-Match and If-Modified-Since"
+        ),
+        responses={
+            200: openapi.Response(
+                '<b>Success:</b> The file'
+            ),
+            206: openapi.Response(
+                '<b>Success:</b> Partial content for a Range request'
+            ),
+            304: openapi.Response(
+                '<b>Success:</b> Not modified'
+            ),
+            404: openapi.Response(
+                '<b>Error:</b> Not found <br><b>Response detail examples:</b> "Message not found.", "Media not found."',
+                ErrorResponseSerializer
+            ),
+            416: openapi.Response(
+                '<b>Error:</b> Range not satisfiable'
+            ),
+        }
+    )
+    def get(self, request, message_id, variant):
+        message = Message.objects.filter(
+            id=message_id,
+            room__roommembership__user=request.user,
+            deleted_at__isnull=True
+        ).select_related('image_derivative').first()
+        if message is None:
+            return Response(
+                {
+                    "detail": "Message not found."
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        field_file = None
+        if variant == 'original':
+            field_file = message.image or message.video
+        elif variant in MEDIA_VARIANTS and message.image_derivative and message.image_derivative.status == 'ready':
+            field_file = getattr(message.image_derivative, variant)
+        if not field_file:
+            return Response(
+                {
+                    "detail": "Media not found."
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        # The Django request: file responses bypass DRF rendering
+        return serve_field_file(request._request, field_file)
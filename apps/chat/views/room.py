@@ -0,0 +1,249 @@
+from django.contrib.auth.models import User
+
+from .base import *
+from ..memberships import add_members, create_room, get_or_create_direct_room, remove_members
+from ..models import ChatRoom, RoomMembership
+from ..serializers import (
+    DirectRoomSerializer,
+    RoomCreateSerializer,
+    RoomMembersResultSerializer,
+    RoomMembersSerializer,
+    RoomSummarySerializer,
+)
+
+
+class RoomCreateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    # Create a room with its members in one request
+    @swagger_auto_schema(
+        tags=["Chat"],
+        operation_id="chat_room_create",
+        operation_description="Create a room. The requesting user becomes its admin; listed users that exist are added as members",
+        request_body=RoomCreateSerializer,
+        responses={
+            201: openapi.Response(
+                '<b>Success:</b> Created',
+                RoomSummarySerializer
+            ),
+            400: openapi.Response(
+                '<b>Error:</b> Bad request <br><b>Response detail examples:</b> "Invalid input.", "Use /api/chat/rooms/direct/ to open a private room."',
+                ErrorResponseSerializer
+            ),
+        }
+    )
+    def post(self, request):
+        serializer = RoomCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {
+                    "detail": "Invalid input."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        data = serializer.validated_data
+        if data['room_type'] == 'private':
+            return Response(
+                {
+                    "detail": "Use /api/chat/rooms/direct/ to open a private room."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        room, _ = create_room(request.user, data.get('name') or None, data['room_type'], data['members'])
+        return Response(RoomSummarySerializer(room).data, status=status.HTTP_201_CREATED)
+
+
+class DirectRoomView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    # Open (or reopen) the private room with another user
+    @swagger_auto_schema(
+        tags=["Chat"],
+        operation_id="chat_room_direct",
+        operation_description="Get the private room between the requesting user and another user, creating it on first use",
+        request_body=DirectRoomSerializer,
+        responses={
+            200: openapi.Response(
+                '<b>Success:</b> Existing room',
+                RoomSummarySerializer
+            ),
+            201: openapi.Response(
+                '<b>Success:</b> Created',
+                RoomSummarySerializer
+            ),
+            400: openapi.Response(
+                '<b>Error:</b> Bad request <br><b>Response detail examples:</b> "Invalid input.", "Cannot open a private room with yourself."',
+                ErrorResponseSerializer
+            ),
+            404: openapi.Response(
+                '<b>Error:</b> Not found <br><b>Response detail examples:</b> "User not found."',
+                ErrorResponseSerializer
+            ),
+        }
+    )
+    def post(self, request):
+        serializer = DirectRoomSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {
+                    "detail": "Invalid input."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        other_id = serializer.validated_data['user_id']
+
+        if other_id == request.user.id:
+            return Response(
+                {
+                    "detail": "Cannot open a private room with yourself."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not User.objects.filter(id=other_id, is_active=True).exists():
+            return Response(
+                {
+                    "detail": "User not found."
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        room, created = get_or_create_direct_room(request.user, other_id)
+        return Response(
+            RoomSummarySerializer(room).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
+
+class RoomMembersView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def check_room_admin(self, request, room_id):
+        """None if the user may manage the room's members, else the error response."""
+        room_type = ChatRoom.objects.filter(id=room_id).values_list('room_type', flat=True).first()
+        role = None
+        if room_type is not None:
+            role = RoomMembership.objects.filter(room_id=room_id, user=request.user).values_list('role', flat=True).first()
+        if room_type is None or (role is None and not request.user.is_staff):
+            return Response(
+                {
+                    "detail": "Room not found."
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+        if role != 'admin' and not request.user.is_staff:
+            return Response(
+                {
+                    "detail": "Only room admins can manage members."
+                },
+                status=status.HTTP_403_FORBIDDEN
+            )
+        if room_type == 'private':
+            # A private room is keyed by its two members (dm_user_low, dm_user_high)
+            return Response(
+                {
+                    "detail": "Members of a private room cannot be changed."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return None
+
+    def get_user_ids(self, request):
+        serializer = RoomMembersSerializer(data=request.data)
+        if not serializer.is_valid():
+            return None
+        return serializer.validated_data['user_ids']
+
+    # Add many members at once
+    @swagger_auto_schema(
+        tags=["Chat"],
+        operation_id="chat_room_members_add",
+        operation_description="Add users to a group room in bulk (room admins only). Unknown users and existing members are skipped",
+        request_body=RoomMembersSerializer,
+        responses={
+            200: openapi.Response(
+                '<b>Success:</b> Ok',
+                RoomMembersResultSerializer
+            ),
+            400: openapi.Response(
+                '<b>Error:</b> Bad request <br><b>Response detail examples:</b> "Invalid input.", "Members of a private room cannot be changed."',
+                ErrorResponseSerializer
+            ),
+            403: openapi.Response(
+                '<b>Error:</b> Forbidden <br><b>Response detail examples:</b> "Only room admins can manage members."',
+                ErrorResponseSerializer
+            ),
+            404: openapi.Response(
+                '<b>Error:</b> Not found <br><b>Response detail examples:</b> "Room not found."',
+                ErrorResponseSerializer
+            ),
+        }
+    )
+    def post(self, request, room_id):
+        error = self.check_room_admin(request, room_id)
+        if error is not None:
+            return error
+        user_ids = self.get_user_ids(request)
+        if user_ids is None:
+            return Response(
+                {
+                    "detail": "Invalid input."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        added = add_members(room_id, user_ids)
+        return Response(
+            {
+                "added": len(added),
+                "total_members": RoomMembership.objects.filter(room_id=room_id).count()
+            },
+            status=status.HTTP_200_OK
+        )
+
+    # Remove many members at once
+    @swagger_auto_schema(
+        tags=["Chat"],
+        operation_id="chat_room_members_remove",
+        operation_description="Remove users from a group room in bulk (room admins only). Their open sockets leave the room",
+        request_body=RoomMembersSerializer,
+        responses={
+            200: openapi.Response(
+                '<b>Success:</b> Ok',
+                RoomMembersResultSerializer
+            ),
+            400: openapi.Response(
+                '<b>Error:</b> Bad request <br><b>Response detail examples:</b> "Invalid input.", "Members of a private room cannot be changed."',
+                ErrorResponseSerializer
+            ),
+            403: openapi.Response(
+                '<b>Error:</b> Forbidden <br><b>Response detail examples:</b> "Only room admins can manage members."',
+                ErrorResponseSerializer
+            ),
+            404: openapi.Response(
+                '<b>Error:</b> Not found <br><b>Response detail examples:</b> "Room not found."',
+                ErrorResponseSerializer
+            ),
+        }
+    )
+    def delete(self, request, room_id):
+        error = self.check_room_admin(request, room_id)
+        if error is not None:
+            return error
+        user_ids = self.get_user_ids(request)
+        if user_ids is None:
+            return Response(
+                {
+                    "detail": "Invalid input."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        removed = remove_members(room_id, user_ids)
+        return Response(
+            {
+                "removed": len(removed),
+                "total_members": RoomMembership.objects.filter(room_id=room_id).count()
+            },
+            status=status.HTTP_200_OK
+        )
@@ -0,0 +1,247 @@
+from django.urls import reverse
+
+from .base import *
+from ..models import MediaUpload, RoomMembership
+from ..serializers import MediaUploadCreateSerializer, MediaUploadSerializer
+from ..uploads import UploadError, abort_upload, complete_upload, max_size, write_chunk
+
+
+def upload_response(upload, status_code=status.HTTP_200_OK):
+    response = Response(MediaUploadSerializer(upload).data, status=status_code)
+    response['Upload-Offset'] = str(upload.received)
+    return response
+
+
+class MediaUploadCreateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    # Open a resumable upload session for an image or video message
+    @swagger_auto_schema(
+        tags=["Chat"],
+        operation_id="chat_upload_create",
+        operation_description="Start a chunked upload of an image or video into a room. Send the bytes with PATCH /api/chat/uploads/{id}/",
+        request_body=MediaUploadCreateSerializer,
+        responses={
+            201: openapi.Response(
+                '<b>Success:</b> Created',
+                MediaUploadSerializer
+            ),
+            400: openapi.Response(
+                '<b>Error:</b> Bad request <br><b>Response detail examples:</b> "Invalid input."',
+                ErrorResponseSerializer
+            ),
+            404: openapi.Response(
+                '<b>Error:</b> Not found <br><b>Response detail examples:</b> "Room not found."',
+                ErrorResponseSerializer
+            ),
+            413: openapi.Response(
+                '<b>Error:</b> Payload too large <br><b>Response detail examples:</b> "Videos may be at most {integer} bytes."',
+                ErrorResponseSerializer
+            ),
+        }
+    )
+    def post(self, request, room_id):
+        serializer = MediaUploadCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {
+                    "detail": "Invalid input."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        data = serializer.validated_data
+
+        if not RoomMembership.objects.filter(room_id=room_id, user=request.user).exists():
+            return Response(
+                {
+                    "detail": "Room not found."
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        if data['size'] > max_size(data['media_type']):
+            return Response(
+                {
+                    "detail": f"{data['media_type'].capitalize()}s may be at most {max_size(data['media_type'])} bytes."
+                },
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        upload = MediaUpload.objects.create(
+            room_id=room_id,
+            user=request.user,
+            media_type=data['media_type'],
+            filename=data['filename'],
+            content_type=data.get('content_type', ''),
+            total_size=data['size'],
+            checksum=data.get('checksum', ''),
+            caption=data.get('caption', ''),
+        )
+        response = upload_response(upload, status.HTTP_201_CREATED)
+        response['Location'] = reverse('media_upload', args=[upload.id])
+        return response
+
+
+class MediaUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_upload(self, request, upload_id):
+        return MediaUpload.objects.filter(pk=upload_id, user=request.user).first()
+
+    # Current offset of an upload, to resume after an interruption
+    @swagger_auto_schema(
+        tags=["Chat"],
+        operation_id="chat_upload_status",
+        operation_description="Get the status and offset of an upload; resume by sending the next chunk from this offset",
+        responses={
+            200: openapi.Response(
+                '<b>Success:</b> Ok',
+                MediaUploadSerializer
+            ),
+            404: openapi.Response(
+                '<b>Error:</b> Not found <br><b>Response detail examples:</b> "Upload not found."',
+                ErrorResponseSerializer
+            ),
+        }
+    )
+    def get(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        if upload is None:
+            return Response(
+                {
+                    "detail": "Upload not found."
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return upload_response(upload)
+
+    # Append one chunk; the chunk completing the file creates the message
+    @swagger_auto_schema(
+        tags=["Chat"],
+        operation_id="chat_upload_chunk",
+        operation_description="Send the raw bytes of one chunk. The chunk that completes the file creates the message and broadcasts it to the room. If creating the message fails, the upload stays at its full offset; an empty chunk at that offset retries it",
+        manual_parameters=[
+            openapi.Parameter('Upload-Offset', openapi.IN_HEADER, type=openapi.TYPE_INTEGER, required=True, description="Byte offset of this chunk; must equal the current upload offset"),
+            openapi.Parameter('Upload-Checksum', openapi.IN_HEADER, type=openapi.TYPE_STRING, required=True, description="Hex SHA-256 of this chunk"),
+        ],
+        responses={
+            200: openapi.Response(
+                '<b>Success:</b> Chunk stored',
+                MediaUploadSerializer
+            ),
+            201: openapi.Response(
+                '<b>Success:</b> Upload complete, message created',
+                MediaUploadSerializer
+            ),
+            400: openapi.Response(
+                '<b>Error:</b> Bad request <br><b>Response detail examples:</b> "Upload-Offset and Upload-Checksum headers are required.", "Chunk checksum mismatch."',
+                ErrorResponseSerializer
+            ),
+            404: openapi.Response(
+                '<b>Error:</b> Not found <br><b>Response detail examples:</b> "Upload not found."',
+                ErrorResponseSerializer
+            ),
+            409: openapi.Response(
+                '<b>Error:</b> Conflict <br><b>Response detail examples:</b> "Expected offset {integer}.", "Upload is already being completed."',
+                ErrorResponseSerializer
+            ),
+            411: openapi.Response(
+                '<b>Error:</b> Length required',
+                ErrorResponseSerializer
+            ),
+            413: openapi.Response(
+                '<b>Error:</b> Payload too large <br><b>Response detail examples:</b> "Chunks may be at most {integer} bytes."',
+                ErrorResponseSerializer
+            ),
+            503: openapi.Response(
+                '<b>Error:</b> Service unavailable <br><b>Response detail examples:</b> "Too many uploads in progress, retry shortly."',
+                ErrorResponseSerializer
+            ),
+        }
+    )
+    def patch(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        if upload is None:
+            return Response(
+                {
+                    "detail": "Upload not found."
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            checksum = request.headers['Upload-Checksum']
+        except (KeyError, ValueError):
+            return Response(
+                {
+                    "detail": "Upload-Offset and Upload-Checksum headers are required."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            length = int(request.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return Response(
+                {
+                    "detail": "Content-Length is required."
+                },
+                status=status.HTTP_411_LENGTH_REQUIRED
+            )
+
+        try:
+            # Read the raw body stream; request.data would buffer the whole chunk
+            write_chunk(upload, offset, request._request, length, checksum)
+            if upload.received < upload.total_size:
+                return upload_response(upload)
+            complete_upload(upload)
+        except UploadError as e:
+            response = Response(
+                {
+                    "detail": e.detail
+                },
+                status=e.status_code
+            )
+            response['Upload-Offset'] = str(upload.received)
+            if e.status_code == status.HTTP_503_SERVICE_UNAVAILABLE:
+                response['Retry-After'] = '1'
+            return response
+        return upload_response(upload, status.HTTP_201_CREATED)
+
+    # Abandon an upload and discard the bytes received so far
+    @swagger_auto_schema(
+        tags=["Chat"],
+        operation_id="chat_upload_abort",
+        operation_description="Abort an unfinished upload",
+        responses={
+            204: openapi.Response(
+                '<b>Success:</b> No content',
+            ),
+            404: openapi.Response(
+                '<b>Error:</b> Not found <br><b>Response detail examples:</b> "Upload not found."',
+                ErrorResponseSerializer
+            ),
+            409: openapi.Response(
+                '<b>Error:</b> Conflict <br><b>Response detail examples:</b> "Upload is already complete."',
+                ErrorResponseSerializer
+            ),
+        }
+    )
+    def delete(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        if upload is None:
+            return Response(
+                {
+                    "detail": "Upload not found."
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+        if upload.status in ('completing', 'complete'):
+            return Response(
+                {
+                    "detail": "Upload is already complete."
+                },
+                status=status.HTTP_409_CONFLICT
+            )
+        abort_upload(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Subscription
+from .models import Subscription, StripeEvent
 
 
 @admin.register(Subscription)
@@ -24,3 +24,12 @@ class SubscriptionAdmin(admin.ModelAdmin):
             'fields': ('created_at', 'updated_at'),
         }),
     )
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'ordering_key', 'status', 'attempts', 'stripe_created', 'received_at', 'processed_at')
+    readonly_fields = ('received_at', 'processed_at')
+    search_fields = ('event_id', 'ordering_key')
+    list_filter = ('status', 'event_type', 'received_at')
+    ordering = ('-stripe_created',)
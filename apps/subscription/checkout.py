@@ -0,0 +1,140 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .models import Subscription
+
+
+_client = None
+_client_lock = threading.Lock()
+_executor = None
+
+# Checkout sessions being created, per user, in this process
+_inflight = {}
+
+
+def get_stripe_client():
+    """
+    Process-wide Stripe client. The requests-based HTTP client keeps one
+    keep-alive session per thread, so repeated calls from the same worker or
+    pool thread reuse their TLS connection instead of opening a new one.
+    """
+    global _client
+    if _client is None:
+        # Imported on first use: the stripe package takes about a second to load
+        import stripe
+
+        with _client_lock:
+            if _client is None:
+                _client = stripe.StripeClient(
+                    settings.STRIPE_SECRET_KEY or '',
+                    base_addresses={'api': settings.STRIPE_API_BASE},
+                    max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+                    http_client=stripe.RequestsClient(
+                        timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT),
+                    ),
+                )
+    return _client
+
+
+def _stripe_executor():
+    # Async callers run Stripe requests here: at most STRIPE_HTTP_POOL_SIZE
+    # threads, hence at most that many open connections to the API
+    global _executor
+    if _executor is None:
+        with _client_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.STRIPE_HTTP_POOL_SIZE, thread_name_prefix='stripe-http'
+                )
+    return _executor
+
+
+def _stripe_call(func):
+    return sync_to_async(func, thread_sensitive=False, executor=_stripe_executor())
+
+
+def subscription_for(user):
+    """
+    The user's subscription row, created on first checkout. Rows that already
+    carry a Stripe customer win, oldest first, matching the webhook lookup.
+    The user's row is locked while looking, so concurrent first checkouts in
+    other processes wait and find the row created here.
+    """
+    with transaction.atomic():
+        list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+        sub = (
+            Subscription.objects.filter(user=user, stripe_customer_id__isnull=False).order_by('created_at').first()
+            or Subscription.objects.filter(user=user).order_by('created_at').first()
+        )
+        if sub is None:
+            sub = Subscription.objects.create(user=user)
+    return sub
+
+
+def create_customer(user, sub):
+    # Keyed by the local row, so a retried or concurrent request gets the same customer back
+    customer = get_stripe_client().v1.customers.create(
+        params={'name': user.username},
+        options={'idempotency_key': f'customer-{sub.pk}'},
+    )
+    return customer.id
+
+
+def save_customer(sub, customer_id):
+    Subscription.objects.filter(pk=sub.pk, stripe_customer_id__isnull=True).update(stripe_customer_id=customer_id)
+    sub.refresh_from_db(fields=['stripe_customer_id'])
+    return sub.stripe_customer_id
+
+
+def create_session(customer_id):
+    session = get_stripe_client().v1.checkout.sessions.create(params={
+        'payment_method_types': ['card'],
+        'mode': 'subscription',
+        'line_items': [{
+            'price': f'{settings.STRIPE_PRICE_ID}',  # Create recurring price in Stripe dashboard for R99/month
+            'quantity': 1,
+        }],
+        'success_url': 'https://079d54ab7d23.ngrok-free.app/api/subscription/success/',
+        'cancel_url': 'https://079d54ab7d23.ngrok-free.app/api/subscription/cancel/',
+        'customer': customer_id,
+    })
+    return session.url
+
+
+def create_checkout_session(user):
+    sub = subscription_for(user)
+    customer_id = sub.stripe_customer_id or save_customer(sub, create_customer(user, sub))
+    return create_session(customer_id)
+
+
+async def _acreate_checkout_session(user):
+    # Database steps stay on the thread-sensitive executor; Stripe calls go to
+    # the Stripe pool so a slow API response never blocks the event loop
+    sub = await sync_to_async(subscription_for)(user)
+    customer_id = sub.stripe_customer_id
+    if not customer_id:
+        customer_id = await _stripe_call(create_customer)(user, sub)
+        customer_id = await sync_to_async(save_customer)(sub, customer_id)
+    return await _stripe_call(create_session)(customer_id)
+
+
+async def acreate_checkout_session(user):
+    """
+    Async create_checkout_session(). Concurrent calls for the same user (a
+    double-clicked button) share one in-flight Stripe session when they reach
+    the same process. Calls served by different processes share the
+    Subscription row and, through its idempotency key, the Stripe customer,
+    but each creates its own checkout session.
+    """
+    task = _inflight.get(user.pk)
+    if task is None:
+        task = _inflight[user.pk] = asyncio.ensure_future(_acreate_checkout_session(user))
+        task.add_done_callback(lambda _: _inflight.pop(user.pk, None))
+    # A caller that disconnects must not cancel the session the others wait for
+    return await asyncio.shield(task)
@@ -0,0 +1,231 @@
+"""
+A small in-process stand-in for the Stripe API.
+
+It speaks the same wire format as api.stripe.com for the endpoints this
+project calls (form-encoded requests, JSON objects, Idempotency-Key replay),
+so the real stripe library can be pointed at it with STRIPE_API_BASE. Tests
+and benchmarks use it to run checkout flows offline with a configurable
+response latency, and it counts requests and TCP connections so connection
+reuse can be verified.
+"""
+import json
+import secrets
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+def _object_id(prefix):
+    return f"{prefix}_{secrets.token_hex(12)}"
+
+
+class FakeStripeState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.customers = {}
+        self.sessions = {}
+        self.subscriptions = {}
+        self.idempotent_responses = {}
+        self.requests = Counter()
+        self.connections = 0
+
+    def create_customer(self, params):
+        customer = {
+            'id': _object_id('cus'),
+            'object': 'customer',
+            'created': int(time.time()),
+            'livemode': False,
+            'name': params.get('name'),
+            'email': params.get('email'),
+            'metadata': {},
+        }
+        self.customers[customer['id']] = customer
+        return 200, customer
+
+    def create_checkout_session(self, params):
+        customer_id = params.get('customer')
+        if customer_id and customer_id not in self.customers:
+            return 400, {'error': {
+                'type': 'invalid_request_error',
+                'param': 'customer',
+                'message': f"No such customer: '{customer_id}'",
+            }}
+        session_id = _object_id('cs_test')
+        session = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'created': int(time.time()),
+            'livemode': False,
+            'customer': customer_id,
+            'mode': params.get('mode'),
+            'payment_status': 'unpaid',
+            'status': 'open',
+            'subscription': None,
+            'success_url': params.get('success_url'),
+            'cancel_url': params.get('cancel_url'),
+            'url': f"https://checkout.stripe.com/c/pay/{session_id}",
+        }
+        self.sessions[session_id] = session
+        return 200, session
+
+    def add_subscription(self, customer_id, status='active', created=None):
+        """Seed a subscription, as if a checkout had completed on Stripe."""
+        with self.lock:
+            subscription = {
+                'id': _object_id('sub'),
+                'object': 'subscription',
+                'created': int(created if created is not None else time.time()),
+                'livemode': False,
+                'customer': customer_id,
+                'status': status,
+                'cancel_at_period_end': False,
+                'metadata': {},
+            }
+            self.subscriptions[subscription['id']] = subscription
+        return subscription
+
+    def list_subscriptions(self, params):
+        # Newest first, like Stripe; without a status filter canceled ones are left out
+        status = params.get('status')
+        subscriptions = sorted(self.subscriptions.values(), key=lambda sub: (sub['created'], sub['id']), reverse=True)
+        if status != 'all':
+            subscriptions = [
+                sub for sub in subscriptions
+                if sub['status'] == status or (status is None and sub['status'] != 'canceled')
+            ]
+        if params.get('customer'):
+            subscriptions = [sub for sub in subscriptions if sub['customer'] == params['customer']]
+        if params.get('starting_after'):
+            ids = [sub['id'] for sub in subscriptions]
+            if params['starting_after'] not in ids:
+                return 400, {'error': {
+                    'type': 'invalid_request_error',
+                    'param': 'starting_after',
+                    'message': f"No such subscription: '{params['starting_after']}'",
+                }}
+            subscriptions = subscriptions[ids.index(params['starting_after']) + 1:]
+
+        limit = min(max(int(params.get('limit') or 10), 1), 100)
+        return 200, {
+            'object': 'list',
+            'url': '/v1/subscriptions',
+            'has_more': len(subscriptions) > limit,
+            'data': subscriptions[:limit],
+        }
+
+    def retrieve_customer(self, customer_id):
+        customer = self.customers.get(customer_id)
+        if customer is None:
+            return 404, {'error': {
+                'type': 'invalid_request_error',
+                'message': f"No such customer: '{customer_id}'",
+            }}
+        return 200, customer
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests, like the real API
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.state.lock:
+            self.server.state.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Request-Id', _object_id('req'))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        params = dict(parse_qsl(body or url.query, keep_blank_values=True))
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        state = self.server.state
+        idempotency_key = self.headers.get('Idempotency-Key') if method == 'POST' else None
+        with state.lock:
+            state.requests[f"{method} {url.path}"] += 1
+            if idempotency_key and idempotency_key in state.idempotent_responses:
+                status, response = state.idempotent_responses[idempotency_key]
+            else:
+                status, response = self.route(method, url.path, params)
+                if idempotency_key:
+                    state.idempotent_responses[idempotency_key] = (status, response)
+        self._respond(status, response)
+
+    def route(self, method, path, params):
+        state = self.server.state
+        if method == 'POST' and path == '/v1/customers':
+            return state.create_customer(params)
+        if method == 'POST' and path == '/v1/checkout/sessions':
+            return state.create_checkout_session(params)
+        if method == 'GET' and path == '/v1/subscriptions':
+            return state.list_subscriptions(params)
+        if method == 'GET' and path.startswith('/v1/customers/'):
+            return state.retrieve_customer(path.rsplit('/', 1)[1])
+        return 404, {'error': {
+            'type': 'invalid_request_error',
+            'message': f"Unrecognized request URL ({method}: {path}).",
+        }}
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+
+class FakeStripeServer:
+    """
+    Run the fake API on a background thread:
+
+        with FakeStripeServer(latency=0.05) as stripe_api:
+            with override_settings(STRIPE_API_BASE=stripe_api.url):
+                ...
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.httpd = ThreadingHTTPServer((host, port), FakeStripeHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.state = FakeStripeState()
+        self._thread = None
+
+    @property
+    def state(self):
+        return self.httpd.state
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-stripe', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
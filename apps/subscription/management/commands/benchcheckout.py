@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Max
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.subscription.fake_stripe import FakeStripeServer
+from apps.subscription.models import Subscription
+from utils.benchmark import build_report, isolated_database, latency_summary, write_report
+
+
+SYNC_URL = '/api/subscription/create-checkout-session/'
+ASYNC_URL = '/api/subscription/create-checkout-session/async/'
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark checkout session creation through the sync and async views against a local "
+        "fake Stripe API with a fixed response latency, including double-clicks and returning users."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--clicks', type=int, default=2, help="Concurrent clicks per user in each round.")
+        parser.add_argument('--rounds', type=int, default=2,
+                            help="Checkout rounds per user; later rounds reuse the Stripe customer.")
+        parser.add_argument('--concurrency', type=int, default=8, help="Worker threads for the sync view.")
+        parser.add_argument('--stripe-latency-ms', type=float, default=50)
+        parser.add_argument('-o', '--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['clicks'], options['rounds'], options['concurrency']) < 1:
+            raise CommandError("--users, --clicks, --rounds and --concurrency must be positive.")
+
+        results = {}
+        with isolated_database(on_disk=True):
+            for mode in ('sync', 'async'):
+                with FakeStripeServer(latency=options['stripe_latency_ms'] / 1000) as stripe_api, override_settings(
+                    STRIPE_API_BASE=stripe_api.url, STRIPE_SECRET_KEY='sk_test_benchmark', STRIPE_PRICE_ID='price_bench',
+                ):
+                    users = self.create_users(mode, options['users'])
+                    results[mode] = self.run_mode(mode, users, stripe_api, options)
+
+            params = {key: options[key] for key in ('users', 'clicks', 'rounds', 'concurrency', 'stripe_latency_ms')}
+            write_report(build_report('checkout_session', params, results), options['output'], self.stdout)
+
+    def create_users(self, mode, count):
+        users = User.objects.bulk_create(User(username=f'bench_checkout_{mode}_{i}') for i in range(count))
+        return [(user, str(AccessToken.for_user(user))) for user in users]
+
+    def run_mode(self, mode, users, stripe_api, options):
+        clicks = [(user, token) for user, token in users for _ in range(options['clicks'])]
+        latencies, errors, urls = [], [], []
+
+        started = time.perf_counter()
+        for _ in range(options['rounds']):
+            if mode == 'sync':
+                self.click_sync(clicks, options['concurrency'], latencies, errors, urls)
+            else:
+                asyncio.run(self.click_async(clicks, latencies, errors, urls))
+        elapsed = time.perf_counter() - started
+
+        rows = Subscription.objects.filter(user__in=[user for user, _ in users])
+        per_user = rows.values('user').annotate(rows=Count('id'))
+        return {
+            'seconds': round(elapsed, 3),
+            'clicks_per_second': round(len(latencies) / elapsed, 1),
+            'errors': len(errors),
+            'latency': latency_summary(latencies),
+            'distinct_sessions': len(set(urls)),
+            'stripe_requests': dict(stripe_api.state.requests),
+            'stripe_customers': len(stripe_api.state.customers),
+            'stripe_connections': stripe_api.state.connections,
+            'subscription_rows': rows.count(),
+            'max_rows_per_user': per_user.aggregate(max=Max('rows'))['max'],
+        }
+
+    def click_sync(self, clicks, concurrency, latencies, errors, urls):
+        local = threading.local()
+
+        def click(item):
+            user, token = item
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+            started = time.perf_counter()
+            response = client.post(SYNC_URL, headers={'Authorization': f'Bearer {token}'})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors.append(response.content)
+            else:
+                urls.append(response.json()['url'])
+
+        def close_connection(_):
+            connection.close()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(click, clicks))
+            list(pool.map(close_connection, range(concurrency)))
+
+    async def click_async(self, clicks, latencies, errors, urls):
+        client = AsyncClient()
+
+        async def click(item):
+            user, token = item
+            started = time.perf_counter()
+            response = await client.post(ASYNC_URL, headers={'Authorization': f'Bearer {token}'})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors.append(response.content)
+            else:
+                urls.append(response.json()['url'])
+
+        await asyncio.gather(*(click(item) for item in clicks))
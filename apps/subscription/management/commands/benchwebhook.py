@@ -0,0 +1,182 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from apps.subscription.models import StripeEvent, Subscription
+from apps.subscription.outbox import process_pending_events
+from apps.subscription.synthetic import EventFactory, delivery_schedule, encode, sign_payload
+from utils.benchmark import build_report, isolated_database, latency_summary, write_report
+
+
+WEBHOOK_URL = '/api/subscription/stripe-webhook/'
+WEBHOOK_SECRET = 'whsec_benchmark'
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay signed synthetic Stripe events against the webhook view with duplicates and "
+        "out-of-order delivery, then drain the outbox and verify the resulting subscriptions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscriptions', type=int, default=200)
+        parser.add_argument('--invoices', type=int, default=3, help="invoice.paid events per subscription.")
+        parser.add_argument('--cancel-ratio', type=float, default=0.2)
+        parser.add_argument('--duplicate-ratio', type=float, default=0.1,
+                            help="Share of events delivered a second time.")
+        parser.add_argument('--shuffle-window', type=float, default=5,
+                            help="Seconds of event time within which deliveries are reordered.")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('-o', '--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['subscriptions'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--subscriptions and --concurrency must be positive.")
+
+        rng = random.Random(options['seed'])
+        factory = EventFactory(seed=options['seed'])
+        lifecycles = [
+            factory.subscription_lifecycle(options['invoices'], cancel=rng.random() < options['cancel_ratio'])
+            for _ in range(options['subscriptions'])
+        ]
+        events = [event for _, _, lifecycle, _ in lifecycles for event in lifecycle]
+        deliveries = delivery_schedule(events, rng, options['duplicate_ratio'], options['shuffle_window'])
+
+        # Sign up front so the timed section only measures the view
+        signed_at = int(time.time())
+        requests = []
+        for event in deliveries:
+            payload = encode(event)
+            requests.append((payload, sign_payload(payload, WEBHOOK_SECRET, signed_at)))
+
+        with isolated_database(on_disk=True), override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET):
+            self.create_fixtures(lifecycles)
+            delivery = self.replay(requests, options['concurrency'])
+            drain = self.drain(options['batch_size'])
+            consistency = self.check_consistency(lifecycles)
+
+            params = {key: options[key] for key in (
+                'subscriptions', 'invoices', 'cancel_ratio', 'duplicate_ratio',
+                'shuffle_window', 'concurrency', 'batch_size', 'seed',
+            )}
+            params['events'] = len(events)
+            params['deliveries'] = len(deliveries)
+            results = {'delivery': delivery, 'drain': drain, 'consistency': consistency}
+            write_report(build_report('stripe_webhook', params, results), options['output'], self.stdout)
+
+        if consistency['mismatches'] or consistency['duplicate_rows']:
+            raise CommandError(
+                f"{consistency['mismatches']} subscriptions ended in the wrong state, "
+                f"{consistency['duplicate_rows']} duplicate rows."
+            )
+
+    def create_fixtures(self, lifecycles):
+        # CreateCheckoutSession stores the customer before Stripe sends any event
+        users = User.objects.bulk_create(
+            User(username=f'bench_webhook_{i}') for i in range(len(lifecycles))
+        )
+        Subscription.objects.bulk_create(
+            Subscription(user=user, stripe_customer_id=customer_id)
+            for user, (customer_id, _, _, _) in zip(users, lifecycles)
+        )
+
+    def replay(self, requests, concurrency):
+        local = threading.local()
+        latencies = []
+        failures = []
+
+        def deliver(request):
+            # One test client per worker thread, like one connection per server worker
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+            payload, signature = request
+            started = time.perf_counter()
+            response = client.post(
+                WEBHOOK_URL, payload, content_type='application/json', HTTP_STRIPE_SIGNATURE=signature
+            )
+            elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                failures.append(response.status_code)
+            latencies.append(elapsed)
+
+        def close_connection(_):
+            connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(deliver, requests))
+            # Worker threads keep their own database connections open until closed
+            list(pool.map(close_connection, range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        return {
+            'seconds': round(elapsed, 3),
+            'events_per_second': round(len(requests) / elapsed, 1),
+            'errors': len(failures),
+            'latency': latency_summary(latencies),
+            'stored_events': StripeEvent.objects.count(),
+        }
+
+    def drain(self, batch_size):
+        batches = []
+        started = time.perf_counter()
+        while True:
+            batch_started = time.perf_counter()
+            applied = process_pending_events(batch_size)
+            if not applied:
+                break
+            batches.append(time.perf_counter() - batch_started)
+        elapsed = time.perf_counter() - started
+
+        processed = StripeEvent.objects.filter(status='processed').count()
+        return {
+            'seconds': round(elapsed, 3),
+            'events_per_second': round(processed / elapsed, 1) if elapsed else None,
+            'batches': len(batches),
+            'batch_latency': latency_summary(batches),
+            'processed': processed,
+            'pending': StripeEvent.objects.filter(status='pending').count(),
+            'failed': StripeEvent.objects.filter(status='failed').count(),
+        }
+
+    def check_consistency(self, lifecycles):
+        rows = {}
+        duplicates = 0
+        for sub in Subscription.objects.filter(stripe_subscription_id__isnull=False):
+            if sub.stripe_subscription_id in rows:
+                duplicates += 1
+            rows[sub.stripe_subscription_id] = sub
+
+        missing = mismatches = 0
+        for customer_id, sub_id, _, expected in lifecycles:
+            sub = rows.get(sub_id)
+            if sub is None:
+                missing += 1
+                mismatches += 1
+                continue
+            actual = {
+                'customer_id': sub.stripe_customer_id,
+                'subscription_length': sub.subscription_length,
+                'is_active': sub.is_active,
+            }
+            if actual != expected:
+                mismatches += 1
+                self.stderr.write(f"{sub_id}: expected {expected}, got {actual}")
+
+        return {
+            'subscriptions': len(lifecycles),
+            'rows': Subscription.objects.count(),
+            'duplicate_rows': duplicates,
+            'missing': missing,
+            'mismatches': mismatches,
+        }
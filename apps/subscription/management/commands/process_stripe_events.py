@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.subscription.outbox import process_pending_events
+
+
+class Command(BaseCommand):
+    help = "Apply Stripe webhook events stored in the outbox, in order per subscription, with retries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Events fetched per batch")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when the outbox is idle")
+        parser.add_argument('--once', action='store_true', help="Drain what is due and exit")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            close_old_connections()
+            applied = process_pending_events(options['batch_size'])
+            total += applied
+            if applied:
+                self.stdout.write(f"Applied {applied} event(s)")
+                continue
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"Applied {total} event(s) in total"))
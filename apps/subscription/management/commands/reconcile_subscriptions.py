@@ -0,0 +1,48 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.subscription.reconcile import (
+    Checkpoint, iter_stripe_subscriptions, push_entitlement_changes, reconcile_chunk,
+)
+
+
+SUMMARY_FIELDS = ('seen', 'matched', 'linked', 'activated', 'deactivated', 'unknown')
+
+
+class Command(BaseCommand):
+    help = (
+        "Correct local Subscription rows from the subscriptions Stripe has on record, "
+        "for when webhooks were missed. Resumable with --checkpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Stripe subscriptions diffed per transaction")
+        parser.add_argument('--page-size', type=int, default=100, help="Subscriptions per Stripe API page (max 100)")
+        parser.add_argument('--checkpoint', help="JSON file recording progress; an existing file resumes the run")
+        parser.add_argument('--dry-run', action='store_true', help="Report differences without changing anything")
+        parser.add_argument('--no-notify', action='store_true', help="Do not push entitlement changes to open sockets")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or not 1 <= options['page_size'] <= 100:
+            raise CommandError("--chunk-size must be positive and --page-size between 1 and 100.")
+
+        checkpoint = Checkpoint(None if options['dry_run'] else options['checkpoint'])
+        if checkpoint.resumed:
+            self.stdout.write(f"Resuming after {checkpoint.starting_after}")
+
+        subscriptions = iter_stripe_subscriptions(checkpoint.starting_after, options['page_size'])
+        while chunk := list(islice(subscriptions, options['chunk_size'])):
+            counts, changes = reconcile_chunk(chunk, dry_run=options['dry_run'])
+            if changes and not (options['dry_run'] or options['no_notify']):
+                push_entitlement_changes(changes)
+            checkpoint.advance(chunk[-1].id, counts)
+            self.stdout.write(
+                f"Reconciled {checkpoint.totals['seen']} subscription(s), "
+                f"{counts['activated'] + counts['deactivated'] + counts['linked']} change(s) in this chunk"
+            )
+
+        checkpoint.clear()
+        prefix = "Would apply" if options['dry_run'] else "Done"
+        summary = ', '.join(f"{field}={checkpoint.totals[field]}" for field in SUMMARY_FIELDS)
+        self.stdout.write(self.style.SUCCESS(f"{prefix}: {summary}"))
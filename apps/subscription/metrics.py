@@ -0,0 +1,9 @@
+from utils.metrics import registry
+
+
+WEBHOOK_EVENTS = registry.counter(
+    'stripe_webhook_events_total', "Stripe webhook deliveries by event type and outcome.", ['event_type', 'result'])
+WEBHOOK_LATENCY = registry.histogram(
+    'stripe_webhook_duration_seconds', "Time spent processing a Stripe webhook delivery.", ['event_type'])
+OUTBOX_EVENTS = registry.counter(
+    'stripe_outbox_events_total', "Stripe outbox events applied by the worker, by outcome.", ['event_type', 'result'])
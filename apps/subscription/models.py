@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 class Subscription(models.Model):
@@ -13,3 +14,33 @@ class Subscription(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - {'Active' if self.is_active else 'Inactive'}"
+
+
+class StripeEvent(models.Model):
+    STATUSES = (
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    )
+
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=255)
+    # Stripe subscription (or customer) the event applies to; events sharing a key are applied in order
+    ordering_key = models.CharField(max_length=255, blank=True, db_index=True)
+    payload = models.JSONField()
+    stripe_created = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['stripe_created', 'id']
+        indexes = [
+            models.Index(fields=['status', 'stripe_created'], name='stripe_event_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} ({self.status})"
@@ -0,0 +1,191 @@
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .metrics import OUTBOX_EVENTS
+from .models import StripeEvent, Subscription
+
+
+logger = logging.getLogger(__name__)
+
+HANDLED_EVENT_TYPES = (
+    'checkout.session.completed',
+    'invoice.paid',
+    'customer.subscription.deleted',
+)
+
+
+def _invoice_subscription_id(invoice):
+    # Newer API versions moved the subscription under parent.subscription_details
+    parent = invoice.get('parent') or {}
+    details = parent.get('subscription_details') or {}
+    return details.get('subscription') or invoice.get('subscription')
+
+
+def ordering_key(event):
+    obj = event['data']['object']
+    if event['type'] == 'checkout.session.completed':
+        return obj.get('subscription') or obj.get('customer') or ''
+    if event['type'] == 'invoice.paid':
+        return _invoice_subscription_id(obj) or ''
+    if event['type'] == 'customer.subscription.deleted':
+        return obj['id']
+    return ''
+
+
+def record_event(event):
+    """
+    Store a verified webhook event in the outbox. Duplicate deliveries are
+    dropped by the unique event ID in the same INSERT, without a lookup.
+    """
+    StripeEvent.objects.bulk_create([
+        StripeEvent(
+            event_id=event['id'],
+            event_type=event['type'],
+            ordering_key=ordering_key(event),
+            payload=event,
+            stripe_created=datetime.fromtimestamp(event['created'], tz=dt_timezone.utc),
+        )
+    ], ignore_conflicts=True)
+
+
+def apply_checkout_completed(event, obj):
+    customer_id = obj['customer']
+    sub_id = obj.get('subscription')
+
+    sub = Subscription.objects.select_for_update().filter(stripe_customer_id=customer_id).order_by('created_at').first()
+    if sub is None:
+        sub = Subscription(stripe_customer_id=customer_id)
+
+    if sub_id:
+        # An invoice delivered before the checkout may have created a row without a customer
+        orphan = Subscription.objects.select_for_update().filter(
+            stripe_subscription_id=sub_id, stripe_customer_id__isnull=True
+        ).exclude(pk=sub.pk).first()
+        if orphan:
+            sub.subscription_length += orphan.subscription_length
+            orphan.delete()
+
+    # A cancellation applied earlier wins over a late checkout delivery
+    cancelled = sub_id and StripeEvent.objects.filter(
+        ordering_key=sub_id, event_type='customer.subscription.deleted', status='processed'
+    ).exists()
+
+    sub.stripe_subscription_id = sub_id
+    sub.is_active = not cancelled
+    sub.save()
+    # Send welcome email here (use django mail)
+
+
+def apply_invoice_paid(event, obj):
+    # Monthly payment success
+    sub_id = _invoice_subscription_id(obj)
+    if not sub_id:
+        # One-off invoices are not tied to a subscription
+        return
+    sub, created = Subscription.objects.select_for_update().get_or_create(stripe_subscription_id=sub_id)
+    Subscription.objects.filter(pk=sub.pk).update(
+        subscription_length=F('subscription_length') + 1,
+        updated_at=timezone.now(),
+    )
+
+
+def apply_subscription_deleted(event, obj):
+    sub, created = Subscription.objects.select_for_update().get_or_create(stripe_subscription_id=obj['id'])
+    sub.is_active = False
+    sub.save(update_fields=['is_active', 'updated_at'])
+
+
+HANDLERS = {
+    'checkout.session.completed': apply_checkout_completed,
+    'invoice.paid': apply_invoice_paid,
+    'customer.subscription.deleted': apply_subscription_deleted,
+}
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(
+        settings.STRIPE_EVENT_RETRY_BASE_SECONDS * 2 ** (attempts - 1),
+        settings.STRIPE_EVENT_RETRY_MAX_SECONDS,
+    ))
+
+
+def apply_event(event_pk):
+    """
+    Apply one outbox event exactly once. The status change and the
+    subscription update commit together, so a crash leaves the event pending.
+    Returns True when the event is settled (processed now or earlier), False
+    when it failed, is backing off or is held by another worker.
+    """
+    try:
+        with transaction.atomic():
+            # Another worker holding the event is applying its key; leave the key to it
+            event = StripeEvent.objects.select_for_update(skip_locked=True).filter(pk=event_pk).first()
+            if event is None:
+                return False
+            if event.status != 'pending':
+                return True
+            if event.next_attempt_at > timezone.now():
+                return False
+            HANDLERS[event.event_type](event, event.payload['data']['object'])
+            event.status = 'processed'
+            event.processed_at = timezone.now()
+            event.last_error = ''
+            event.attempts += 1
+            event.save(update_fields=['status', 'processed_at', 'last_error', 'attempts'])
+        OUTBOX_EVENTS.inc(event.event_type, 'processed')
+        return True
+    except Exception as e:
+        logger.exception("Failed to apply Stripe event %s", event_pk)
+        event = StripeEvent.objects.get(pk=event_pk)
+        event.attempts += 1
+        event.last_error = f"{type(e).__name__}: {e}"
+        if event.attempts >= settings.STRIPE_EVENT_MAX_ATTEMPTS:
+            event.status = 'failed'
+            OUTBOX_EVENTS.inc(event.event_type, 'failed')
+        else:
+            event.next_attempt_at = timezone.now() + retry_delay(event.attempts)
+            OUTBOX_EVENTS.inc(event.event_type, 'retry')
+        event.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+        return False
+
+
+def process_pending_events(batch_size=100):
+    """
+    Drain one batch of the outbox. Events are applied in Stripe creation order
+    per ordering key; a key stops at its first event that is backing off, fails
+    or is held by another worker, so later events never overtake it. Only keys
+    whose oldest pending event is due are read, oldest first, so keys backing
+    off never crowd out the others. Returns the number applied.
+    """
+    now = timezone.now()
+    pending = StripeEvent.objects.filter(status='pending')
+    earlier = pending.filter(ordering_key=OuterRef('ordering_key')).filter(
+        Q(stripe_created__lt=OuterRef('stripe_created'))
+        | Q(stripe_created=OuterRef('stripe_created'), id__lt=OuterRef('id'))
+    )
+    keys = list(
+        pending.filter(next_attempt_at__lte=now)
+        .exclude(Exists(earlier))
+        .order_by('stripe_created', 'id')
+        .values_list('ordering_key', flat=True)[:batch_size]
+    )
+
+    applied = 0
+    for key in keys:
+        events = list(
+            pending.filter(ordering_key=key)
+            .order_by('stripe_created', 'id')
+            .values('pk', 'next_attempt_at')[:batch_size - applied]
+        )
+        for event in events:
+            if event['next_attempt_at'] > now or not apply_event(event['pk']):
+                break
+            applied += 1
+        if applied >= batch_size:
+            break
+    return applied
@@ -0,0 +1,151 @@
+import json
+import os
+from collections import Counter
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.chat.groups import user_group_name
+from .checkout import get_stripe_client
+from .models import Subscription
+
+
+# Stripe keeps retrying past_due invoices; access is only revoked once it gives up
+ENTITLED_STATUSES = ('active', 'trialing', 'past_due')
+
+
+def iter_stripe_subscriptions(starting_after=None, page_size=100):
+    """Every Stripe subscription, newest first, fetched one page at a time."""
+    params = {'status': 'all', 'limit': page_size}
+    if starting_after:
+        params['starting_after'] = starting_after
+    return get_stripe_client().v1.subscriptions.list(params=params).auto_paging_iter()
+
+
+def reconcile_chunk(stripe_subscriptions, dry_run=False):
+    """
+    Bring the local rows for one chunk of Stripe subscriptions in line with
+    Stripe. Rows are matched by subscription ID, or by customer for rows whose
+    checkout webhook was missed: rows without a subscription, and rows whose
+    subscription has ended, which take the customer's newest entitled one.
+    Returns (counts, entitlement changes as (user_id, is_active) pairs).
+    """
+    counts = Counter(seen=len(stripe_subscriptions))
+    changes = []
+    now = timezone.now()
+    statuses = {sub.id: sub.status for sub in stripe_subscriptions}
+
+    def entitled(row):
+        # Stripe's word when the row's subscription is in this chunk, the row's otherwise
+        status = statuses.get(row.stripe_subscription_id)
+        return row.is_active if status is None else status in ENTITLED_STATUSES
+
+    with transaction.atomic():
+        rows = {
+            row.stripe_subscription_id: row
+            for row in Subscription.objects.select_for_update().filter(
+                stripe_subscription_id__in=list(statuses)
+            )
+        }
+        unlinked_customers = {sub.customer for sub in stripe_subscriptions if sub.id not in rows}
+        ended = [sub_id for sub_id, status in statuses.items() if status not in ENTITLED_STATUSES]
+        # Oldest row per customer, the one the checkout webhook would have updated
+        by_customer = {}
+        by_pk = {row.pk: row for row in rows.values()}
+        for row in Subscription.objects.select_for_update().filter(
+            Q(stripe_subscription_id__isnull=True) | Q(is_active=False) | Q(stripe_subscription_id__in=ended),
+            stripe_customer_id__in=unlinked_customers,
+        ).order_by('-created_at'):
+            # The same instance when the row is also matched by ID, so a relink is seen there
+            by_customer[row.stripe_customer_id] = by_pk.get(row.pk, row)
+
+        updated = {}
+        for sub in stripe_subscriptions:
+            is_active = sub.status in ENTITLED_STATUSES
+            row = rows.get(sub.id)
+            if row is not None and row.stripe_subscription_id != sub.id:
+                # Moved on to the customer's newer subscription earlier in this chunk
+                counts['matched'] += 1
+                continue
+            if row is None:
+                row = by_customer.get(sub.customer)
+                if row is not None and row.stripe_subscription_id is not None and (entitled(row) or not is_active):
+                    # Only an entitled subscription replaces one that ended
+                    row = None
+            if row is None:
+                counts['unknown'] += 1
+                continue
+            counts['matched'] += 1
+
+            if row.stripe_subscription_id == sub.id and row.is_active == is_active:
+                continue
+            if row.stripe_subscription_id != sub.id:
+                counts['linked'] += 1
+                row.stripe_subscription_id = sub.id
+            if row.is_active != is_active:
+                counts['activated' if is_active else 'deactivated'] += 1
+                row.is_active = is_active
+                if row.user_id:
+                    changes.append((row.user_id, is_active))
+            row.updated_at = now
+            updated[row.pk] = row
+
+        if updated and not dry_run:
+            Subscription.objects.bulk_update(
+                list(updated.values()), ['stripe_subscription_id', 'is_active', 'updated_at']
+            )
+    return counts, changes
+
+
+def push_entitlement_changes(changes):
+    """Tell the users' open sockets that their subscription changed."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not changes:
+        return
+
+    async def send_all():
+        for user_id, is_active in changes:
+            await channel_layer.group_send(user_group_name(user_id), {
+                'type': 'subscription_status',
+                'is_active': is_active,
+            })
+
+    async_to_sync(send_all)()
+
+
+class Checkpoint:
+    """
+    Progress of a reconciliation run in a JSON file: the last Stripe
+    subscription of the last committed chunk and the running totals.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.starting_after = None
+        self.totals = Counter()
+        if path and os.path.exists(path):
+            with open(path) as fh:
+                data = json.load(fh)
+            self.starting_after = data['starting_after']
+            self.totals.update(data['totals'])
+
+    @property
+    def resumed(self):
+        return self.starting_after is not None
+
+    def advance(self, starting_after, counts):
+        self.starting_after = starting_after
+        self.totals.update(counts)
+        if not self.path:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as fh:
+            json.dump({'starting_after': starting_after, 'totals': self.totals}, fh)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
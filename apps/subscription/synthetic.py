@@ -0,0 +1,103 @@
+import hashlib
+import hmac
+import json
+import random
+import time
+
+
+API_VERSION = '2025-09-30.clover'
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """Build a Stripe-Signature header for `payload` exactly as Stripe does."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+class EventFactory:
+    """Realistic Stripe event payloads with deterministic IDs."""
+
+    def __init__(self, seed=0, start=None):
+        self.rng = random.Random(seed)
+        self.clock = int(start if start is not None else time.time()) - 86400
+
+    def _id(self, prefix):
+        return f"{prefix}_{self.rng.getrandbits(96):024x}"
+
+    def _event(self, event_type, obj, created):
+        return {
+            'id': self._id('evt'),
+            'object': 'event',
+            'api_version': API_VERSION,
+            'created': created,
+            'livemode': False,
+            'pending_webhooks': 1,
+            'request': {'id': self._id('req'), 'idempotency_key': None},
+            'type': event_type,
+            'data': {'object': obj},
+        }
+
+    def checkout_session_completed(self, customer_id, sub_id, created):
+        return self._event('checkout.session.completed', {
+            'id': self._id('cs_test'),
+            'object': 'checkout.session',
+            'customer': customer_id,
+            'subscription': sub_id,
+            'mode': 'subscription',
+            'payment_status': 'paid',
+            'status': 'complete',
+        }, created)
+
+    def invoice_paid(self, customer_id, sub_id, created):
+        return self._event('invoice.paid', {
+            'id': self._id('in'),
+            'object': 'invoice',
+            'customer': customer_id,
+            'status': 'paid',
+            'amount_paid': 9900,
+            'currency': 'zar',
+            'parent': {
+                'type': 'subscription_details',
+                'subscription_details': {'subscription': sub_id},
+            },
+        }, created)
+
+    def subscription_deleted(self, customer_id, sub_id, created):
+        return self._event('customer.subscription.deleted', {
+            'id': sub_id,
+            'object': 'subscription',
+            'customer': customer_id,
+            'status': 'canceled',
+        }, created)
+
+    def subscription_lifecycle(self, invoices=3, cancel=False):
+        """
+        Events of one subscription in creation order plus the state they
+        should leave behind: (customer_id, sub_id, events, expected).
+        """
+        customer_id, sub_id = self._id('cus'), self._id('sub')
+        created = self.clock = self.clock + 1
+        events = [self.checkout_session_completed(customer_id, sub_id, created)]
+        for i in range(invoices):
+            events.append(self.invoice_paid(customer_id, sub_id, created + 1 + i))
+        if cancel:
+            events.append(self.subscription_deleted(customer_id, sub_id, created + 1 + invoices))
+
+        expected = {'customer_id': customer_id, 'subscription_length': invoices, 'is_active': not cancel}
+        return customer_id, sub_id, events, expected
+
+
+def delivery_schedule(events, rng, duplicate_ratio=0.1, shuffle_window=10):
+    """
+    Reorder events the way Stripe may deliver them: duplicated retries and
+    deliveries shuffled within a sliding window of `shuffle_window`.
+    """
+    deliveries = list(events)
+    deliveries.extend(rng.sample(events, k=int(len(events) * duplicate_ratio)))
+    deliveries.sort(key=lambda event: event['created'] + rng.uniform(0, shuffle_window))
+    return deliveries
+
+
+def encode(event):
+    return json.dumps(event, separators=(',', ':'))
@@ -1,3 +1,314 @@
-from django.test import TestCase
+import asyncio
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import AsyncClient, TestCase
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.chat.groups import user_group_name
+from . import checkout
+from .fake_stripe import FakeStripeServer
+from .models import StripeEvent, Subscription
+from .outbox import HANDLERS, process_pending_events, record_event
+
+
+ASYNC_CHECKOUT_URL = '/api/subscription/create-checkout-session/async/'
+
+
+class FakeStripeTestCase(TestCase):
+    """Points the Stripe client at a fresh in-process fake API for each test."""
+    stripe_latency = 0.0
+
+    def setUp(self):
+        self.stripe_api = FakeStripeServer(latency=self.stripe_latency).start()
+        self.addCleanup(self.stripe_api.stop)
+        # The process-wide client is built from the settings, so it goes with them
+        self.addCleanup(self.reset_stripe_client)
+        override = self.settings(
+            STRIPE_API_BASE=self.stripe_api.url, STRIPE_SECRET_KEY='sk_test_fake', STRIPE_PRICE_ID='price_test',
+            STRIPE_MAX_NETWORK_RETRIES=0,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.reset_stripe_client()
+
+    def reset_stripe_client(self):
+        checkout._client = None
+
+    def stripe_requests(self, route):
+        return self.stripe_api.state.requests[route]
+
+
+class AsyncCheckoutSessionTests(FakeStripeTestCase):
+    # Long enough for concurrent clicks to overlap
+    stripe_latency = 0.05
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='x')
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    async def click(self, times=1):
+        client = AsyncClient()
+        return await asyncio.gather(*(client.post(ASYNC_CHECKOUT_URL, headers=self.headers) for _ in range(times)))
+
+    async def test_concurrent_clicks_share_one_session(self):
+        responses = await self.click(times=3)
+
+        self.assertEqual([200, 200, 200], [response.status_code for response in responses])
+        self.assertEqual(1, len({response.json()['url'] for response in responses}))
+        self.assertEqual(1, self.stripe_requests('POST /v1/customers'))
+        self.assertEqual(1, self.stripe_requests('POST /v1/checkout/sessions'))
+        self.assertEqual(1, await Subscription.objects.filter(user=self.user).acount())
+
+    async def test_returning_user_reuses_customer_and_row(self):
+        await self.click()
+        await self.click()
+
+        self.assertEqual(1, self.stripe_requests('POST /v1/customers'))
+        self.assertEqual(2, self.stripe_requests('POST /v1/checkout/sessions'))
+        sub = await Subscription.objects.aget(user=self.user)
+        self.assertIn(sub.stripe_customer_id, self.stripe_api.state.customers)
+
+    async def test_concurrent_clicks_of_many_users_get_one_row_each(self):
+        users = [await User.objects.acreate(username=f'user{i}') for i in range(5)]
+        client = AsyncClient()
+        responses = await asyncio.gather(*(
+            client.post(ASYNC_CHECKOUT_URL, headers={'Authorization': f'Bearer {AccessToken.for_user(user)}'})
+            for user in users for _ in range(2)
+        ))
+
+        self.assertTrue(all(response.status_code == 200 for response in responses))
+        self.assertEqual(5, self.stripe_requests('POST /v1/customers'))
+        self.assertEqual(5, self.stripe_requests('POST /v1/checkout/sessions'))
+        rows = [sub async for sub in Subscription.objects.filter(user__in=users)]
+        self.assertEqual(sorted(user.pk for user in users), sorted(sub.user_id for sub in rows))
+        self.assertEqual(5, len({sub.stripe_customer_id for sub in rows}))
+
+    async def test_clicks_served_by_other_processes_share_row_and_customer(self):
+        # Called past the in-flight map, as by separate worker processes
+        first, second = await asyncio.gather(
+            checkout._acreate_checkout_session(self.user), checkout._acreate_checkout_session(self.user)
+        )
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(2, self.stripe_requests('POST /v1/checkout/sessions'))
+        # Both asked for the customer of the same row, and got the same one back
+        self.assertEqual(2, self.stripe_requests('POST /v1/customers'))
+        self.assertEqual(1, len(self.stripe_api.state.customers))
+        sub = await Subscription.objects.aget(user=self.user)
+        self.assertIn(sub.stripe_customer_id, self.stripe_api.state.customers)
+
+    async def test_stripe_error_is_a_bad_request(self):
+        # A customer deleted on Stripe's side
+        await Subscription.objects.acreate(user=self.user, stripe_customer_id='cus_missing')
+
+        response, = await self.click()
+
+        self.assertEqual(400, response.status_code)
+        self.assertIn("No such customer: 'cus_missing'", response.json()['error'])
+        self.assertEqual(0, self.stripe_requests('POST /v1/customers'))
+
+    async def test_missing_or_invalid_token_is_unauthorized(self):
+        client = AsyncClient()
+        missing = await client.post(ASYNC_CHECKOUT_URL)
+        invalid = await client.post(ASYNC_CHECKOUT_URL, headers={'Authorization': 'Bearer junk'})
+
+        self.assertEqual((401, 401), (missing.status_code, invalid.status_code))
+        self.assertEqual('Authentication credentials were not provided.', missing.json()['detail'])
+        self.assertEqual(0, sum(self.stripe_api.state.requests.values()))
+
+
+class ReconcileSubscriptionsTests(FakeStripeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', password='x')
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_subscriptions', '--no-notify', *args, stdout=out)
+        return out.getvalue()
+
+    def add_subscription(self, customer, status='active', created=1_700_000_000):
+        return self.stripe_api.state.add_subscription(customer, status=status, created=created)['id']
+
+    def test_repairs_missed_status_changes(self):
+        cancelled = self.add_subscription('cus_a', status='canceled')
+        resumed = self.add_subscription('cus_b', status='past_due')
+        unchanged = self.add_subscription('cus_c')
+        stale_active = Subscription.objects.create(stripe_customer_id='cus_a', stripe_subscription_id=cancelled, is_active=True)
+        stale_inactive = Subscription.objects.create(stripe_customer_id='cus_b', stripe_subscription_id=resumed)
+        current = Subscription.objects.create(stripe_customer_id='cus_c', stripe_subscription_id=unchanged, is_active=True)
+
+        output = self.reconcile()
+
+        stale_active.refresh_from_db()
+        stale_inactive.refresh_from_db()
+        self.assertFalse(stale_active.is_active)
+        self.assertTrue(stale_inactive.is_active)
+        self.assertEqual(current.updated_at, Subscription.objects.get(pk=current.pk).updated_at)
+        self.assertIn('seen=3, matched=3, linked=0, activated=1, deactivated=1, unknown=0', output)
+
+    def test_links_row_of_missed_checkout(self):
+        sub_id = self.add_subscription('cus_a')
+        newer = Subscription.objects.create(user=self.user, stripe_customer_id='cus_a')
+        oldest = Subscription.objects.create(user=self.user, stripe_customer_id='cus_a')
+        Subscription.objects.filter(pk=oldest.pk).update(created_at=newer.created_at.replace(year=2020))
+
+        self.reconcile()
+
+        oldest.refresh_from_db()
+        self.assertEqual((sub_id, True), (oldest.stripe_subscription_id, oldest.is_active))
+        self.assertIsNone(Subscription.objects.get(pk=newer.pk).stripe_subscription_id)
+
+    def test_row_of_cancelled_subscription_takes_newer_active_one(self):
+        old = self.add_subscription('cus_a', status='canceled', created=1_600_000_000)
+        new = self.add_subscription('cus_a', status='active', created=1_700_000_000)
+        row = Subscription.objects.create(user=self.user, stripe_customer_id='cus_a', stripe_subscription_id=old)
+
+        # One subscription per chunk, so the old one is not seen alongside the new
+        output = self.reconcile('--chunk-size', '1', '--page-size', '1')
+
+        row.refresh_from_db()
+        self.assertEqual((new, True), (row.stripe_subscription_id, row.is_active))
+        self.assertIn('linked=1, activated=1, deactivated=0', output)
+
+    def test_row_still_active_on_cancelled_subscription_takes_newer_one(self):
+        old = self.add_subscription('cus_a', status='canceled', created=1_600_000_000)
+        new = self.add_subscription('cus_a', status='trialing', created=1_700_000_000)
+        row = Subscription.objects.create(
+            user=self.user, stripe_customer_id='cus_a', stripe_subscription_id=old, is_active=True
+        )
+
+        self.reconcile()
+
+        row.refresh_from_db()
+        self.assertEqual((new, True), (row.stripe_subscription_id, row.is_active))
+        self.assertEqual(1, Subscription.objects.count())
+
+    def test_ended_subscription_does_not_replace_entitled_one(self):
+        current = self.add_subscription('cus_a', status='active', created=1_600_000_000)
+        self.add_subscription('cus_a', status='canceled', created=1_700_000_000)
+        row = Subscription.objects.create(
+            user=self.user, stripe_customer_id='cus_a', stripe_subscription_id=current, is_active=True
+        )
+
+        self.assertIn('unknown=1', self.reconcile())
+
+        row.refresh_from_db()
+        self.assertEqual((current, True), (row.stripe_subscription_id, row.is_active))
+
+    def test_dry_run_changes_nothing(self):
+        self.add_subscription('cus_a')
+        row = Subscription.objects.create(stripe_customer_id='cus_a')
+
+        self.assertIn('Would apply: seen=1, matched=1, linked=1, activated=1', self.reconcile('--dry-run'))
+
+        row.refresh_from_db()
+        self.assertEqual((None, False), (row.stripe_subscription_id, row.is_active))
+
+    def test_entitlement_changes_reach_the_users_sockets(self):
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(user_group_name(self.user.id), channel)
+        self.addCleanup(async_to_sync(channel_layer.group_discard), user_group_name(self.user.id), channel)
+        sub_id = self.add_subscription('cus_a')
+        Subscription.objects.create(user=self.user, stripe_customer_id='cus_a', stripe_subscription_id=sub_id)
+
+        call_command('reconcile_subscriptions', stdout=StringIO())
+
+        self.assertEqual(
+            {'type': 'subscription_status', 'is_active': True},
+            async_to_sync(channel_layer.receive)(channel)
+        )
+
+
+def stripe_event(event_id, event_type, obj, created):
+    return {'id': event_id, 'type': event_type, 'created': created, 'data': {'object': obj}}
+
+
+def invoice_paid(event_id, sub_id, created):
+    return stripe_event(event_id, 'invoice.paid', {'subscription': sub_id}, created)
+
+
+class StripeOutboxTests(TestCase):
+    def test_duplicate_delivery_is_recorded_and_applied_once(self):
+        record_event(invoice_paid('evt_1', 'sub_a', 100))
+        self.assertEqual(1, process_pending_events())
+        record_event(invoice_paid('evt_1', 'sub_a', 100))
+
+        self.assertEqual(0, process_pending_events())
+        self.assertEqual(1, StripeEvent.objects.count())
+        self.assertEqual(1, Subscription.objects.get(stripe_subscription_id='sub_a').subscription_length)
+
+    def test_events_of_a_subscription_apply_in_stripe_order(self):
+        # The cancellation is delivered before the checkout that preceded it
+        record_event(stripe_event('evt_2', 'customer.subscription.deleted', {'id': 'sub_a'}, 200))
+        record_event(stripe_event(
+            'evt_1', 'checkout.session.completed', {'customer': 'cus_a', 'subscription': 'sub_a'}, 100
+        ))
+
+        self.assertEqual(2, process_pending_events())
+
+        applied = StripeEvent.objects.order_by('processed_at', 'id').values_list('event_id', flat=True)
+        self.assertEqual(['evt_1', 'evt_2'], list(applied))
+        sub = Subscription.objects.get()
+        self.assertEqual(('cus_a', 'sub_a', False), (sub.stripe_customer_id, sub.stripe_subscription_id, sub.is_active))
+
+    def test_late_checkout_does_not_undo_an_applied_cancellation(self):
+        record_event(stripe_event('evt_2', 'customer.subscription.deleted', {'id': 'sub_a'}, 200))
+        process_pending_events()
+        record_event(stripe_event(
+            'evt_1', 'checkout.session.completed', {'customer': 'cus_a', 'subscription': 'sub_a'}, 100
+        ))
+        process_pending_events()
+
+        self.assertFalse(Subscription.objects.filter(is_active=True).exists())
+
+    def test_failing_event_backs_off_without_stalling_other_keys(self):
+        apply_invoice_paid = HANDLERS['invoice.paid']
+
+        def failing_for_sub_bad(event, obj):
+            if obj['subscription'] == 'sub_bad':
+                raise RuntimeError("database hiccup")
+            apply_invoice_paid(event, obj)
+
+        record_event(invoice_paid('evt_1', 'sub_bad', 100))
+        record_event(invoice_paid('evt_2', 'sub_bad', 200))
+        record_event(invoice_paid('evt_3', 'sub_good', 300))
+
+        with mock.patch.dict(HANDLERS, {'invoice.paid': failing_for_sub_bad}), self.assertLogs('apps.subscription.outbox'):
+            # The failing key comes first and fills the batch
+            self.assertEqual(0, process_pending_events(batch_size=1))
+            # Backing off, it no longer holds the other key up
+            self.assertEqual(1, process_pending_events(batch_size=1))
+
+        failed = StripeEvent.objects.get(event_id='evt_1')
+        self.assertEqual(('pending', 1, 'RuntimeError: database hiccup'), (failed.status, failed.attempts, failed.last_error))
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+        # The later event of the failing key waits behind it
+        self.assertEqual('pending', StripeEvent.objects.get(event_id='evt_2').status)
+        self.assertFalse(Subscription.objects.filter(stripe_subscription_id='sub_bad').exists())
+
+        StripeEvent.objects.filter(pk=failed.pk).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(2, process_pending_events())
+        self.assertEqual(2, Subscription.objects.get(stripe_subscription_id='sub_bad').subscription_length)
+
+    def test_event_fails_for_good_after_max_attempts(self):
+        record_event(stripe_event('evt_1', 'checkout.session.completed', {}, 100))
+        override = self.settings(STRIPE_EVENT_MAX_ATTEMPTS=2)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        with self.assertLogs('apps.subscription.outbox'):
+            for _ in range(2):
+                StripeEvent.objects.update(next_attempt_at=timezone.now())
+                process_pending_events()
+
+        self.assertEqual(('failed', 2), StripeEvent.objects.values_list('status', 'attempts').get())
@@ -1,9 +1,10 @@
 from django.urls import path
-from .views import CreateCheckoutSession, stripe_webhook, success_view, cancel_view
+from .views import CreateCheckoutSession, create_checkout_session_async, stripe_webhook, success_view, cancel_view
 
 
 urlpatterns = [
     path('create-checkout-session/', CreateCheckoutSession.as_view()),
+    path('create-checkout-session/async/', create_checkout_session_async),
     path('stripe-webhook/', stripe_webhook),
     path('success/', success_view),
     path('cancel/', cancel_view),
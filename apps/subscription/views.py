@@ -1,48 +1,64 @@
-import stripe
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse
+from django.views.decorators.http import require_POST
+from django.http import HttpResponse, JsonResponse
 from django.conf import settings
-from .models import Subscription
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from .checkout import acreate_checkout_session, create_checkout_session
+from .metrics import WEBHOOK_EVENTS, WEBHOOK_LATENCY
+from .outbox import HANDLED_EVENT_TYPES, record_event
 from .serializers import CreateCheckoutSessionSerializer
 
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
 class CreateCheckoutSession(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        username = request.user.username
         try:
-            customer = stripe.Customer.create(
-                name=username
-            )
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                mode='subscription',
-                line_items=[{
-                    'price': f'{settings.STRIPE_PRICE_ID}',  # Create recurring price in Stripe dashboard for R99/month
-                    'quantity': 1,
-                }],
-                success_url='https://079d54ab7d23.ngrok-free.app/api/subscription/success/',
-                cancel_url='https://079d54ab7d23.ngrok-free.app/api/subscription/cancel/',
-                customer=customer.id,
-            )
-
-            # Create or update subscription
-            sub = Subscription.objects.create(user=request.user)
-            sub.stripe_customer_id = customer.id
-            sub.save()
-            return Response({'url': session.url})
+            return Response({'url': create_checkout_session(request.user)})
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+@csrf_exempt
+@require_POST
+async def create_checkout_session_async(request):
+    """
+    Non-blocking CreateCheckoutSession for ASGI deployments. Authenticates
+    with the same JWT header; double-clicks share one Stripe session.
+    """
+    try:
+        user_auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        # InvalidToken nests its message in a dict detail
+        detail = e.detail.get('detail', e.detail) if isinstance(e.detail, dict) else e.detail
+        return JsonResponse({'detail': str(detail)}, status=401)
+    if user_auth is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    try:
+        return JsonResponse({'url': await acreate_checkout_session(user_auth[0])})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
 @csrf_exempt
 def stripe_webhook(request):
+    started = time.perf_counter()
+    event_type, result, response = process_stripe_webhook(request)
+    WEBHOOK_LATENCY.observe(time.perf_counter() - started, event_type)
+    WEBHOOK_EVENTS.inc(event_type, result)
+    return response
+
+def process_stripe_webhook(request):
+    import stripe
+
     payload = request.body
     sig_header = request.META['HTTP_STRIPE_SIGNATURE']
     event = None
@@ -52,39 +68,17 @@ def stripe_webhook(request):
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
     except ValueError as e:
-        return HttpResponse(status=400)
+        return 'invalid', 'bad_payload', HttpResponse(status=400)
     except stripe.error.SignatureVerificationError as e:
-        return HttpResponse(status=400)
-
-    if event.type == 'checkout.session.completed':
-        session = event.data.object
-        customer_id = session.customer
-        sub_id = session.subscription
-        # sub_id = session.get('subscription')
-        sub, created = Subscription.objects.get_or_create(stripe_customer_id=customer_id)
-        sub.stripe_subscription_id = sub_id
-        sub.is_active = True
-        sub.save()
-        # Send welcome email here (use django mail)
-
-    elif event.type == 'invoice.paid':
-        # Monthly payment success
-        # sub_id = event.data.object.subscription
-        sub_id = event.data.object.parent.subscription_details.subscription
-        sub, created = Subscription.objects.get_or_create(stripe_subscription_id=sub_id)
-        sub.subscription_length += 1
-        sub.save()
-
-    elif event.type == 'customer.subscription.deleted':
-        sub_id = event.data.object.id
-        sub, created = Subscription.objects.get_or_create(stripe_subscription_id=sub_id)
-        sub.is_active = False
-        sub.save()
+        return 'invalid', 'bad_signature', HttpResponse(status=400)
 
-    else:
+    if event.type not in HANDLED_EVENT_TYPES:
         print(f"Unhandled event type: {event.type}")
+        return event.type, 'unhandled', HttpResponse(status=200)
 
-    return HttpResponse(status=200)
+    # Persist and acknowledge right away; `manage.py process_stripe_events` applies it
+    record_event(json.loads(payload))
+    return event.type, 'queued', HttpResponse(status=200)
 
 def success_view(request):
     return HttpResponse("Subscription successful! Thank you for subscribing.")
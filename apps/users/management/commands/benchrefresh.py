@@ -0,0 +1,142 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from apps.users.serializers import CachedTokenRefreshSerializer
+from apps.users.tokens import CachedBlacklistRefreshToken, purge_expired_batch
+from utils.benchmark import build_report, isolated_database, latency_summary, write_report
+
+
+SEED_BATCH = 50_000
+
+
+def seed_tokens(user, rows, expired_ratio, blacklisted_ratio):
+    """Insert outstanding (and some blacklisted) tokens oldest first, as years of logins would leave them."""
+    now = timezone.now()
+    expired = int(rows * expired_ratio)
+    outstanding = OutstandingToken._meta.db_table
+    blacklisted = BlacklistedToken._meta.db_table
+    every = round(1 / blacklisted_ratio) if blacklisted_ratio else 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, rows, SEED_BATCH):
+            batch = []
+            for i in range(start, min(start + SEED_BATCH, rows)):
+                # Expired rows first, then rows still valid for up to a week
+                expires_at = now - timedelta(days=1, seconds=expired - i) if i < expired else now + timedelta(seconds=i - expired + 60)
+                batch.append((user.id, uuid.uuid4().hex, 'x', expires_at - timedelta(days=7), expires_at))
+            cursor.executemany(
+                f'INSERT INTO {outstanding} (user_id, jti, token, created_at, expires_at) VALUES (%s, %s, %s, %s, %s)', batch
+            )
+            if every:
+                cursor.execute(
+                    f'INSERT INTO {blacklisted} (token_id, blacklisted_at) '
+                    f'SELECT id, %s FROM {outstanding} WHERE id > %s AND id %% %s = 0',
+                    [now, start, every]
+                )
+
+
+def time_refreshes(serializer_class, token, count):
+    latencies, queries = [], 0
+    for _ in range(count):
+        # A full query log (9000 entries) would make every capture empty
+        connection.queries_log.clear()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as captured:
+            serializer = serializer_class(data={'refresh': token})
+            serializer.is_valid(raise_exception=True)
+        latencies.append(time.perf_counter() - started)
+        queries += len(captured)
+        token = serializer.validated_data['refresh']
+    return {'latency': latency_summary(latencies), 'queries_per_refresh': round(queries / count, 2)}
+
+
+def time_replays(token_class, token, count):
+    """Reuse of an already rotated (blacklisted) refresh token, as a stolen or retried token would be."""
+    latencies, queries = [], 0
+    for _ in range(count):
+        # A full query log (9000 entries) would make every capture empty
+        connection.queries_log.clear()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as captured:
+            try:
+                token_class(token)
+            except Exception:
+                pass
+        latencies.append(time.perf_counter() - started)
+        queries += len(captured)
+    return {'latency': latency_summary(latencies), 'queries_per_check': round(queries / count, 2)}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure token refresh latency with a large outstanding token table, simplejwt's stock "
+        "blacklist check against the cached one, before and after purge_expired_tokens."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000_000)
+        parser.add_argument('--expired-ratio', type=float, default=0.8)
+        parser.add_argument('--blacklisted-ratio', type=float, default=0.5)
+        parser.add_argument('--refreshes', type=int, default=300)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('-o', '--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['refreshes'] < 1:
+            raise CommandError("--rows and --refreshes must be positive.")
+
+        with isolated_database(on_disk=True):
+            user = User.objects.create_user('bench-refresh', password='x')
+            started = time.perf_counter()
+            seed_tokens(user, options['rows'], options['expired_ratio'], options['blacklisted_ratio'])
+            seed_seconds = time.perf_counter() - started
+            caches['default'].clear()
+
+            def measure():
+                replay = str(RefreshToken.for_user(user))
+                CachedTokenRefreshSerializer(data={'refresh': replay}).is_valid(raise_exception=True)
+                return {
+                    'stock_refresh': time_refreshes(TokenRefreshSerializer, str(RefreshToken.for_user(user)), options['refreshes']),
+                    'cached_refresh': time_refreshes(CachedTokenRefreshSerializer, str(RefreshToken.for_user(user)), options['refreshes']),
+                    'stock_replay': time_replays(RefreshToken, replay, options['refreshes']),
+                    'cached_replay': time_replays(CachedBlacklistRefreshToken, replay, options['refreshes']),
+                }
+
+            before = measure()
+
+            batch_seconds, purged, last_id = [], 0, 0
+            started = time.perf_counter()
+            while True:
+                batch_started = time.perf_counter()
+                last_id, deleted = purge_expired_batch(last_id, timezone.now(), options['batch_size'])
+                if last_id is None:
+                    break
+                batch_seconds.append(time.perf_counter() - batch_started)
+                purged += deleted
+            purge_seconds = time.perf_counter() - started
+
+            results = {
+                'seed_seconds': round(seed_seconds, 1),
+                'before_purge': before,
+                'purge': {
+                    'rows_deleted': purged,
+                    'seconds': round(purge_seconds, 1),
+                    'rows_per_second': round(purged / purge_seconds) if purge_seconds else None,
+                    'batch': latency_summary(batch_seconds),
+                    'outstanding_left': OutstandingToken.objects.count(),
+                },
+                'after_purge': measure(),
+            }
+
+        params = {key: options[key] for key in ('rows', 'expired_ratio', 'blacklisted_ratio', 'refreshes', 'batch_size')}
+        write_report(build_report('token_refresh', params, results), options['output'], self.stdout)
@@ -0,0 +1,168 @@
+import pickle
+import random
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+from rest_framework.throttling import AnonRateThrottle
+
+from apps.users.throttles import AnonSlidingWindowRateThrottle
+from utils.benchmark import build_report, latency_summary, write_report
+
+
+BENCH_CACHE = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'bench-throttle',
+    'OPTIONS': {'MAX_ENTRIES': 10_000_000},
+}
+# Simulated clocks start here, a boundary of every rate window (second to day)
+EPOCH = 1_000_000_000 - 1_000_000_000 % 86400
+
+
+def make_throttles(rate):
+    """DRF's timestamp-list throttle and the sliding window counter one, at the same rate."""
+    log = type('LogThrottle', (AnonRateThrottle,), {'rate': rate, 'scope': 'bench_log', 'cache': caches['throttle_bench']})
+    counter = type('CounterThrottle', (AnonSlidingWindowRateThrottle,), {'rate': rate, 'scope': 'bench_counter'})
+    return log, counter
+
+
+def client_request(factory, address):
+    request = factory.post('/', REMOTE_ADDR=address)
+    request.user = AnonymousUser()
+    return request
+
+
+def arrivals(pattern, num_requests, duration, windows, rng):
+    """Request times of one client over `windows` rate windows."""
+    end = windows * duration
+    if pattern == 'steady':
+        # Twice the allowed rate, evenly spaced
+        step = duration / (2 * num_requests)
+        return [i * step for i in range(int(end / step))]
+    if pattern == 'poisson':
+        times, now = [], 0.0
+        while now < end:
+            now += rng.expovariate(1.5 * num_requests / duration)
+            times.append(now)
+        return times
+    if pattern == 'boundary':
+        # The fixed window worst case: a full rate just before and just after each boundary
+        times = []
+        for window in range(1, windows):
+            boundary = window * duration
+            times += [boundary - 0.5 + i * 0.5 / num_requests for i in range(num_requests)]
+            times += [boundary + i * 0.5 / num_requests for i in range(num_requests)]
+        return times
+    raise CommandError(f"Unknown pattern {pattern!r}.")
+
+
+def replay(throttle_class, times, request):
+    """Admission decisions for requests at `times` (seconds) from one client."""
+    clock = [0.0]
+    decisions = []
+    for at in times:
+        clock[0] = EPOCH + at
+        throttle = throttle_class()
+        throttle.timer = lambda: clock[0]
+        decisions.append(throttle.allow_request(request, None))
+    return decisions
+
+
+def max_in_window(times, decisions, duration):
+    """Most admitted requests inside any `duration` seconds."""
+    admitted = [at for at, allowed in zip(times, decisions) if allowed]
+    best, start = 0, 0
+    for end, at in enumerate(admitted):
+        while admitted[start] <= at - duration:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+def stored_bytes(cache):
+    """Pickled size of everything in a local memory cache."""
+    return sum(len(value) for value in cache._cache.values())
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare DRF's timestamp-list throttle with the sliding window counter throttle: "
+        "accuracy against the true sliding window, cache memory per client and check latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rate', default='180/minute')
+        parser.add_argument('--windows', type=int, default=20, help="Rate windows simulated per traffic pattern.")
+        parser.add_argument('--clients', type=int, default=1000, help="Clients at the full rate for the memory comparison.")
+        parser.add_argument('--checks', type=int, default=20_000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('-o', '--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['windows'] < 2 or options['clients'] < 1 or options['checks'] < 1:
+            raise CommandError("--windows must be at least 2, --clients and --checks positive.")
+
+        caches_setting = {'default': BENCH_CACHE, 'throttle_bench': {**BENCH_CACHE, 'LOCATION': 'bench-throttle-log'}}
+        with override_settings(CACHES=caches_setting, THROTTLE_CACHE='default'):
+            results = self.run(options)
+
+        params = {key: options[key] for key in ('rate', 'windows', 'clients', 'checks', 'seed')}
+        write_report(build_report('throttle', params, results), options['output'], self.stdout)
+
+    def run(self, options):
+        log_class, counter_class = make_throttles(options['rate'])
+        num_requests, duration = log_class().parse_rate(options['rate'])
+        factory = APIRequestFactory()
+        rng = random.Random(options['seed'])
+        log_cache, counter_cache = caches['throttle_bench'], caches['default']
+
+        accuracy = {}
+        for pattern in ('steady', 'poisson', 'boundary'):
+            times = arrivals(pattern, num_requests, duration, options['windows'], rng)
+            request = client_request(factory, f'10.0.0.{len(accuracy) + 1}')
+            log = replay(log_class, times, request)
+            counter = replay(counter_class, times, request)
+            accuracy[pattern] = {
+                'requests': len(times),
+                'admitted_exact': sum(log),
+                'admitted_counter': sum(counter),
+                'max_in_any_window_exact': max_in_window(times, log, duration),
+                'max_in_any_window_counter': max_in_window(times, counter, duration),
+                'admitted_difference_pct': round(100 * (sum(counter) - sum(log)) / sum(log), 2),
+            }
+
+        # Every client at its full rate: the timestamp list's worst case
+        log_cache.clear()
+        counter_cache.clear()
+        for client in range(options['clients']):
+            request = client_request(factory, f'10.{client >> 16 & 255}.{client >> 8 & 255}.{client & 255}')
+            replay(log_class, [i * duration / num_requests / 2 for i in range(num_requests)], request)
+            replay(counter_class, [duration / 2 + i * duration / num_requests for i in range(num_requests)], request)
+        memory = {
+            'log_bytes_per_client': round(stored_bytes(log_cache) / options['clients']),
+            'counter_bytes_per_client': round(stored_bytes(counter_cache) / options['clients']),
+            'log_value_bytes': len(pickle.dumps([1e9] * num_requests, pickle.HIGHEST_PROTOCOL)),
+            'counter_value_bytes': 2 * len(pickle.dumps(num_requests, pickle.HIGHEST_PROTOCOL)),
+        }
+
+        # One client sending at exactly its rate, so every check is admitted with a full history
+        latency = {}
+        request = client_request(factory, '192.0.2.1')
+        for name, throttle_class, cache in (('log', log_class, log_cache), ('counter', counter_class, counter_cache)):
+            cache.clear()
+            clock = [float(EPOCH)]
+            seconds = []
+            for check in range(num_requests + options['checks']):
+                clock[0] += duration / num_requests
+                throttle = throttle_class()
+                throttle.timer = lambda: clock[0]
+                started = time.perf_counter()
+                throttle.allow_request(request, None)
+                if check >= num_requests:
+                    seconds.append(time.perf_counter() - started)
+            latency[name] = latency_summary(seconds)
+
+        return {'rate': options['rate'], 'accuracy': accuracy, 'memory': memory, 'latency': latency}
@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.users.tokens import purge_expired_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired outstanding refresh tokens and their blacklist entries in short batches. "
+        "Safe to run often (e.g. hourly from cron); unlike flushexpiredtokens it never deletes in one statement."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Tokens per transaction (defaults to JWT_PURGE_BATCH_SIZE)")
+        parser.add_argument('--grace', type=int, default=0, help="Keep tokens expired less than this many seconds ago")
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches, to let other writers in")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or settings.JWT_PURGE_BATCH_SIZE
+        if batch_size < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        expired_before = timezone.now() - timedelta(seconds=options['grace'])
+        last_id, purged, started = 0, 0, time.perf_counter()
+        while True:
+            last_id, deleted = purge_expired_batch(last_id, expired_before, batch_size)
+            if last_id is None:
+                break
+            purged += deleted
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {purged} expired token(s) in {time.perf_counter() - started:.1f}s"
+        ))
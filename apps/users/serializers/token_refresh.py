@@ -1,4 +1,12 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+
+from ..tokens import CachedBlacklistRefreshToken
+
+
+class CachedTokenRefreshSerializer(TokenRefreshSerializer):
+    # Blacklist checks go through the cache (apps.users.tokens)
+    token_class = CachedBlacklistRefreshToken
 
 
 class TokenRefreshResponseSerializer(serializers.Serializer):
@@ -1,3 +1,184 @@
-from django.test import TestCase
+import uuid
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from .throttles import HighLimitAnonRateThrottle, RegisterThrottle
+from .tokens import CachedBlacklistRefreshToken
+
+
+# Start of a RegisterThrottle window (5 requests per 60 seconds)
+WINDOW = 60 * 1000
+
+
+class SlidingWindowRateThrottleTests(TestCase):
+    def setUp(self):
+        caches[settings.THROTTLE_CACHE].clear()
+        self.addCleanup(caches[settings.THROTTLE_CACHE].clear)
+
+    def hit(self, at, throttle_class=RegisterThrottle, ip='10.0.0.1'):
+        """A request from `ip` at the fake time `at`; returns the throttle after its decision."""
+        request = RequestFactory().post('/', REMOTE_ADDR=ip)
+        request.user = AnonymousUser()
+        throttle = throttle_class()
+        throttle.timer = lambda: at
+        throttle.allowed = throttle.allow_request(request, None)
+        return throttle
+
+    def hits(self, at, times, **kwargs):
+        return [self.hit(at, **kwargs).allowed for _ in range(times)]
+
+    def test_admits_the_rate_within_a_window(self):
+        self.assertEqual([True] * 5 + [False], self.hits(WINDOW + 10, 6))
+
+    def test_rejected_requests_do_not_count(self):
+        self.hits(WINDOW, 5)
+        self.assertEqual([False] * 3, self.hits(WINDOW + 30, 3))
+
+        throttle = self.hit(WINDOW + 30)
+        self.assertEqual(5, throttle.cache.get(throttle.window_key(WINDOW // 60)))
+
+        # Had the rejections counted, the previous window would hold 9 here
+        self.assertTrue(self.hit(WINDOW + 72).allowed)
+
+    def test_previous_window_weighs_in_across_the_boundary(self):
+        self.hits(WINDOW + 59, 5)
+
+        # All of the previous window still counts at the boundary
+        self.assertFalse(self.hit(WINDOW + 60).allowed)
+        # Half of it, 30 seconds in
+        self.assertEqual([True, True, False], self.hits(WINDOW + 90, 3))
+        # Nothing once a whole window has passed without requests
+        self.assertEqual([True] * 5, self.hits(WINDOW + 180, 5))
+
+    def test_wait_while_the_current_window_is_full(self):
+        self.hits(WINDOW, 5)
+
+        throttle = self.hit(WINDOW + 30)
+
+        self.assertFalse(throttle.allowed)
+        # 30 seconds to the next window, then 12 for this one's 5 to weigh 4
+        self.assertAlmostEqual(42, throttle.wait())
+        self.assertFalse(self.hit(WINDOW + 71).allowed)
+        self.assertTrue(self.hit(WINDOW + 72).allowed)
+
+    def test_wait_while_the_previous_window_fades(self):
+        self.hits(WINDOW + 59, 5)
+
+        throttle = self.hit(WINDOW + 60)
+
+        self.assertFalse(throttle.allowed)
+        self.assertAlmostEqual(12, throttle.wait())
+        self.assertFalse(self.hit(WINDOW + 71).allowed)
+        self.assertTrue(self.hit(WINDOW + 72).allowed)
+
+    def test_no_wait_without_a_previous_window(self):
+        self.assertIsNone(self.hit(WINDOW).wait())
+
+    def test_scopes_and_clients_have_separate_budgets(self):
+        self.hits(WINDOW, 5)
+        self.assertFalse(self.hit(WINDOW).allowed)
+
+        self.assertTrue(self.hit(WINDOW, throttle_class=HighLimitAnonRateThrottle).allowed)
+        self.assertTrue(self.hit(WINDOW, ip='10.0.0.2').allowed)
+
+        # The auth scope has 179 of its 180 left, whatever the register scope used
+        self.assertEqual([True] * 179 + [False], self.hits(WINDOW + 1, 180, throttle_class=HighLimitAnonRateThrottle))
+        self.assertFalse(self.hit(WINDOW + 1).allowed)
+
+
+class CachedBlacklistRefreshTokenTests(TestCase):
+    def setUp(self):
+        for alias in (settings.JWT_BLACKLIST_CACHE, settings.THROTTLE_CACHE):
+            caches[alias].clear()
+            self.addCleanup(caches[alias].clear)
+        self.user = User.objects.create_user('alice', password='x')
+        self.refresh = str(CachedBlacklistRefreshToken.for_user(self.user))
+
+    def post(self, url, refresh):
+        return self.client.post(url, {'refresh': refresh}, content_type='application/json')
+
+    def test_rotated_token_cannot_be_replayed(self):
+        response = self.post('/api/users/token/refresh/', self.refresh)
+        self.assertEqual(200, response.status_code)
+
+        replay = self.post('/api/users/token/refresh/', self.refresh)
+
+        self.assertEqual((401, {'detail': 'Invalid or expired refresh token.'}), (replay.status_code, replay.json()))
+        self.assertEqual(200, self.post('/api/users/token/refresh/', response.json()['refresh']).status_code)
+
+    def test_blacklist_answer_is_cached(self):
+        with self.assertNumQueries(1):
+            CachedBlacklistRefreshToken(self.refresh)
+        with self.assertNumQueries(0):
+            CachedBlacklistRefreshToken(self.refresh)
+
+    def test_logout_overrides_a_cached_answer(self):
+        CachedBlacklistRefreshToken(self.refresh)
+
+        self.assertEqual(204, self.post('/api/users/logout/', self.refresh).status_code)
+
+        with self.assertNumQueries(0), self.assertRaisesMessage(TokenError, 'Token is blacklisted'):
+            CachedBlacklistRefreshToken(self.refresh)
+
+
+class PurgeExpiredTokensTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+
+    def outstanding(self, expires_in_days, lifetime_days=7, blacklisted=False):
+        jti = uuid.uuid4().hex
+        expires_at = timezone.now() + timedelta(days=expires_in_days)
+        token = OutstandingToken.objects.create(
+            user=self.user, jti=jti, token=jti,
+            created_at=expires_at - timedelta(days=lifetime_days), expires_at=expires_at,
+        )
+        if blacklisted:
+            BlacklistedToken.objects.create(token=token)
+        return token.pk
+
+    def purge(self, *args):
+        out = StringIO()
+        call_command('purge_expired_tokens', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_removes_expired_tokens_with_their_blacklist_entries(self):
+        for _ in range(3):
+            self.outstanding(-1, blacklisted=True)
+        self.outstanding(-1)
+        current = [self.outstanding(7), self.outstanding(7, blacklisted=True)]
+
+        self.assertIn('Purged 4 expired token(s)', self.purge())
+
+        self.assertEqual(current, list(OutstandingToken.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(1, BlacklistedToken.objects.count())
+
+    def test_tokens_of_other_lifetimes_do_not_stop_the_purge(self):
+        self.outstanding(-1)
+        # A long-lived token, then a batch with nothing expired in it
+        kept = [self.outstanding(30, lifetime_days=60), self.outstanding(7), self.outstanding(7)]
+        self.outstanding(-1)
+        self.outstanding(-1, blacklisted=True)
+
+        self.assertIn('Purged 3 expired token(s)', self.purge())
+
+        self.assertEqual(kept, list(OutstandingToken.objects.order_by('id').values_list('id', flat=True)))
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+    def test_stops_at_a_batch_starting_after_the_cutoff(self):
+        self.outstanding(-5)
+        self.outstanding(-5)
+        # Issued within the grace period; nothing after it is read
+        kept = [self.outstanding(7, lifetime_days=7), self.outstanding(-5), self.outstanding(-5)]
+
+        self.assertIn('Purged 2 expired token(s)', self.purge('--grace', str(2 * 24 * 3600)))
+
+        self.assertEqual(kept, list(OutstandingToken.objects.order_by('id').values_list('id', flat=True)))
@@ -1,10 +1,95 @@
-from rest_framework.throttling import AnonRateThrottle
+"""
+Throttles for the auth views.
 
+DRF's SimpleRateThrottle keeps a list of every request timestamp per client,
+so memory grows with the rate. SlidingWindowRateThrottle keeps two integers
+per client instead: the request counts of the current and the previous fixed
+window. It estimates the requests of the last `duration` seconds by weighting
+the previous count with the share of it still inside the sliding window.
 
-class RegisterThrottle(AnonRateThrottle):
+The counts live in the THROTTLE_CACHE cache and are bumped with `incr()`.
+`incr()` is atomic in Redis, Memcached and (per process) local memory.
+Database and file caches read and write instead, so concurrent requests may
+get lost there. Use a cache shared by all workers in production. Otherwise
+each worker enforces the limit separately.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import AnonRateThrottle, SimpleRateThrottle
+
+
+class SlidingWindowRateThrottle(SimpleRateThrottle):
+    """SimpleRateThrottle with O(1) memory per client, shared across processes by the cache."""
+
+    cache_format = 'throttle_%(scope)s_%(ident)s'
+
+    @property
+    def cache(self):
+        return caches[settings.THROTTLE_CACHE]
+
+    def window_key(self, window):
+        return f'{self.key}:{window}'
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window, elapsed = divmod(self.now, self.duration)
+        window = int(window)
+        key = self.window_key(window)
+        # A window's count is read as the previous one during the next window
+        try:
+            self.current = self.cache.incr(key)
+        except ValueError:
+            if self.cache.add(key, 1, 2 * self.duration):
+                self.current = 1
+            else:
+                # Created concurrently
+                self.current = self.cache.incr(key)
+        self.previous = self.cache.get(self.window_key(window - 1), 0)
+        self.elapsed = elapsed
+
+        if self.estimate(self.previous, self.current, elapsed) > self.num_requests:
+            # Rejected requests do not count, as with SimpleRateThrottle
+            self.current = self.cache.decr(key)
+            return self.throttle_failure()
+        return self.throttle_success()
+
+    def estimate(self, previous, current, elapsed):
+        return previous * (1 - elapsed / self.duration) + current
+
+    def throttle_success(self):
+        return True
+
+    def wait(self):
+        """Seconds until the estimate leaves room for one more request."""
+        rate, previous, current = self.num_requests, self.previous, self.current
+        if current + 1 <= rate:
+            if not previous:
+                return None
+            # The previous window's weight has to drop far enough
+            needed = 1 - (rate - current - 1) / previous
+            return max(0, needed * self.duration - self.elapsed)
+        # Only the next window can admit it, once this window has faded enough
+        needed = 1 - (rate - 1) / current
+        return self.duration - self.elapsed + max(0, needed) * self.duration
+
+
+class AnonSlidingWindowRateThrottle(SlidingWindowRateThrottle, AnonRateThrottle):
+    pass
+
+
+class RegisterThrottle(AnonSlidingWindowRateThrottle):
     # Custom limit for registration
+    scope = "register"
     rate = "5/minute"
 
-class HighLimitAnonRateThrottle(AnonRateThrottle):
+class HighLimitAnonRateThrottle(AnonSlidingWindowRateThrottle):
     # Custom throttle with high limit (for login, logout, token refresh)
+    scope = "auth"
     rate = "180/minute"
@@ -0,0 +1,83 @@
+"""
+Refresh tokens with a cached blacklist check.
+
+Every refresh and logout verifies the submitted token against the blacklist.
+Answers are cached under the token's jti: "blacklisted" until the token
+expires, since blacklisting is permanent, and "not blacklisted" for
+JWT_BLACKLIST_CACHE_TTL seconds. Blacklisting a token overwrites its entry,
+so with a cache shared by all workers a revoked token is refused at once;
+with a per-process cache another worker may accept it for up to the TTL.
+
+Outstanding and blacklisted rows of expired tokens are removed in short
+batches by `manage.py purge_expired_tokens`.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+def blacklist_cache_key(jti):
+    return f'jwt-blacklist:{jti}'
+
+
+class CachedBlacklistRefreshToken(RefreshToken):
+    @property
+    def cache(self):
+        return caches[settings.JWT_BLACKLIST_CACHE]
+
+    def seconds_left(self):
+        return max(1, int(self.payload['exp'] - self.current_time.timestamp()))
+
+    def check_blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        key = blacklist_cache_key(jti)
+        blacklisted = self.cache.get(key)
+        if blacklisted is None:
+            blacklisted = BlacklistedToken.objects.filter(token__jti=jti).exists()
+            self.cache.set(key, blacklisted, self.seconds_left() if blacklisted else settings.JWT_BLACKLIST_CACHE_TTL)
+        if blacklisted:
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        token_id = OutstandingToken.objects.filter(jti=jti).values_list('id', flat=True).first()
+        if token_id is None:
+            # Issued before the outstanding list existed; let simplejwt record it
+            result = super().blacklist()
+        else:
+            result = BlacklistedToken.objects.get_or_create(token_id=token_id)
+        self.cache.set(blacklist_cache_key(jti), True, self.seconds_left())
+        return result
+
+
+def purge_expired_batch(after_id, expired_before, batch_size):
+    """
+    Delete the expired tokens among the next `batch_size` outstanding tokens
+    by id after `after_id`, with their blacklist entries. Returns (last id
+    scanned, rows deleted), or (None, 0) at the end of the table or once a
+    batch starts with a token issued after `expired_before`.
+
+    Walking the primary key avoids scanning the unindexed `expires_at` column
+    of the whole table. Tokens of any lifetime may sit between expired ones,
+    so a batch with nothing expired does not end the walk; a token issued
+    after the cutoff does, since it and the tokens issued after it cannot
+    have expired yet.
+    """
+    rows = list(
+        OutstandingToken.objects.filter(id__gt=after_id)
+        .order_by('id')
+        .values_list('id', 'created_at', 'expires_at')[:batch_size]
+    )
+    if not rows or (rows[0][1] is not None and rows[0][1] > expired_before):
+        return None, 0
+    expired = [token_id for token_id, _, expires_at in rows if expires_at <= expired_before]
+    if expired:
+        with transaction.atomic():
+            # Cascades to BlacklistedToken with one more DELETE
+            OutstandingToken.objects.filter(id__in=expired).delete()
+    return rows[-1][0], len(expired)
@@ -2,6 +2,7 @@ from .base import *
 from ..serializers import (
     LogoutSerializer,
 )
+from ..tokens import CachedBlacklistRefreshToken
 
 
 class LogoutView(APIView):
@@ -58,7 +59,7 @@ class LogoutView(APIView):
         refresh_token = serializer.validated_data.get("refresh")
 
         try:
-            token = RefreshToken(refresh_token)
+            token = CachedBlacklistRefreshToken(refresh_token)
             token.blacklist()
 
             return Response(
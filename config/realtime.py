@@ -0,0 +1,30 @@
+"""
+Websocket-only ASGI application for realtime workers.
+
+    daphne config.realtime:application
+
+Starts with config.settings_realtime and loads only what the chat consumers
+need. Route /ws/ to these workers and everything else to config.asgi.
+"""
+import os
+
+import django
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_realtime')
+
+django.setup(set_prefix=False)
+
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
+from apps.chat.middleware import JWTAuthMiddlewareStack
+from apps.chat.routing import websocket_urlpatterns
+
+
+application = ProtocolTypeRouter({
+    "websocket": AllowedHostsOriginValidator(
+        JWTAuthMiddlewareStack(
+            URLRouter(websocket_urlpatterns)
+        )
+    ),
+})
@@ -14,6 +14,7 @@ from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
 import os
+import tempfile
 
 
 load_dotenv()
@@ -144,6 +145,10 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# User-uploaded files (chat images and videos)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -157,6 +162,22 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Cache for throttle counters and refresh token blacklist answers. Set
+# REDIS_URL (needs the redis package) in production so all workers share it;
+# the local memory fallback is per process, which multiplies rate limits by
+# the number of workers
+REDIS_URL = os.getenv("REDIS_URL")
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+    } if REDIS_URL else {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+}
+# Cache holding the auth views' sliding window counters (apps.users.throttles)
+THROTTLE_CACHE = os.getenv("THROTTLE_CACHE", "default")
+
 # NOTE: use redis for production instead of in-memory layer
 CHANNEL_LAYERS = {
     "default": {
@@ -185,8 +206,17 @@ SIMPLE_JWT = {
     
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
+
+    'TOKEN_REFRESH_SERIALIZER': 'apps.users.serializers.CachedTokenRefreshSerializer',
 }
 
+# Cache answering refresh token blacklist checks (apps.users.tokens); use a
+# cache shared by all workers in production so revocations apply everywhere at once
+JWT_BLACKLIST_CACHE = os.getenv("JWT_BLACKLIST_CACHE", "default")
+JWT_BLACKLIST_CACHE_TTL = int(os.getenv("JWT_BLACKLIST_CACHE_TTL", 60))
+# Expired outstanding tokens are deleted this many per transaction (manage.py purge_expired_tokens)
+JWT_PURGE_BATCH_SIZE = int(os.getenv("JWT_PURGE_BATCH_SIZE", 1000))
+
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
         'Bearer': {
@@ -203,3 +233,117 @@ SWAGGER_SETTINGS = {
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_PRICE_ID = os.getenv("STRIPE_PRICE_ID")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+# Point at a local fake (apps.subscription.fake_stripe) for offline tests and benchmarks
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "https://api.stripe.com")
+STRIPE_CONNECT_TIMEOUT = float(os.getenv("STRIPE_CONNECT_TIMEOUT", 3))
+STRIPE_READ_TIMEOUT = float(os.getenv("STRIPE_READ_TIMEOUT", 10))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", 2))
+# Threads (and keep-alive connections) serving Stripe calls from async views
+STRIPE_HTTP_POOL_SIZE = int(os.getenv("STRIPE_HTTP_POOL_SIZE", 16))
+
+# Chat consumer instrumentation
+CHAT_SLOW_QUERY_MS = float(os.getenv("CHAT_SLOW_QUERY_MS", 100))
+CHAT_SLOW_FRAME_MS = float(os.getenv("CHAT_SLOW_FRAME_MS", 500))
+CHAT_SLOW_QUERY_LOG = os.getenv("CHAT_SLOW_QUERY_LOG")
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+        'slow_queries': {
+            'class': 'logging.FileHandler',
+            'filename': CHAT_SLOW_QUERY_LOG,
+        } if CHAT_SLOW_QUERY_LOG else {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'apps.chat.frames': {
+            'handlers': ['console'],
+            'level': os.getenv("CHAT_FRAME_LOG_LEVEL", "WARNING"),
+            'propagate': False,
+        },
+        'apps.chat.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+# Bearer token required by the /metrics/ scrape endpoint. When unset the
+# endpoint is open only under DEBUG, and limited to staff sessions otherwise
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Longest run accepted by the staff-only sampling profiler at /admin/profile/
+PROFILER_MAX_SECONDS = int(os.getenv("PROFILER_MAX_SECONDS", 60))
+
+# Stripe webhook outbox worker (manage.py process_stripe_events)
+STRIPE_EVENT_MAX_ATTEMPTS = int(os.getenv("STRIPE_EVENT_MAX_ATTEMPTS", 8))
+STRIPE_EVENT_RETRY_BASE_SECONDS = int(os.getenv("STRIPE_EVENT_RETRY_BASE_SECONDS", 5))
+STRIPE_EVENT_RETRY_MAX_SECONDS = int(os.getenv("STRIPE_EVENT_RETRY_MAX_SECONDS", 3600))
+
+# Chunked chat media uploads (apps.chat.uploads)
+CHAT_UPLOAD_TEMP_DIR = os.getenv("CHAT_UPLOAD_TEMP_DIR", os.path.join(tempfile.gettempdir(), 'chat-uploads'))
+CHAT_UPLOAD_MAX_IMAGE_SIZE = int(os.getenv("CHAT_UPLOAD_MAX_IMAGE_SIZE", 20 * 1024 * 1024))
+CHAT_UPLOAD_MAX_VIDEO_SIZE = int(os.getenv("CHAT_UPLOAD_MAX_VIDEO_SIZE", 512 * 1024 * 1024))
+CHAT_UPLOAD_MAX_CHUNK_SIZE = int(os.getenv("CHAT_UPLOAD_MAX_CHUNK_SIZE", 8 * 1024 * 1024))
+# Chunk bodies are copied through a buffer of this size; at most
+# CHAT_UPLOAD_MAX_CONCURRENT_CHUNKS run at once, which caps upload memory per process
+CHAT_UPLOAD_BUFFER_SIZE = int(os.getenv("CHAT_UPLOAD_BUFFER_SIZE", 64 * 1024))
+CHAT_UPLOAD_MAX_CONCURRENT_CHUNKS = int(os.getenv("CHAT_UPLOAD_MAX_CONCURRENT_CHUNKS", 16))
+
+# Image derivative process pool (apps.chat.derivatives)
+CHAT_DERIVATIVE_WORKERS = int(os.getenv("CHAT_DERIVATIVE_WORKERS", os.cpu_count() or 1))
+CHAT_DERIVATIVE_QUEUE_SIZE = int(os.getenv("CHAT_DERIVATIVE_QUEUE_SIZE", 64))
+
+# Permission-checked chat media downloads (apps.chat.media)
+# Set to "x-sendfile" (Apache, lighttpd) or "x-accel-redirect" (nginx) to let the
+# web server send the bytes; the nginx location for CHAT_MEDIA_ACCEL_PREFIX must be internal
+CHAT_MEDIA_OFFLOAD = os.getenv("CHAT_MEDIA_OFFLOAD", "")
+CHAT_MEDIA_ACCEL_PREFIX = os.getenv("CHAT_MEDIA_ACCEL_PREFIX", "/protected-media/")
+CHAT_MEDIA_CHUNK_SIZE = int(os.getenv("CHAT_MEDIA_CHUNK_SIZE", 64 * 1024))
+
+# Resuming chat sockets from a sequence number (apps.chat.events)
+# Recent events per room kept in memory for replay; older ones are read from RoomEvent
+CHAT_EVENT_BUFFER_SIZE = int(os.getenv("CHAT_EVENT_BUFFER_SIZE", 256))
+CHAT_EVENT_BUFFER_ROOMS = int(os.getenv("CHAT_EVENT_BUFFER_ROOMS", 1024))
+# A client further behind than this is told to resync instead of replaying
+CHAT_RESUME_MAX_EVENTS = int(os.getenv("CHAT_RESUME_MAX_EVENTS", 1000))
+# RoomEvent rows older than this are removed by manage.py purge_deleted_messages
+CHAT_EVENT_RETENTION = int(os.getenv("CHAT_EVENT_RETENTION", 7 * 24 * 3600))
+# Read receipts of purged messages are deleted this many rows per transaction
+CHAT_PURGE_RECEIPT_CHUNK_SIZE = int(os.getenv("CHAT_PURGE_RECEIPT_CHUNK_SIZE", 1000))
+
+# Rooms one multiplexed socket (ws/chat/) may subscribe to
+CHAT_MAX_SUBSCRIPTIONS = int(os.getenv("CHAT_MAX_SUBSCRIPTIONS", 500))
+
+# Largest member list accepted by one bulk room create or membership change
+CHAT_BULK_MEMBERS_MAX = int(os.getenv("CHAT_BULK_MEMBERS_MAX", 10000))
+
+# Sender profiles embedded in message payloads (apps.chat.profiles), cached per process
+CHAT_PROFILE_CACHE_SIZE = int(os.getenv("CHAT_PROFILE_CACHE_SIZE", 10000))
+CHAT_PROFILE_CACHE_TTL = int(os.getenv("CHAT_PROFILE_CACHE_TTL", 300))
+# Messages per history page and rooms per inbox page, by default and at most
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", 50))
+CHAT_MAX_PAGE_SIZE = int(os.getenv("CHAT_MAX_PAGE_SIZE", 200))
+
+# Chat worker presence and draining (apps.chat.presence)
+# Each process refreshes its PresenceNode row this often; the online flags of a
+# process silent for CHAT_PRESENCE_TIMEOUT are cleared by the next one to sweep
+CHAT_PRESENCE_HEARTBEAT = int(os.getenv("CHAT_PRESENCE_HEARTBEAT", 30))
+CHAT_PRESENCE_TIMEOUT = int(os.getenv("CHAT_PRESENCE_TIMEOUT", 90))
+# On SIGTERM sockets are closed within CHAT_DRAIN_TIMEOUT seconds and told to
+# reconnect after a random delay of up to CHAT_DRAIN_RECONNECT_JITTER seconds
+CHAT_DRAIN_TIMEOUT = int(os.getenv("CHAT_DRAIN_TIMEOUT", 20))
+CHAT_DRAIN_RECONNECT_JITTER = float(os.getenv("CHAT_DRAIN_RECONNECT_JITTER", 10))
+
+# Idle chat sockets (apps.chat.timers): a socket that sends no frame for
+# CHAT_IDLE_TIMEOUT seconds is closed, so clients send {"type": "ping"} while
+# quiet, e.g. every CHAT_IDLE_TIMEOUT / 3 seconds. Deadlines are checked every
+# CHAT_IDLE_TICK seconds by one timer wheel per process
+CHAT_IDLE_TIMEOUT = int(os.getenv("CHAT_IDLE_TIMEOUT", 75))
+CHAT_IDLE_TICK = float(os.getenv("CHAT_IDLE_TICK", 1))
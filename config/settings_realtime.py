@@ -0,0 +1,23 @@
+"""
+Settings for websocket-only workers (config.realtime).
+
+Everything from config.settings, but only the apps the chat consumers need
+are installed. Admin, the REST API, Swagger and Stripe are never imported,
+and neither is Daphne's Twisted server, which the daphne process running
+these workers has loaded already.
+"""
+from .settings import *
+
+
+INSTALLED_APPS = [
+    'channels',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+
+    # Custom apps
+    'apps.chat',
+    'apps.subscription',
+]
+
+# No HTTP is served by these workers
+MIDDLEWARE = []
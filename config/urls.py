@@ -16,19 +16,19 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
-from rest_framework.authtoken.views import obtain_auth_token
+from utils.metrics import metrics_view
+from utils.profiler import profile_view
 
 urlpatterns = [
+    path('admin/profile/', profile_view, name='admin_profile'),
     path('admin/', admin.site.urls),
     path('api/users/', include('apps.users.urls')),
     path('api/subscription/', include('apps.subscription.urls')),
-    # path('api/chat/', include('apps.chat.urls')),
+    path('api/chat/', include('apps.chat.urls')),
+    path('metrics/', metrics_view, name='metrics'),
     # path('api-auth/', include('rest_framework.urls')),
     # path('api-token-auth/', obtain_auth_token, name='api_token_auth'),
 ]
 
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Media is not served from MEDIA_URL, even in development: chat attachments are
+# downloaded through the membership-checked api/chat/messages/<id>/media/ view
\ No newline at end of file
@@ -0,0 +1,96 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted sequence."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def latency_summary(seconds):
+    """Summarize latencies given in seconds as milliseconds."""
+    values = [value * 1000 for value in seconds]
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values), 3),
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'max_ms': round(max(values), 3),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def build_report(name, params, results):
+    """Wrap benchmark results with enough metadata to compare runs across commits."""
+    return {
+        'benchmark': name,
+        'revision': _git_revision(),
+        'timestamp': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'params': params,
+        'results': results,
+    }
+
+
+def write_report(report, output=None, stream=None):
+    data = json.dumps(report, indent=2, default=str)
+    if output:
+        with open(output, 'w') as fh:
+            fh.write(data + '\n')
+    else:
+        (stream or sys.stdout).write(data + '\n')
+
+
+@contextmanager
+def isolated_database(on_disk=False):
+    """
+    Run against a throwaway test database and the in-memory channel layer so
+    benchmarks never touch real data and need no network services.
+
+    SQLite test databases live in shared-cache memory, which rejects
+    concurrent writers outright; `on_disk` uses a temporary file instead so
+    multi-threaded benchmarks see normal lock waits.
+    """
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    if on_disk and connection.vendor == 'sqlite':
+        test_settings['NAME'] = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.sqlite3')
+
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}):
+            from channels.layers import channel_layers
+            channel_layers.backends.clear()
+            yield
+            channel_layers.backends.clear()
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
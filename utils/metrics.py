@@ -0,0 +1,199 @@
+"""
+In-process metrics with a Prometheus text-format scrape view.
+
+Recording is lock-free on the hot path: every thread writes to its own shard
+(the event loop thread, each sync executor thread, ...) and shards are only
+merged when the endpoint is scraped. Histograms use fixed buckets, so an
+observation is one bisect and two additions.
+"""
+import hmac
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+from django.http import HttpResponse
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        # Only taken once per thread, when it records its first sample
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._shards_lock:
+                self._shards.append(values)
+            return values
+
+    def _snapshots(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        # dict() copies atomically under the GIL while owner threads keep writing
+        return [dict(shard) for shard in shards]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._render_samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _totals(self):
+        totals = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def _render_samples(self):
+        for labels, value in sorted(self._totals().items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+
+
+class Gauge(Counter):
+    """Additive gauge: threads inc/dec their own shard and the scrape sums them."""
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # One slot per bucket plus +Inf, then sum and count
+            series = shard[labels] = [0] * (len(self.buckets) + 3)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def _render_samples(self):
+        merged = {}
+        for shard in self._snapshots():
+            for labels, series in shard.items():
+                series = list(series)
+                total = merged.setdefault(labels, [0] * len(series))
+                for i, value in enumerate(series):
+                    total[i] += value
+
+        for labels, series in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                label_str = _format_labels(self.labelnames, labels, [('le', _format_value(float(bound)))])
+                yield f'{self.name}_bucket{label_str} {cumulative}'
+            label_str = _format_labels(self.labelnames, labels)
+            yield f'{self.name}_sum{label_str} {_format_value(float(series[-2]))}'
+            yield f'{self.name}_count{label_str} {series[-1]}'
+
+
+class CallbackGauge:
+    """Gauge whose samples are computed at scrape time by `callback()`."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for labels, value in self.callback():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback_gauge(self, name, documentation, callback, labelnames=()):
+        return self.register(CallbackGauge(name, documentation, callback, labelnames))
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def metrics_view(request):
+    # Scrapers authenticate with METRICS_TOKEN. Without one the endpoint is
+    # only open under DEBUG; otherwise it is limited to staff sessions.
+    token = settings.METRICS_TOKEN
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(supplied, token):
+            return HttpResponse(status=401)
+    elif not settings.DEBUG and not getattr(request.user, 'is_staff', False):
+        return HttpResponse(status=403)
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
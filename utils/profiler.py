@@ -0,0 +1,143 @@
+"""
+On-demand sampling profiler for the live ASGI process.
+
+A daemon thread wakes every `interval` seconds, reads the current stack of
+every other thread with sys._current_frames() (the event loop thread and the
+sync executor threads alike) and counts identical stacks. The result is the
+"collapsed stack" format understood by flamegraph.pl, speedscope and
+inferno: one `thread;outer;...;inner count` line per distinct stack.
+
+Overhead is bounded by construction: the profiled threads are never
+instrumented, only inspected between bytecodes, and each sample costs
+O(threads x stack depth), typically 20-200us. At the default 10 ms interval
+that is well under 2% of one core for the duration of the profile, and
+nothing at all when no profile is running. The interval is clamped to
+between 1 ms and the length of the run, runs are capped at
+PROFILER_MAX_SECONDS and only one profile may run at a time. The measured
+sampling cost is returned with every profile in the X-Profile-Overhead
+header.
+"""
+import asyncio
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+
+MIN_INTERVAL = 0.001
+
+_running = threading.Lock()
+
+
+def _frame_label(code):
+    filename = code.co_filename
+    base_dir = str(settings.BASE_DIR)
+    if filename.startswith(base_dir):
+        filename = filename[len(base_dir) + 1:]
+    elif 'site-packages' in filename:
+        filename = filename.split('site-packages', 1)[1].lstrip(os.sep)
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.01):
+        self.interval = max(interval, MIN_INTERVAL)
+        self.stacks = Counter()
+        self.samples = 0
+        self.sampling_time = 0.0
+        self.elapsed = 0.0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _label(self, code):
+        # Code objects live as long as their function, so labels are cached per code
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def sample(self):
+        started = time.perf_counter()
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f'thread-{thread_id}'))
+            self.stacks[';'.join(reversed(stack))] += 1
+
+        self.samples += 1
+        self.sampling_time += time.perf_counter() - started
+
+    def _run(self):
+        started = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            self.sample()
+        self.elapsed = time.perf_counter() - started
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def overhead(self):
+        """Share of one core spent sampling while the profile ran."""
+        return self.sampling_time / self.elapsed if self.elapsed else 0.0
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+@staff_member_required
+async def profile_view(request):
+    try:
+        seconds = float(request.GET.get('seconds', 10))
+        interval = float(request.GET.get('interval_ms', 10)) / 1000
+        # nan and inf parse, but would break the sampler thread's wait
+        if not (math.isfinite(seconds) and math.isfinite(interval)):
+            raise ValueError
+    except ValueError:
+        return JsonResponse({"detail": "seconds and interval_ms must be numbers."}, status=400)
+
+    if not 0 < seconds <= settings.PROFILER_MAX_SECONDS:
+        return JsonResponse({"detail": f"seconds must be between 0 and {settings.PROFILER_MAX_SECONDS}."}, status=400)
+
+    if not _running.acquire(blocking=False):
+        return JsonResponse({"detail": "A profile is already running."}, status=409)
+
+    # Longer would not sample at all, and can overflow the sampler thread's wait
+    profiler = SamplingProfiler(min(interval, seconds))
+    try:
+        profiler.start()
+        # The event loop stays free while the sampler thread runs
+        await asyncio.sleep(seconds)
+    finally:
+        # Joining takes at most one interval plus one sample
+        profiler.stop()
+        _running.release()
+
+    filename = f"profile-{os.getpid()}-{timezone.now():%Y%m%d%H%M%S}.collapsed"
+    response = HttpResponse(profiler.collapsed(), content_type='text/plain; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Profile-Samples'] = str(profiler.samples)
+    response['X-Profile-Overhead'] = f'{profiler.overhead:.4f}'
+    return response
@@ -0,0 +1,62 @@
+"""
+Import-time startup profile.
+
+Cold starts are measured in fresh interpreters, since nothing imported by the
+measuring process may be reused. `cold_start` times a snippet from process
+spawn to exit. `import_profile` runs it under `python -X importtime` and
+returns the self and cumulative import time of every module, which is what
+`manage.py benchstartup` reports per module and per top-level package.
+importtime adds its own overhead, so its totals run higher than the wall
+clock; use them to rank modules, and `cold_start` for the time itself.
+"""
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+
+
+def _run(code, flags=()):
+    # Entry points choose their own settings module
+    env = dict(os.environ)
+    env.pop('DJANGO_SETTINGS_MODULE', None)
+    return subprocess.run(
+        [sys.executable, *flags, '-c', code],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+
+
+def cold_start(code):
+    """Seconds from spawning an interpreter running `code` to its exit."""
+    started = time.perf_counter()
+    _run(code)
+    return time.perf_counter() - started
+
+
+def import_profile(code):
+    """[{module, self_ms, cumulative_ms}] for every module `code` imports, in import order."""
+    stderr = _run(code, flags=('-X', 'importtime')).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            # The header line
+            continue
+        modules.append({
+            'module': module.strip(),
+            'self_ms': int(self_us) / 1000,
+            'cumulative_ms': int(cumulative_us) / 1000,
+        })
+    return modules
+
+
+def package_totals(modules):
+    """Self import time summed per top-level package, largest first."""
+    totals = Counter()
+    for entry in modules:
+        totals[entry['module'].split('.')[0]] += entry['self_ms']
+    return {package: round(ms, 1) for package, ms in totals.most_common()}
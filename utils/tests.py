@@ -0,0 +1,79 @@
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+
+from apps.chat.management.commands.benchstartup import TARGETS
+from .startup import import_profile, package_totals
+
+
+class MetricsViewTests(TestCase):
+    url = '/metrics/'
+
+    def setUp(self):
+        override = self.settings(METRICS_TOKEN=None, DEBUG=False)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_closed_without_a_token_outside_debug(self):
+        self.assertEqual(403, self.client.get(self.url).status_code)
+
+        self.client.force_login(User.objects.create_user('alice', password='x'))
+        self.assertEqual(403, self.client.get(self.url).status_code)
+
+    def test_open_to_staff_sessions(self):
+        self.client.force_login(User.objects.create_user('admin', password='x', is_staff=True))
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+    def test_open_under_debug_without_a_token(self):
+        with self.settings(DEBUG=True):
+            self.assertEqual(200, self.client.get(self.url).status_code)
+
+    def test_token_is_required_once_set(self):
+        with self.settings(METRICS_TOKEN='secret', DEBUG=True):
+            self.assertEqual(401, self.client.get(self.url).status_code)
+            self.assertEqual(401, self.client.get(self.url, headers={'Authorization': 'Bearer wrong'}).status_code)
+            self.assertEqual(200, self.client.get(self.url, headers={'Authorization': 'Bearer secret'}).status_code)
+
+            # Even staff sessions need the token
+            self.client.force_login(User.objects.create_user('admin', password='x', is_staff=True))
+            self.assertEqual(401, self.client.get(self.url).status_code)
+
+
+class StartupImportTests(SimpleTestCase):
+    def imported(self, target):
+        return {entry['module'] for entry in import_profile(TARGETS[target])}
+
+    def assertNotImported(self, packages, modules):
+        self.assertEqual(set(), {module for module in modules if module.split('.')[0] in packages})
+
+    def test_asgi_leaves_stripe_and_pillow_for_first_use(self):
+        modules = self.imported('asgi')
+
+        self.assertIn('apps.chat.consumers', modules)
+        self.assertNotImported({'stripe', 'PIL'}, modules)
+
+    def test_first_request_loads_neither_stripe_nor_schema_generation(self):
+        modules = self.imported('asgi_first_request')
+
+        self.assertIn('apps.subscription.views', modules)
+        self.assertNotImported({'stripe'}, modules)
+        self.assertNotIn('drf_yasg.generators', modules)
+
+    def test_realtime_loads_only_the_consumers(self):
+        modules = self.imported('realtime')
+
+        self.assertIn('apps.chat.consumers', modules)
+        self.assertNotImported({'stripe', 'PIL', 'drf_yasg', 'twisted'}, modules)
+        self.assertNotIn('django.contrib.admin', modules)
+
+    def test_package_totals_rank_packages_by_self_time(self):
+        modules = [
+            {'module': 'a', 'self_ms': 1.0, 'cumulative_ms': 5.0},
+            {'module': 'b.x', 'self_ms': 3.0, 'cumulative_ms': 3.0},
+            {'module': 'a.y', 'self_ms': 4.0, 'cumulative_ms': 4.0},
+        ]
+
+        self.assertEqual([('a', 5.0), ('b', 3.0)], list(package_totals(modules).items()))